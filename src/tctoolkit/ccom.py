@@ -24,11 +24,11 @@ from optparse import OptionParser
 
 from pygments.token import Token
 
-from .thirdparty.templet import unicodefunction
+from .thirdparty.templet import unicodefunction, unicodegenerator
 
 from .tctoolkitutil import readJsText, getJsDirPath
 from .tctoolkitutil import SourceCodeTokenizer
-from .tctoolkitutil import FileOrStdout
+from .tctoolkitutil import FileOrStdout, writeChunks
 from .tctoolkitutil import TCApp
 
 try:
@@ -55,7 +55,7 @@ class HtmlCCOMWriter(object):
             jsdir = getJsDirPath()
             # read the text of d3js file
             d3jstext = readJsText(jsdir, ["d3js", "d3.min.js"])
-            outf.write(self.outputHtml(d3jstext))
+            writeChunks(outf, self.outputHtml(d3jstext))
 
     @unicodefunction
     def outputCComScript(self):
@@ -275,7 +275,7 @@ class HtmlCCOMWriter(object):
         # duplication co-occurance matrix data.
         # similar to http://bost.ocks.org/mike/miserables/
 
-    @unicodefunction
+    @unicodegenerator
     def outputHtml(self, d3js_text):
         '''<!DOCTYPE html>
         <html>        
@@ -16,6 +16,10 @@ import string
 import os
 import datetime
 import json
+import sqlite3
+import hashlib
+import itertools
+import multiprocessing
 from optparse import OptionParser
 
 from pygments import highlight
@@ -24,8 +28,23 @@ from pygments.formatters import HtmlFormatter
 from .tctoolkitutil import *
 from .thirdparty.templet import *
 from .codedupdetect import CodeDupDetect
+from .codedupdetect.baselineindex import BaselineIndex
+from .codedupdetect.matchsink import write_report
+from .codedupdetect.blame import create_blame_provider
+from .codedupdetect.sourcelines import SourceLines
 #from exceptions import ImportError
 
+HIGHLIGHT_BATCH_SIZE = 32  # number of fragments highlighted together by each worker process
+
+
+def highlight_fragment(task):
+    '''
+    return syntax highlighted html of (source code, lexer). Run in worker processes.
+    '''
+    source_code, lexer = task
+    formatter = HtmlFormatter(encoding='utf-8')
+    return str(highlight(source_code, lexer, formatter, outfile=None).decode(formatter.encoding))
+
 
 class HtmlWriter(object):
 
@@ -33,27 +52,39 @@ class HtmlWriter(object):
     class to output the duplication information in html format
     '''
 
-    def __init__(self, cddapp):
+    def __init__(self, cddapp, minimum=None, min_lines=None):
         self.cddapp = cddapp
         self.formatter = HtmlFormatter(encoding='utf-8')
+        # only the matches with at least 'minimum' tokens and 'min_lines' lines are reported.
+        self.minimum = minimum
+        self.min_lines = min_lines
+        self.highlighted = dict()  # highlighted html of matchsets (see highlightedMatches)
+        self.jobs = getattr(cddapp.options, 'jobs', 1)
+        self.diskcache = None
+        self.pool = None
+        self.sourcelines = None  # memory mapped source files (see startHighlighter)
 
     def getCssStyle(self):
         return self.formatter.get_style_defs('.highlight')
 
     def getMatches(self):
-        return self.cddapp.getMatches()
+        return self.cddapp.getMatches(self.minimum, self.min_lines)
 
     def write(self, fname, blameflag=False):
         self.blameflag = blameflag
         fname = make_uncpath(fname)
-        with codecs.open(fname, "wb", encoding='utf-8', errors='ignore') as outf:
-            outf.write(self.output())
+        self.startHighlighter()
+        try:
+            with codecs.open(fname, "wb", encoding='utf-8', errors='ignore') as outf:
+                writeChunks(outf, self.output())
+        finally:
+            self.stopHighlighter()
 
     def getCooccuranceData(self):
         '''
         create a co-occurance data in JSON format.
         '''
-        groups, nodes, links = self.cddapp.getCooccuranceData()
+        groups, nodes, links = self.cddapp.getCooccuranceData(self.minimum, self.min_lines)
         nodelist = [None] * len(nodes)
         linklist = list()
         # create a list of node dictionaries
@@ -271,7 +302,7 @@ class HtmlWriter(object):
         # duplication co-occurance matrix data.
         # similar to http://bost.ocks.org/mike/miserables/
 
-    @unicodefunction
+    @unicodegenerator
     def output(self):
         '''<!DOCTYPE html>
         <html>
@@ -316,7 +347,7 @@ class HtmlWriter(object):
                 </div>
                 <div style="margin-top:10px">Goto <a href="#dup_co_ocm">Duplication Cooccurance Matrix</a></div>
                 <div style="margin-top:10px">
-                    ${[self.getMatchHtml(i, match) for i, match in enumerate(self.getMatches())]}
+                    ${[self.getMatchHtml(i, match) for i, match in enumerate(self.highlightedMatches(self.getMatches()))]}
                 </div>
                 <div id="dup_co_ocm">
                     <h1>Duplication Cooccurance Matrix</h1>
@@ -364,8 +395,78 @@ class HtmlWriter(object):
             <li>${match.srcfile()}:${match.getStartLine()}-${match.getStartLine()+match.getLineCount()}: In Revision ${match.getRevisionNumber()} by ${match.getAuthorName()}:</li>
         '''
 
+    def startHighlighter(self):
+        '''
+        open the highlight cache and the source files used by highlightedMatches.
+        '''
+        options = self.cddapp.options
+        cachedir = getattr(options, 'cachedir', None)
+        self.diskcache = DiskCache(cachedir, options.cachesize * 1024 * 1024) if cachedir else None
+        self.sourcelines = SourceLines()
+
+    def stopHighlighter(self):
+        '''
+        stop the worker processes and close the source files. Files must not remain mapped
+        (e.g. comments are inserted in the files after the report is written).
+        '''
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.sourcelines is not None:
+            self.sourcelines.close()
+            self.sourcelines = None
+        self.highlighted.clear()
+
+    def highlightedMatches(self, matches):
+        '''
+        iterate the matchsets. Source of the matchsets is syntax highlighted in batches just
+        before they are rendered (see getSyntaxHighlightedSource). Hence only the html of one
+        batch is in memory.
+        '''
+        batchsize = HIGHLIGHT_BATCH_SIZE * max(1, self.jobs)
+        for start in range(0, len(matches), batchsize):
+            batch = matches[start:start + batchsize]
+            self.highlightBatch(batch)
+            for matchset in batch:
+                yield matchset
+
+    def highlightBatch(self, matches):
+        '''
+        syntax highlight the source of the matchsets. Highlighted html is cached on disk with
+        sha1 of the lexer name and source as key. Fragments not found in the cache are
+        highlighted with a process pool (if jobs > 1).
+        '''
+        tasks = list()
+        for matchset in matches:
+            source_code = ''.join(matchset.getMatchSource(self.sourcelines))
+            lexer = matchset.getSourceLexer()
+            key = hashlib.sha1(('%s\0%s' % (type(lexer).__name__, source_code)).encode('utf-8', 'surrogateescape'))
+            key = 'highlight:' + key.hexdigest()
+            html = self.diskcache.get(key) if self.diskcache is not None else None
+            if html is not None:
+                self.highlighted[matchset] = html
+            else:
+                tasks.append((matchset, key, (source_code, lexer)))
+
+        if self.jobs > 1 and len(tasks) > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(self.jobs)
+            htmls = self.pool.map(highlight_fragment, [task for matchset, key, task in tasks])
+        else:
+            htmls = [highlight_fragment(task) for matchset, key, task in tasks]
+
+        for (matchset, key, task), html in zip(tasks, htmls):
+            self.highlighted[matchset] = html
+            if self.diskcache is not None:
+                self.diskcache.put(key, html)
+
     def getSyntaxHighlightedSource(self, matchset):
-        source_code = ''.join(matchset.getMatchSource())
+        # each matchset is rendered once. Hence its html is released after use.
+        html = self.highlighted.pop(matchset, None)
+        if html is not None:
+            return html
+        source_code = ''.join(matchset.getMatchSource(self.sourcelines))
         highlighted = highlight(source_code, matchset.getSourceLexer(), self.formatter, outfile=None)
         #out of 'highlight' function is string, encoded with 'self.formatter.encoding'. Hence we have to
         #decode it with appropriate encoding and then covert it to unicode.
@@ -376,6 +477,245 @@ class HtmlWriter(object):
         return readJsText(jsdir, ["d3js", "d3.min.js"])
 
 
+class ShardedHtmlWriter(HtmlWriter):
+
+    '''
+    class to output the duplication information as a small index page and 'shard' pages of
+    'shardsize' matches each. Shard pages are written one by one. Hence only the matches of one
+    shard are kept in memory as html. Browser loads the syntax highlighted source only when
+    a shard page is opened from the index.
+    '''
+
+    def __init__(self, cddapp, shardsize, minimum=None, min_lines=None):
+        super(ShardedHtmlWriter, self).__init__(cddapp, minimum, min_lines)
+        self.shardsize = shardsize
+
+    def write(self, fname, blameflag=False):
+        self.blameflag = blameflag
+        fname = make_uncpath(fname)
+        # shard pages are written in '<report name>_files' directory (like 'save as' of browsers)
+        sharddir = os.path.splitext(fname)[0] + '_files'
+        if not os.path.isdir(sharddir):
+            os.makedirs(sharddir)
+        self.sharddir = os.path.basename(sharddir)
+        self.indexname = os.path.basename(fname)
+        matches = self.getMatches()
+        self.numshards = (len(matches) + self.shardsize - 1) // self.shardsize
+
+        with codecs.open(fname, "wb", encoding='utf-8', errors='ignore') as outf:
+            outf.write(self.outputIndexHeader(len(matches)))
+            for i, matchset in enumerate(matches):
+                outf.write(self.getIndexRow(i, matchset))
+            outf.write(self.outputIndexFooter())
+
+        self.startHighlighter()
+        try:
+            for shard in range(self.numshards):
+                shardname = os.path.join(sharddir, self.getShardName(shard))
+                start = shard * self.shardsize
+                shardmatches = self.highlightedMatches(matches[start:start + self.shardsize])
+                with codecs.open(shardname, "wb", encoding='utf-8', errors='ignore') as outf:
+                    outf.write(self.outputShardHeader(shard))
+                    for i, matchset in enumerate(shardmatches, start):
+                        outf.write(self.getMatchHtml(i, matchset))
+                    outf.write(self.outputShardFooter(shard))
+        finally:
+            self.stopHighlighter()
+
+    def getShardName(self, shard):
+        return 'matches_%04d.html' % shard
+
+    def getShardLink(self, shard, text):
+        if 0 <= shard < self.numshards:
+            return '<a href="%s">%s</a>' % (self.getShardName(shard), text)
+        return ''
+
+    @unicodefunction
+    def getIndexRow(self, i, matchset):
+        '''<tr><td><a href="${self.sharddir}/${self.getShardName(i // self.shardsize)}#match_$i">Match ${i+1}</a></td><td>${matchset.matchedlines}</td><td>${len(matchset)}</td><td>${matchset.firstMatch.srcfile()}:${matchset.firstMatch.getStartLine()}</td></tr>
+        '''
+
+    @unicodefunction
+    def outputIndexHeader(self, nummatches):
+        '''<!DOCTYPE html>
+        <html>
+            <head>
+                <meta http-equiv="content-type" content="text/html;charset=utf-8">
+                <style type="text/css">
+                #co_ocm {
+                    margin-top:20px;
+                }
+                #co_ocm .background {
+                    fill: #eee;
+                }
+
+                #co_ocm line {
+                    stroke: #fff;
+                }
+
+                #co_ocm text.active {
+                    fill: red;
+                }
+                 .tooltip {
+                    position:absolute;
+                    z-index: 10;
+                    background-color:#FFFFF0;
+                    padding:3px;
+                    border:2px solid #808080;
+                }
+                .tooltip ul {
+                    list-style-type:none;
+                    padding:3px;
+                    margin:0px;
+                }
+                #matches td {
+                    padding-right:20px;
+                }
+                </style>
+                <script >
+                    ${self.getD3JS()}
+                </script>
+            </head>
+            <body>
+                <div>$nummatches matches in ${self.numshards} pages.
+                Goto <a href="#dup_co_ocm">Duplication Cooccurance Matrix</a></div>
+                <table id="matches" style="margin-top:10px">
+                <tr><th>Match</th><th>Lines</th><th>Files</th><th>First file</th></tr>
+        '''
+
+    @unicodefunction
+    def outputIndexFooter(self):
+        '''
+                </table>
+                <div id="dup_co_ocm">
+                    <h1>Duplication Cooccurance Matrix</h1>
+                    <div id="co_ocm">
+                    </div>
+                </div>
+            </body>
+            <script>
+            ${self.outputCooccurenceMatrix()}
+            </script>
+        </html>
+        '''
+
+    @unicodefunction
+    def outputShardHeader(self, shard):
+        '''<!DOCTYPE html>
+        <html>
+            <head>
+                <meta http-equiv="content-type" content="text/html;charset=utf-8">
+                <style type="text/css">${self.getCssStyle()}</style>
+            </head>
+            <body>
+                <div>${self.getShardLink(shard - 1, 'Previous')}
+                <a href="../${self.indexname}">Index</a>
+                ${self.getShardLink(shard + 1, 'Next')}</div>
+                <div style="margin-top:10px">
+        '''
+
+    @unicodefunction
+    def outputShardFooter(self, shard):
+        '''
+                </div>
+                <div>${self.getShardLink(shard - 1, 'Previous')}
+                <a href="../${self.indexname}">Index</a>
+                ${self.getShardLink(shard + 1, 'Next')}</div>
+            </body>
+        </html>
+        '''
+
+
+class SqliteWriter(object):
+
+    '''
+    class to output the duplication information in an indexed SQLite database. Reports of
+    huge code bases can be queried (e.g. top duplicated directories, clones of a file)
+    without parsing the text or html reports.
+    '''
+    SCHEMA = '''
+        CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, directory TEXT);
+        CREATE TABLE matchsets (id INTEGER PRIMARY KEY, tokens INTEGER, lines INTEGER,
+                                filecount INTEGER, duplicatelines INTEGER);
+        CREATE TABLE matches (matchset_id INTEGER REFERENCES matchsets(id),
+                              file_id INTEGER REFERENCES files(id), startline INTEGER,
+                              endline INTEGER, lines INTEGER, author TEXT, revision TEXT);
+        CREATE TABLE links (file1_id INTEGER REFERENCES files(id),
+                            file2_id INTEGER REFERENCES files(id), lines INTEGER, count INTEGER);
+        CREATE INDEX files_directory ON files(directory);
+        CREATE INDEX matchsets_lines ON matchsets(lines);
+        CREATE INDEX matches_matchset ON matches(matchset_id);
+        CREATE INDEX matches_file ON matches(file_id, startline);
+        CREATE INDEX links_file1 ON links(file1_id);
+        CREATE INDEX links_file2 ON links(file2_id);
+        CREATE VIEW directory_duplication AS
+            SELECT files.directory AS directory, COUNT(DISTINCT matches.matchset_id) AS matchsets,
+                   SUM(matches.lines) AS lines
+            FROM matches JOIN files ON files.id = matches.file_id GROUP BY files.directory;
+    '''
+
+    def __init__(self, cddapp, minimum=None, min_lines=None):
+        self.cddapp = cddapp
+        # only the matches with at least 'minimum' tokens and 'min_lines' lines are written.
+        self.minimum = minimum
+        self.min_lines = min_lines
+        self.fileids = dict()
+
+    def write(self, fname):
+        fname = make_uncpath(fname)
+        if os.path.exists(fname):
+            os.remove(fname)
+        conn = sqlite3.connect(fname)
+        try:
+            conn.executescript(self.SCHEMA)
+            with conn:
+                self.writeMatches(conn)
+                self.writeLinks(conn)
+        finally:
+            conn.close()
+
+    def getFileId(self, conn, path):
+        fileid = self.fileids.get(path)
+        if fileid is None:
+            fileid = len(self.fileids) + 1
+            self.fileids[path] = fileid
+            conn.execute("INSERT INTO files VALUES (?, ?, ?)", (fileid, path, os.path.dirname(path)))
+        return fileid
+
+    def writeMatches(self, conn):
+        dirname = self.cddapp.dirname
+        matchrows = list()
+        for matchsetid, matchset in enumerate(self.cddapp.getMatches(self.minimum, self.min_lines), 1):
+            conn.execute("INSERT INTO matchsets VALUES (?, ?, ?, ?, ?)",
+                         (matchsetid, matchset.matchedtokens, matchset.matchedlines, len(matchset),
+                          matchset.getDuplicateLineCount()))
+            for match in matchset:
+                fileid = self.getFileId(conn, os.path.relpath(match.srcfile(), dirname))
+                revision = match.getRevisionNumber()
+                matchrows.append((matchsetid, fileid, match.getStartLine(),
+                                  match.getStartLine() + match.getLineCount(), match.getLineCount(),
+                                  match.getAuthorName(), None if revision is None else str(revision)))
+        conn.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?)", matchrows)
+
+    def writeLinks(self, conn):
+        '''
+        write the links between files of every pair of matches in a matchset. 'lines' is the
+        total duplicate lines and 'count' is the number of duplicate pairs of the two files.
+        '''
+        dirname = self.cddapp.dirname
+        links = dict()  # key = (file id, file id), value = [lines, count]
+        for matchset in self.cddapp.getMatches(self.minimum, self.min_lines):
+            for match1, match2 in itertools.combinations(sorted(matchset), 2):
+                fileid1 = self.getFileId(conn, os.path.relpath(match1.srcfile(), dirname))
+                fileid2 = self.getFileId(conn, os.path.relpath(match2.srcfile(), dirname))
+                linkinfo = links.setdefault((min(fileid1, fileid2), max(fileid1, fileid2)), [0, 0])
+                linkinfo[0] = linkinfo[0] + match1.getLineCount()
+                linkinfo[1] = linkinfo[1] + 1
+        conn.executemany("INSERT INTO links VALUES (?, ?, ?, ?)",
+                         [(fileid1, fileid2, lines, count)
+                          for (fileid1, fileid2), (lines, count) in links.items()])
+
+
 class CDDApp(TCApp):
 
     '''
@@ -401,9 +741,26 @@ class CDDApp(TCApp):
                     name, ext = os.path.splitext(self.outfile)
                     if ext in set(['.html', '.htm', '.xhtml']):
                         self.options.format = 'html'
+                    elif ext in set(['.db', '.sqlite', '.sqlite3']):
+                        self.options.format = 'sqlite'
+
+            if self.options.format == 'sqlite' and not self.outfile:
+                self.optparser.error("Output file (-o) is required for sqlite format")
 
             self.exclude = self.options.exclude.split(',')
 
+            # detect duplicates once with the smallest thresholds (see writeThresholdReports)
+            self.thresholds = list()
+            if self.options.thresholds:
+                try:
+                    for threshold in self.options.thresholds.split(','):
+                        minimum, min_lines = threshold.split(':')
+                        self.thresholds.append((int(minimum), int(min_lines)))
+                except ValueError:
+                    self.optparser.error("Invalid thresholds %s. Use format like 50:5,100:10" % self.options.thresholds)
+                self.options.chunk = min(minimum for minimum, min_lines in self.thresholds)
+                self.options.min_lines = min(min_lines for minimum, min_lines in self.thresholds)
+
         return success
 
     def _run(self):
@@ -411,21 +768,46 @@ class CDDApp(TCApp):
             runtests()
             return
 
+        self.blameprovider = None
         if (self.options.blame):
+            # raises ImportError if pysvn is required and not installed. git blame processes
+            # are mostly waiting for disk. Hence at least 4 are run concurrently.
+            self.blameprovider = create_blame_provider(
+                self.options.blameprovider, self.args[0], jobs=max(self.options.jobs, 4),
+                cachedir=self.options.cachedir, cachesize=self.options.cachesize * 1024 * 1024)
+
+        if (self.options.hashengine == 'numpy' or self.options.engine == 'suffixarray' or
+                self.options.nearmiss is not None):
             try:
-                import pysvn
+                import numpy
             except ImportError:
-                raise ImportError("Install pysvn module before proceeding")
+                raise ImportError("Install numpy module before proceeding")
 
         #print("pysvn module mandatory for 'Blame' is available")
 
+        if self.options.streamreport:
+            with FileOrStdout(self.outfile) as output:
+                write_report(self.options.streamreport, output)
+            return
+
         self.cdd = self.getCDDInstance()
 
-        if self.options.format.lower() == 'html':
+        if self.options.daemon:
+            self.cdd.serve(self.options.daemon, self.listFiles, interval=self.options.pollinterval)
+            return
+
+        if self.options.saveindex:
+            self.cdd.saveIndex(self.options.saveindex, self.dirname)
+            return
+
+        if self.thresholds:
+            self.writeThresholdReports()
+        elif self.options.format.lower() == 'html':
             # self.cdd.html_output(self.options.filename)
-            htmlwriter = HtmlWriter(self)
+            htmlwriter = self.getHtmlWriter()
             htmlwriter.write(self.outfile, self.options.blame)
-
+        elif self.options.format.lower() == 'sqlite':
+            SqliteWriter(self).write(self.outfile)
         else:
             # assume that format is 'txt'.
             self.printDuplicates(self.outfile)
@@ -438,6 +820,27 @@ class CDDApp(TCApp):
             exactmatch = self.cdd.printmatches(output)
             tm2 = datetime.datetime.now()
 
+    def writeThresholdReports(self):
+        '''
+        write one report for each (minimum tokens, minimum lines) threshold. Duplicates are
+        detected only once with the smallest thresholds. Threshold is added to the output file
+        name (e.g. report-m100-l10.html)
+        '''
+        for minimum, min_lines in self.thresholds:
+            outfile = self.outfile
+            if outfile:
+                name, ext = os.path.splitext(outfile)
+                outfile = '%s-m%d-l%d%s' % (name, minimum, min_lines, ext)
+            if self.options.format.lower() == 'html':
+                htmlwriter = self.getHtmlWriter(minimum, min_lines)
+                htmlwriter.write(outfile, self.options.blame)
+            elif self.options.format.lower() == 'sqlite':
+                SqliteWriter(self, minimum, min_lines).write(outfile)
+            else:
+                with FileOrStdout(outfile) as output:
+                    output.write("\nDuplicates with minimum %d tokens and %d lines\n" % (minimum, min_lines))
+                    self.cdd.printmatches(output, minimum, min_lines)
+
     def foundMatches(self):
         '''
         return true if there is atleast one match found.
@@ -445,20 +848,72 @@ class CDDApp(TCApp):
         matches = self.getMatches()
         return(len(matches) > 0)
 
-    def getMatches(self):
+    def getHtmlWriter(self, minimum=None, min_lines=None):
+        if self.options.shardsize > 0:
+            return ShardedHtmlWriter(self, self.options.shardsize, minimum, min_lines)
+        return HtmlWriter(self, minimum, min_lines)
+
+    def getMatches(self, minimum=None, min_lines=None):
         if(self.matches == None):
             exactmatches = self.cdd.findcopies()
             self.matches = sorted(
                 exactmatches, reverse=True, key=lambda x: x.matchedlines)
+        if minimum is not None or min_lines is not None:
+            return [matches for matches in self.matches
+                    if matches.matchedtokens >= (minimum or 0) and matches.matchedlines >= (min_lines or 0)]
         return(self.matches)
 
-    def getCooccuranceData(self):
-        return self.cdd.getCooccuranceData(self.dirname)
+    def getCooccuranceData(self, minimum=None, min_lines=None):
+        return self.cdd.getCooccuranceData(self.dirname, minimum, min_lines)
+
+    def listFiles(self):
+        '''
+        return the current list of files in the directory (i.e. without the cached file list)
+        '''
+        self.filelist = None
+        return self.getFileList(self.args[0], exclude_dirs=self.exclude)
+
+    def getChangedFiles(self):
+        '''
+        return the absolute paths of all files listed in the 'changed' file (e.g. output of
+        'git diff --name-only'), including the deleted files. Paths in the list are relative to
+        the source directory.
+        '''
+        dirname = self.args[0]
+        if self.options.changed == '-':
+            names = sys.stdin.read().splitlines()
+        else:
+            with open(self.options.changed) as changed:
+                names = changed.read().splitlines()
+        return [os.path.abspath(os.path.join(dirname, name.strip())) for name in names if name.strip()]
 
     def getCDDInstance(self):
-        filelist = self.getFileList(self.args[0], exclude_dirs=self.exclude)
+        baseline = None
+        if self.options.baseline:
+            if not self.options.changed:
+                raise ValueError("List of changed files (--changed) is required with --baseline")
+            baseline = BaselineIndex.load(self.options.baseline)
+            changedfiles = self.getChangedFiles()
+            # deleted files and files not matching the pattern (or language) are not analyzed.
+            srcfiles = set(os.path.abspath(srcfile)
+                           for srcfile in self.getFileList(self.args[0], exclude_dirs=self.exclude))
+            filelist = [srcfile for srcfile in changedfiles if srcfile in srcfiles]
+        else:
+            changedfiles = None
+            filelist = self.getFileList(self.args[0], exclude_dirs=self.exclude)
         return CodeDupDetect(filelist, self.options.chunk, fuzzy=self.options.fuzzy,
-                             min_lines=self.options.min_lines, blameflag=self.options.blame)
+                             min_lines=self.options.min_lines, blameflag=self.options.blame,
+                             jobs=self.options.jobs, cachedir=self.options.cachedir,
+                             cachesize=self.options.cachesize * 1024 * 1024,
+                             hashengine=self.options.hashengine,
+                             hashbits=int(self.options.hashbits), engine=self.options.engine,
+                             lowmemory=self.options.lowmemory, poolfiles=self.options.poolfiles,
+                             poolsize=self.options.poolsize * 1024 * 1024,
+                             diskstore=self.options.diskstore,
+                             filededup=self.options.filededup,
+                             nearmiss=self.options.nearmiss, baseline=baseline,
+                             rootdir=self.args[0], streamfile=self.options.streamfile,
+                             blameprovider=self.blameprovider, changedfiles=changedfiles)
 
 
 def RunMain():
@@ -480,16 +935,66 @@ def createOptionParser():
                       help="Mark duplicate patterns in-source with c-style comment.")
     parser.add_option("-r", "--report", dest="report", default=None,
                       help="Output html to given filename.This is essentially combination '-f html -o <filename>")
+    parser.add_option("", "--shard-size", dest="shardsize", default=0, type="int",
+                      help="Write the html report as an index page and pages of this many matches each (e.g. 100). Use for large reports. Default is single html file.")
     parser.add_option("-f", "--fmt", dest="format", default=None,
-                      help="output file format. If not specified, determined from outputfile extension. Supported : txt, html")
+                      help="output file format. If not specified, determined from outputfile extension. Supported : txt, html, sqlite")
     parser.add_option("-m", "--minimum", dest="chunk", default=10, type="int",
                       help="Minimum token count for matching patterns.")
     parser.add_option("", "--lines", dest="min_lines", default=5, type="int",
                       help="Minimum line count for matched patterns.")
+    parser.add_option("", "--thresholds", dest="thresholds", default=None,
+                      help="Comma separated list of 'minimum tokens:minimum lines' thresholds (e.g. 50:5,100:10,200:20). Duplicates are detected once with the smallest thresholds and one report is written for each threshold. --minimum and --lines are ignored.")
     parser.add_option("-z", "--fuzzy", dest="fuzzy", default=False, action="store_true",
                       help="Enable fuzzy matching (ignore variable names, function names etc).")
+    parser.add_option("", "--parameterized", dest="fuzzy", action="store_const", const='param',
+                      help="Enable parameterized matching. Copies with consistently renamed variables, function names, constants etc are matched. Much faster than --fuzzy on large code bases.")
     parser.add_option("-b", "--blame", dest="blame", default=False, action="store_true",
-                      help="Enable svn blame information output in reports.")
+                      help="Enable blame information (author and revision of duplicates) output in reports.")
+    parser.add_option("", "--blame-provider", dest="blameprovider", default='auto', type="choice",
+                      choices=['auto', 'git', 'svn'],
+                      help="Version control system used for blame. 'auto' uses git if the directory is in a git repository, else svn. Supported : auto, git, svn")
+    parser.add_option("-j", "--jobs", dest="jobs", default=1, type="int",
+                      help="Number of worker processes used for tokenizing the files.")
+    parser.add_option("", "--cache-dir", dest="cachedir", default=None,
+                      help="Directory to cache the tokens of files. Unchanged files are not parsed again.")
+    parser.add_option("", "--cache-size", dest="cachesize", default=1024, type="int",
+                      help="Maximum size of token cache directory in MB.")
+    parser.add_option("", "--engine", dest="engine", default='rabinkarp', type="choice",
+                      choices=['rabinkarp', 'suffixarray'],
+                      help="Duplicate detection algorithm. 'suffixarray' finds maximal repeats using suffix array of all tokens and is not slowed down by highly repetitive code. Supported : rabinkarp, suffixarray")
+    parser.add_option("", "--near-miss", dest="nearmiss", default=None, type="float",
+                      help="Also detect near-miss duplicates (copies with few changed, inserted or deleted tokens). Value is the minimum similarity (0 to 1, e.g. 0.8) of the matched tokens.")
+    parser.add_option("", "--hash-engine", dest="hashengine", default='rolling', type="choice",
+                      choices=['rolling', 'numpy'],
+                      help="Rolling hash implementation. 'numpy' computes hashes of all tokens of a file in one pass. Supported : rolling, numpy")
+    parser.add_option("", "--hash-bits", dest="hashbits", default='24', type="choice",
+                      choices=['24', '64'],
+                      help="Size of rolling hash fingerprint in bits. 64 bit fingerprints reduce false candidate matches on large code bases. Supported : 24, 64")
+    parser.add_option("", "--low-memory", dest="lowmemory", default=False, action="store_true",
+                      help="Read the files twice and store only the repeated hashes. Reduces the memory required for large code bases. Use with --cache-dir to avoid parsing the files twice.")
+    parser.add_option("", "--file-dedup", dest="filededup", default=False, action="store_true",
+                      help="Report files with identical contents as whole file duplicates and analyze only one copy. Faster on code bases with many copied files, but the copies are not reported in the partial matches.")
+    parser.add_option("", "--disk-store", dest="diskstore", default=False, action="store_true",
+                      help="Store the hashes in sorted temporary files on disk instead of memory. Files are read twice. Use with --cache-dir to avoid parsing the files twice.")
+    parser.add_option("", "--pool-files", dest="poolfiles", default=0, type="int",
+                      help="Maximum number of files whose tokens are kept in memory. Other files are loaded again when required (0 means no limit).")
+    parser.add_option("", "--pool-size", dest="poolsize", default=0, type="int",
+                      help="Maximum size in MB of the tokens kept in memory (0 means no limit).")
+    parser.add_option("", "--save-index", dest="saveindex", default=None,
+                      help="Save the tokens and hashes of all files in this baseline index file (e.g. for main branch). Duplicates are not detected.")
+    parser.add_option("", "--baseline", dest="baseline", default=None,
+                      help="Baseline index file created with --save-index. Only the duplicates involving the changed files (see --changed) are detected.")
+    parser.add_option("", "--changed", dest="changed", default=None,
+                      help="File with list of changed files (e.g. output of 'git diff --name-only'), one file per line, relative to the source directory. Use '-' to read the list from stdin.")
+    parser.add_option("", "--daemon", dest="daemon", default=None, type="int",
+                      help="Run as daemon on this localhost port. Files are kept in memory, updated when changed and code fragments or files are searched with JSON requests (GET /status, POST /fragment, /file, /refresh).")
+    parser.add_option("", "--poll-interval", dest="pollinterval", default=2.0, type="float",
+                      help="Seconds between the checks for changed files in daemon mode.")
+    parser.add_option("", "--stream", dest="streamfile", default=None,
+                      help="Write the matches to this JSON Lines file as soon as they are found. Matches are available during long runs and are not lost if the run is aborted.")
+    parser.add_option("", "--stream-report", dest="streamreport", default=None,
+                      help="Create the sorted text report from this JSON Lines file written with --stream. Duplicates are not detected.")
     parser.add_option("-x", "--exclude", dest="exclude", default='',
                       help="Directories to exclude in analysis")
     parser.add_option("", '--test', action="store_true", dest='runtests',
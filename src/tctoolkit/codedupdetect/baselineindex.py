@@ -0,0 +1,160 @@
+'''
+baselineindex.py
+Persisted index of tokens and rolling hashes of all files of a baseline (e.g. main branch).
+Changed files (e.g. files of a pull request) are tokenized and searched in the baseline
+index. Hence only the duplicates involving the changed files are found without analyzing
+the whole code base again.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import pickle
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .matchstore import MatchStore
+from .rabinkarp import RabinKarp
+from .tokentable import TokenValues, TokenTable, TOKEN_INDEX_BITS, TOKEN_INDEX_MASK, make_tokenref
+
+BASELINE_INDEX_VERSION = 2
+
+
+def baseline_key(rhash, tokenid):
+    '''
+    return the key of (rolling hash, token id of first token) stored in the index. hash() of a
+    tuple differs between Python versions and 32/64 bit builds. This key is same everywhere.
+    Hence the index can be created and used on different machines.
+    '''
+    rhash = int(rhash)
+    # fold the 64 bit hashes in 31 bits. 24 bit hashes are unchanged.
+    rhash = (rhash ^ (rhash >> 31)) & 0x7FFFFFFF
+    return (rhash << 32) | (int(tokenid) & 0xFFFFFFFF)
+
+
+class BaselineIndex(object):
+    '''
+    tokens of the baseline files and the sorted postings (hash key and token reference of
+    each window). Source file paths are stored relative to the root directory. Hence the index
+    can be used with a different checkout of the code base.
+    '''
+    def __init__(self, chunk, fuzzy, hashbits):
+        self.params = (BASELINE_INDEX_VERSION, chunk, fuzzy, hashbits)
+        self.srcfiles = list()  # source file paths relative to root directory
+        self.tokenvalues = TokenValues()
+        self.tables = list()  # (token ids, lines, charpos) arrays of each file
+        self.keys = array('q')  # sorted hash keys (see baseline_key)
+        self.refs = array('q')  # token references of the keys
+
+    def checkParams(self, chunk, fuzzy, hashbits):
+        if self.params != (BASELINE_INDEX_VERSION, chunk, fuzzy, hashbits):
+            raise ValueError("Baseline index is created with different options (version, minimum tokens, fuzzy, hash bits) %s"
+                             % (self.params,))
+
+    def save(self, fname):
+        state = dict(params=self.params, srcfiles=self.srcfiles, values=self.tokenvalues.values,
+                     tables=self.tables, keys=self.keys, refs=self.refs)
+        with open(fname, 'wb') as indexfile:
+            pickle.dump(state, indexfile, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, fname):
+        with open(fname, 'rb') as indexfile:
+            state = pickle.load(indexfile)
+        version, chunk, fuzzy, hashbits = state['params']
+        index = cls(chunk, fuzzy, hashbits)
+        index.params = state['params']
+        index.srcfiles = state['srcfiles']
+        for value in state['values']:
+            index.tokenvalues.intern(value)
+        index.tables = state['tables']
+        index.keys = state['keys']
+        index.refs = state['refs']
+        return index
+
+    def filePaths(self, rootdir):
+        '''
+        return the paths of the baseline files in the root directory.
+        '''
+        return [os.path.normpath(os.path.join(rootdir, srcfile)) for srcfile in self.srcfiles]
+
+
+class IndexBuilder(RabinKarp):
+    '''
+    add the files to the baseline index. Duplicates are not detected.
+    '''
+    def __init__(self, chunk, fuzzy=False, tokencache=None, hashengine='rolling', hashbits=24):
+        super(IndexBuilder, self).__init__(chunk, 0, None, fuzzy, tokencache=tokencache,
+                                           hashengine=hashengine, hashbits=hashbits)
+        self.keys = array('q')
+        self.refs = array('q')
+
+    def addFingerprint(self, fingerprint):
+        tokentable = self.addTokenTable(fingerprint)
+        tokenids = tokentable.tokenids
+        for tokenidx, curhash in fingerprint.hashlist():
+            self.keys.append(baseline_key(curhash, self.keyTokenId(tokenids[tokenidx])))
+            self.refs.append(tokentable.tokenref(tokenidx))
+
+    def createIndex(self, rootdir):
+        '''
+        return the BaselineIndex of the added files.
+        '''
+        index = BaselineIndex(self.chunk, self.fuzzy, self.hashbits)
+        index.tokenvalues = self.tokenvalues
+        for fileid, srcfile in enumerate(self.srcfiles):
+            tokentable = self.tokentables[fileid]
+            index.srcfiles.append(os.path.relpath(srcfile, rootdir))
+            index.tables.append((tokentable.tokenids, tokentable.lines, tokentable.charpos))
+        # sort is stable. Hence references of a key remain in the order of files.
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        index.keys = array('q', [self.keys[i] for i in order])
+        index.refs = array('q', [self.refs[i] for i in order])
+        return index
+
+
+class BaselineMatchStore(MatchStore):
+    '''
+    match store which returns the postings of the baseline index along with the hashes of
+    the changed files. Baseline files are added to the detector first (see addBaseline).
+    Baseline version of a changed file is not added and its postings are ignored.
+    '''
+    def __init__(self, minmatch, blameflag, index):
+        super(BaselineMatchStore, self).__init__(minmatch, blameflag)
+        self.index = index
+        self.fileidmap = list()  # file id in the detector for each baseline file id (-1 if ignored)
+
+    def addBaseline(self, detector, rootdir, changedfiles):
+        '''
+        add the token tables of the baseline files which are not changed to the detector.
+        'changedfiles' includes the deleted (or renamed) files. Their baseline version is not added.
+        '''
+        changedfiles = set(os.path.abspath(srcfile) for srcfile in changedfiles)
+        for srcfile, (tokenids, lines, charpos) in zip(self.index.filePaths(rootdir), self.index.tables):
+            if os.path.abspath(srcfile) in changedfiles:
+                self.fileidmap.append(-1)
+            else:
+                fileid = len(detector.srcfiles)
+                detector.registerTokenTable(TokenTable(fileid, srcfile, tokenids, lines, charpos))
+                self.fileidmap.append(fileid)
+
+    def getHashMatch(self, rhash, tokenid):
+        key = baseline_key(rhash, tokenid)
+        start = bisect_left(self.index.keys, key)
+        end = bisect_right(self.index.keys, key, start)
+        fileidmap = self.fileidmap
+        matches = list()
+        for tokenref in self.index.refs[start:end]:
+            fileid = fileidmap[tokenref >> TOKEN_INDEX_BITS]
+            if fileid >= 0:
+                matches.append(make_tokenref(fileid, tokenref & TOKEN_INDEX_MASK))
+        matches.extend(super(BaselineMatchStore, self).getHashMatch(rhash, tokenid) or ())
+        return matches or None
+
+    def getHashCount(self):
+        return len(self.index.keys) + len(self.hashset)
@@ -0,0 +1,213 @@
+'''
+blame.py
+Blame providers for attributing the duplicates to authors and revisions. Blame is computed
+after duplicate detection for all the matches together. Each file is blamed only once for
+all its duplicate fragments.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import hashlib
+import logging
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+
+from tctoolkit.tctoolkitutil import DiskCache, make_uncpath
+
+try:
+    import pysvn
+    from .svn_blame import SvnBlameClient
+    SVN_BLAME_SUPPORT = True
+except ImportError:
+    SVN_BLAME_SUPPORT = False
+
+# change the version whenever format of cached blame data changes.
+BLAME_CACHE_VERSION = 1
+UNCOMMITTED = '0' * 40  # commit id of uncommitted lines in git blame output
+REVISION_SIZE = 12  # number of characters of git commit id reported as revision
+
+
+def fragment_author(blame, startline, endline):
+    '''
+    return (author, revision) which modified most of the lines from startline to endline
+    (inclusive). 'blame' is list of (author, revision) of each line of file.
+    '''
+    counts = dict()
+    # line numbers start from 1 (see Tokenizer)
+    for lineinfo in blame[startline - 1:endline]:
+        counts[lineinfo] = counts.get(lineinfo, 0) + 1
+    if not counts:
+        return (None, None)
+    # ties are resolved on the first line of fragment
+    return max(counts, key=lambda lineinfo: counts[lineinfo])
+
+
+def git_blob_id(srcfile):
+    '''
+    return git object id of the file contents. Same as 'git hash-object' but without
+    running git.
+    '''
+    with open(make_uncpath(srcfile), 'rb') as fobj:
+        contents = fobj.read()
+    sha1 = hashlib.sha1(b'blob %d\0' % len(contents))
+    sha1.update(contents)
+    return sha1.hexdigest()
+
+
+def parse_porcelain(output):
+    '''
+    parse the output of 'git blame --porcelain' and return list of (author, revision) of
+    each line. Author of a commit is given only for its first line in the output.
+    '''
+    authors = dict()
+    blame = list()
+    commit = None
+    # splitlines() also splits on form feed, carriage return etc. in the source lines.
+    lines = output.split('\n')
+    if lines and not lines[-1]:
+        del lines[-1]
+    for line in lines:
+        if line.startswith('\t'):
+            # line contents. Header of next line follows.
+            blame.append((authors.get(commit), commit[:REVISION_SIZE]))
+            commit = None
+        elif commit is None:
+            commit = line.split(' ', 1)[0]
+        elif line.startswith('author '):
+            authors[commit] = line[len('author '):]
+    return blame
+
+
+class BlameProvider(object):
+    '''
+    base class of blame providers. blameFile returns list of (author, revision) of each line
+    of a source file.
+    '''
+    def __init__(self, jobs=1):
+        self.jobs = jobs  # number of files blamed concurrently
+        self.blamed = 0  # number of files blamed (i.e. not found in cache)
+
+    def blameFile(self, srcfile):
+        raise NotImplementedError
+
+    def blameFiles(self, srcfiles):
+        '''
+        return dictionary of source file and its blame list.
+        '''
+        if self.jobs > 1 and len(srcfiles) > 1:
+            pool = ThreadPool(self.jobs)
+            try:
+                return dict(zip(srcfiles, pool.map(self.blameFile, srcfiles)))
+            finally:
+                pool.close()
+                pool.join()
+        return dict((srcfile, self.blameFile(srcfile)) for srcfile in srcfiles)
+
+
+class GitBlameProvider(BlameProvider):
+    '''
+    blame with 'git blame --porcelain' of the local git repository. git processes are run
+    concurrently with a thread pool. Blame of a file is cached on disk with the key
+    (file path, git object id of file contents). Hence unchanged files are not blamed
+    again on the next run.
+    '''
+    def __init__(self, jobs=1, cachedir=None, cachesize=1024 * 1024 * 1024):
+        super(GitBlameProvider, self).__init__(jobs)
+        self.diskcache = DiskCache(cachedir, cachesize) if cachedir else None
+
+    def blameFile(self, srcfile):
+        key = None
+        if self.diskcache is not None:
+            key = 'blame:git:v%d:%s:%s' % (BLAME_CACHE_VERSION, os.path.abspath(srcfile),
+                                          git_blob_id(srcfile))
+            blame = self.diskcache.get(key)
+            if blame is not None:
+                return blame
+
+        srcdir, fname = os.path.split(os.path.abspath(srcfile))
+        try:
+            output = subprocess.check_output(['git', 'blame', '--porcelain', '--', fname],
+                                             cwd=srcdir, stderr=subprocess.PIPE)
+        except (OSError, subprocess.CalledProcessError) as exp:
+            logging.warning("git blame failed for %s : %s" % (srcfile, exp))
+            return list()
+        blame = parse_porcelain(output.decode('utf-8', errors='replace'))
+        self.blamed = self.blamed + 1
+        # blame of uncommitted lines changes after commit without changing the contents.
+        if key is not None and all(revision != UNCOMMITTED[:REVISION_SIZE] for author, revision in blame):
+            self.diskcache.put(key, blame)
+        return blame
+
+
+class SvnBlameProvider(BlameProvider):
+    '''
+    blame with subversion 'annotate' (see SvnBlameClient). Blame of all files is prefetched
+    concurrently. pysvn client is not thread safe. Hence each thread uses its own client.
+    Blame is cached on disk with the key (URL, last changed revision).
+    '''
+    def __init__(self, jobs=1, cachedir=None, cachesize=1024 * 1024 * 1024):
+        super(SvnBlameProvider, self).__init__(jobs)
+        self.diskcache = DiskCache(cachedir, cachesize) if cachedir else None
+        self.local = threading.local()  # svn client of each thread
+        self.lock = threading.Lock()
+
+    def getClient(self):
+        svnclient = getattr(self.local, 'svnclient', None)
+        if svnclient is None:
+            svnclient = SvnBlameClient(diskcache=self.diskcache)
+            self.local.svnclient = svnclient
+        return svnclient
+
+    def blameFile(self, srcfile):
+        svnclient = self.getClient()
+        fetched = svnclient.fetched
+        try:
+            blame = svnclient.getBlame(srcfile)
+        except pysvn.ClientError as exp:
+            logging.warning("svn blame failed for %s : %s" % (srcfile, exp))
+            return list()
+        with self.lock:
+            self.blamed = self.blamed + svnclient.fetched - fetched
+        return [(blameinfo.author, blameinfo.revision) for blameinfo in blame]
+
+
+def is_git_repository(dirname):
+    try:
+        subprocess.check_output(['git', 'rev-parse', '--git-dir'], cwd=dirname, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
+def create_blame_provider(name, dirname, jobs=1, cachedir=None, cachesize=1024 * 1024 * 1024):
+    '''
+    create blame provider 'git' or 'svn'. With 'auto', git is used if 'dirname' is in a git
+    repository.
+    '''
+    if name == 'auto':
+        name = 'git' if is_git_repository(dirname) else 'svn'
+    if name == 'git':
+        return GitBlameProvider(jobs, cachedir, cachesize)
+    if not SVN_BLAME_SUPPORT:
+        raise ImportError("Install pysvn module before proceeding")
+    return SvnBlameProvider(jobs, cachedir, cachesize)
+
+
+def attribute_blame(matchsets, provider):
+    '''
+    set the revision info (author, revision) of all matches in the matchsets. Called after the
+    duplicates are detected.
+    '''
+    matchsets = list(matchsets)
+    srcfiles = sorted(set(match.srcfile() for matchset in matchsets for match in matchset))
+    blames = provider.blameFiles(srcfiles)
+    for matchset in matchsets:
+        for match in matchset:
+            match.revisioninfo = fragment_author(blames[match.srcfile()], match.startline, match.endline)
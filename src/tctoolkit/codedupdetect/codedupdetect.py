@@ -16,46 +16,373 @@ import logging
 import tempfile
 import os
 import shutil
+import multiprocessing
+from functools import partial
 from itertools import tee
+from collections import defaultdict
 
 from . import matchstore
+from .diskmatchstore import DiskMatchStore
 from .rabinkarp import RabinKarp
+from .suffixarray import SuffixArrayDetect
+from .nearmiss import NearMissDetect
+from .baselineindex import IndexBuilder, BaselineMatchStore
+from .daemon import DupIndex, DupServer, DEFAULT_POLL_INTERVAL
+from .matchsink import JsonLinesSink
+from .blame import attribute_blame, create_blame_provider
+from .tokencache import TokenCache, load_fingerprint, file_digest
+from tctoolkit.tctoolkitutil import make_uncpath
+
+
+def insert_file_comments(task):
+    '''
+    insert the duplicate marker comments in a source file in one pass. 'task' is tuple of
+    (source file, list of (start line, line count, marker number, info string)). Line numbers
+    are of the original file. Called in the worker processes.
+    '''
+    fn, markers = task
+    # comments to be inserted before each line (END markers first and then BEGIN markers)
+    begins = defaultdict(list)
+    ends = defaultdict(list)
+    for startline, linecount, begin_no, infostring in markers:
+        begins[startline].append('//!DUPLICATE BEGIN %i -- %s\n' % (begin_no, infostring))
+        ends[startline + linecount].append((begin_no, '//!DUPLICATE END %i\n' % begin_no))
+
+    def write_markers(output, lineno):
+        for begin_no, comment in sorted(ends.get(lineno, ()), reverse=True):
+            output.write(comment)
+        for comment in begins.get(lineno, ()):
+            output.write(comment)
+
+    fn = make_uncpath(fn)
+    # write the new contents in the same directory and then replace the file.
+    fd, tmp_source_name = tempfile.mkstemp(prefix='cdd-', dir=os.path.dirname(fn) or None)
+    try:
+        with open(fn, 'r', encoding='utf-8', errors='surrogateescape', newline='') as srcfile, \
+                open(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='') as tmp_source:
+            lineno = 0
+            line = ''
+            for line in srcfile:
+                write_markers(tmp_source, lineno)
+                tmp_source.write(line)
+                lineno = lineno + 1
+            if line and not line.endswith('\n') and (lineno in begins or lineno in ends):
+                tmp_source.write('\n')
+            write_markers(tmp_source, lineno)
+        shutil.copymode(fn, tmp_source_name)
+        os.replace(tmp_source_name, fn)
+    finally:
+        if os.path.exists(tmp_source_name):
+            os.remove(tmp_source_name)
+    return fn
 
 
 class CodeDupDetect(object):
 
-    def __init__(self, filelist, chunk=5, fuzzy=False, min_lines=3, blameflag=False):
+    def __init__(self, filelist, chunk=5, fuzzy=False, min_lines=3, blameflag=False, jobs=1,
+                 cachedir=None, cachesize=1024 * 1024 * 1024, hashengine='rolling',
+                 hashbits=24, engine='rabinkarp', lowmemory=False, poolfiles=0, poolsize=0,
+                 diskstore=False, filededup=False, nearmiss=None, baseline=None, rootdir=None,
+                 streamfile=None, blameprovider=None, changedfiles=None):
         self.chunk = chunk  # minimum number of tokens to be matched.
-        self.matchstore = matchstore.MatchStore(chunk, blameflag)
+        # baseline index (see BaselineIndex). 'filelist' is list of changed files and only the
+        # duplicates involving the changed files are detected. 'rootdir' is root directory of
+        # the baseline files. 'changedfiles' is list of all changed files including the deleted
+        # files. Baseline version of these files is ignored (default is 'filelist').
+        self.baseline = baseline
+        self.rootdir = rootdir
+        self.changedfiles = filelist if changedfiles is None else changedfiles
+        if baseline is not None:
+            baseline.checkParams(chunk, fuzzy, hashbits)
+            self.matchstore = BaselineMatchStore(chunk, blameflag, baseline)
+        elif diskstore:
+            self.matchstore = DiskMatchStore(chunk, blameflag)
+        else:
+            self.matchstore = matchstore.MatchStore(chunk, blameflag, lowmemory)
         self.min_lines = min_lines  # minimum number of lines to match
         self.filelist = filelist
+        self.tokenfiles = filelist  # files analyzed with tokens (i.e. except identical copies)
+        # report identical files as one whole file match without analyzing tokens of the copies.
+        # Copies are not reported in the partial matches of their representative file.
+        self.filededup = filededup
+        self.identicalfiles = list()  # list of (content digest, identical files)
         self.foundcopies = False
         self.fuzzy = fuzzy
+        self.jobs = jobs  # number of worker processes used for tokenizing files
+        self.hashengine = hashengine  # 'rolling' or 'numpy'
+        self.hashbits = hashbits  # size of rolling hash fingerprint (24 or 64 bits)
+        self.engine = engine  # 'rabinkarp' or 'suffixarray'
+        self.lowmemory = lowmemory  # store only the repeated hashes (two pass)
+        self.diskstore = diskstore  # store the hashes on disk (two pass)
+        # maximum number of files and size of token tables kept in memory (0 means no limit)
+        self.poolfiles = poolfiles
+        self.poolsize = poolsize
+        # minimum similarity of near-miss duplicates (None means near-miss detection is off)
+        self.nearmiss = nearmiss
+        # JSON Lines file in which matches are written as soon as they are found (see JsonLinesSink)
+        self.streamfile = streamfile
+        self.sink = None
+        # blame provider (see blame.py) for author/revision of matches. Used after the detection.
+        # With 'blameflag' and no provider, git or svn is selected for the source directory.
+        if blameflag and blameprovider is None and filelist:
+            srcdir = rootdir or os.path.dirname(os.path.abspath(filelist[0]))
+            blameprovider = create_blame_provider('auto', srcdir, jobs=max(jobs, 4), cachedir=cachedir,
+                                                  cachesize=cachesize)
+        self.blameprovider = blameprovider
+        if engine == 'suffixarray':
+            # suffix array engine uses only the tokens. Don't compute the rolling hashes.
+            self.hashengine = None
+        self.tokencache = None
+        self.tokentablepool = None
+        if cachedir:
+            self.tokencache = TokenCache(cachedir, cachesize, chunk, fuzzy, self.hashengine,
+                                         hashbits)
 
     def __find_rk_copies(self):
         '''
         detect exact copies using the RabinKarp algorithm
         '''
-        totalfiles = len(self.filelist)
+        rk = RabinKarp(self.chunk, self.min_lines, self.matchstore, self.fuzzy,
+                       tokencache=self.tokencache, hashengine=self.hashengine,
+                       hashbits=self.hashbits, poolfiles=self.poolfiles, poolbytes=self.poolsize)
+        self.tokentablepool = rk.tokentables
+        try:
+            if self.lowmemory or self.diskstore:
+                # first pass to find the repeated hashes or to write the hashes to disk.
+                self.__add_files(rk, rk.countHashes)
+                self.matchstore.buildIndex()
+            self.__add_files(rk, rk.addFingerprint)
+        finally:
+            self.matchstore.close()
+        self.__find_near_miss(rk)
+        self.__add_identical_files(rk)
+        print("Total Hashes Stored %d\n" % self.matchstore.getHashCount())
+        if self.lowmemory:
+            print("Hashes pruned by repeat filter %d\n" % self.matchstore.prunedhashes)
+        if self.poolfiles or self.poolsize:
+            pool = self.tokentablepool
+            print("Token table pool hits %d, misses %d, evictions %d\n" %
+                  (pool.hits, pool.misses, pool.evictions))
+        print("Candidate matches verified %d, false positives %d, tokens compared %d\n" %
+              (rk.candidates, rk.falsepositives, rk.tokenswalked))
+        print("Candidate matches skipped (covered by verified clones) %d\n" % rk.skipped)
+        self.__print_cache_stats()
 
-        rk = RabinKarp(self.chunk, self.min_lines, self.matchstore, self.fuzzy)
+        self.foundcopies = True
 
-        for i, srcfile in enumerate(self.filelist):
-            print("Analyzing file %s (%d of %d)" % (srcfile, i + 1, totalfiles))
-            logging.info("Analyzing file %s (%d of %d)" %
-                         (srcfile, i + 1, totalfiles))
-            rk.addAllTokens(srcfile)
-        print("Total Hashes Stored %d\n" % len(self.matchstore.hashset))
+    def __find_sa_copies(self):
+        '''
+        detect exact copies as maximal repeats using suffix array of tokens of all files.
+        '''
+        sa = SuffixArrayDetect(self.chunk, self.min_lines, self.matchstore, self.fuzzy,
+                               tokencache=self.tokencache, hashengine=self.hashengine,
+                               hashbits=self.hashbits)
+        self.__add_files(sa, sa.addFingerprint)
+        sa.findAllMatches()
+        self.__find_near_miss(sa)
+        self.__add_identical_files(sa)
+        print("Total Tokens %d, maximal repeats %d\n" % (sa.numtokens, sa.repeats))
+        self.__print_cache_stats()
 
         self.foundcopies = True
 
+    def __find_baseline_copies(self):
+        '''
+        detect exact copies involving the changed files (i.e. filelist) using the baseline index.
+        '''
+        rk = RabinKarp(self.chunk, self.min_lines, self.matchstore, self.fuzzy,
+                       tokencache=self.tokencache, hashengine=self.hashengine,
+                       hashbits=self.hashbits, tokenvalues=self.baseline.tokenvalues)
+        self.matchstore.addBaseline(rk, self.rootdir, self.changedfiles)
+        self.__add_files(rk, rk.addFingerprint)
+        self.__add_identical_files(rk)
+        print("Baseline files %d, changed files %d\n" % (len(self.baseline.srcfiles), len(self.filelist)))
+        print("Candidate matches verified %d, false positives %d, tokens compared %d\n" %
+              (rk.candidates, rk.falsepositives, rk.tokenswalked))
+        self.__print_cache_stats()
+
+        self.foundcopies = True
+
+    def saveIndex(self, fname, rootdir):
+        '''
+        save the tokens and hashes of all files as the baseline index. Paths of files are
+        stored relative to the 'rootdir'.
+        '''
+        if self.hashengine is None:
+            raise ValueError("Baseline index requires the rolling hashes of 'rabinkarp' engine")
+        builder = IndexBuilder(self.chunk, self.fuzzy, tokencache=self.tokencache,
+                               hashengine=self.hashengine, hashbits=self.hashbits)
+        self.__add_files(builder, builder.addFingerprint)
+        builder.createIndex(rootdir).save(fname)
+        print("Baseline index of %d files saved in %s\n" % (len(builder.srcfiles), fname))
+        self.__print_cache_stats()
+
+    def serve(self, port, listfiles, host='127.0.0.1', interval=DEFAULT_POLL_INTERVAL):
+        '''
+        run the daemon. Tokens and hashes of the files returned by 'listfiles' function are kept
+        in memory and the duplicate queries are answered on http://host:port (see DupQueryHandler)
+        '''
+        dupindex = DupIndex(listfiles, self.chunk, self.min_lines, self.fuzzy,
+                            tokencache=self.tokencache, hashengine=self.hashengine or 'rolling',
+                            hashbits=self.hashbits)
+        counts = dupindex.refresh()
+        print("Indexed %d files. Listening on http://%s:%d\n" % (counts['added'], host, port))
+        server = DupServer((host, port), dupindex, interval)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def __find_near_miss(self, detector):
+        '''
+        detect near-miss copies in the token tables of the exact duplicate detector.
+        '''
+        if self.nearmiss is None:
+            return
+        nearmiss = NearMissDetect(self.chunk, self.min_lines, self.matchstore, self.nearmiss)
+        nearmiss.findMatches(detector.tokentables, len(detector.srcfiles))
+        print("Near-miss fragments %d, candidate pairs %d, verified %d, clones %d\n" %
+              (len(nearmiss.fragments), nearmiss.candidates, nearmiss.verified, nearmiss.clones))
+
+    def __find_identical_files(self):
+        '''
+        group the files with identical contents. Files are compared with size first and
+        then with content digest. Only the first file of each group is analyzed with tokens.
+        '''
+        bysize = defaultdict(list)
+        for srcfile in self.filelist:
+            bysize[os.path.getsize(make_uncpath(srcfile))].append(srcfile)
+
+        copies = set()
+        for samesize in bysize.values():
+            if len(samesize) < 2:
+                continue
+            bydigest = defaultdict(list)
+            for srcfile in samesize:
+                bydigest[file_digest(srcfile)].append(srcfile)
+            for digest, srcfiles in bydigest.items():
+                if len(srcfiles) > 1:
+                    self.identicalfiles.append((digest, srcfiles))
+                    copies.update(srcfiles[1:])
+
+        self.tokenfiles = [srcfile for srcfile in self.filelist if srcfile not in copies]
+        if copies:
+            print("Identical files %d in %d groups\n" % (len(copies) + len(self.identicalfiles),
+                                                         len(self.identicalfiles)))
+
+    def __add_identical_files(self, detector):
+        '''
+        add whole file matches for the groups of identical files.
+        '''
+        for digest, srcfiles in self.identicalfiles:
+            tokentable = detector.getTokenTable(srcfiles[0])
+            if len(tokentable) >= self.chunk and \
+                    tokentable.lines[-1] - tokentable.lines[0] >= self.min_lines:
+                self.matchstore.addIdenticalFiles(digest, tokentable, srcfiles)
+
+    def __add_files(self, detector, addfunc):
+        '''
+        call addfunc with the fingerprint of each file. 'addfunc' is a method of the
+        detector (RabinKarp or SuffixArrayDetect)
+        '''
+        if self.jobs > 1:
+            self.__add_files_parallel(addfunc)
+        else:
+            totalfiles = len(self.tokenfiles)
+            for i, srcfile in enumerate(self.tokenfiles):
+                self.__print_progress(srcfile, i, totalfiles)
+                addfunc(detector.loadFingerprint(srcfile))
+                self.__stream_matches()
+
+    def __print_cache_stats(self):
+        if self.tokencache is not None:
+            print("Token cache hits %d, misses %d\n" %
+                  (self.tokencache.hits, self.tokencache.misses))
+
+    def __add_files_parallel(self, addfunc):
+        '''
+        tokenize the files and compute the rolling hashes in worker processes. Matchstore
+        is updated in this process in the same file order as the serial run. Hence the
+        results are identical to the serial run.
+        '''
+        totalfiles = len(self.tokenfiles)
+        fingerprint_func = partial(load_fingerprint, chunk=self.chunk, fuzzy=self.fuzzy,
+                                   tokencache=self.tokencache, hashengine=self.hashengine,
+                                   hashbits=self.hashbits)
+        # send files in small batches to reduce the inter process communication overhead.
+        chunksize = max(1, min(16, totalfiles // (self.jobs * 4)))
+
+        pool = multiprocessing.Pool(self.jobs)
+        try:
+            for i, (fingerprint, fileinfo) in enumerate(pool.imap(fingerprint_func, self.tokenfiles, chunksize)):
+                self.__print_progress(fingerprint.srcfile, i, totalfiles)
+                if self.tokencache is not None:
+                    self.tokencache.update(fingerprint, fileinfo)
+                addfunc(fingerprint)
+                self.__stream_matches()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def __find_authors(self):
+        '''
+        find author and revision of all matches with the blame provider.
+        '''
+        attribute_blame(self.matchstore.iter_matches(), self.blameprovider)
+        print("Files blamed %d\n" % self.blameprovider.blamed)
+
+    def __stream_matches(self):
+        '''
+        write the matchsets found or extended by the last analyzed file to the stream file.
+        '''
+        if self.sink is not None:
+            self.sink.write(self.matchstore.popUpdated())
+
+    def __print_progress(self, srcfile, i, totalfiles):
+        print("Analyzing file %s (%d of %d)" % (srcfile, i + 1, totalfiles))
+        logging.info("Analyzing file %s (%d of %d)" %
+                     (srcfile, i + 1, totalfiles))
+
     def findcopies(self):
         if self.foundcopies == False:
-            self.__find_rk_copies()
+            if self.streamfile:
+                self.sink = JsonLinesSink(self.streamfile)
+                self.matchstore.trackUpdates()
+            try:
+                if self.filededup:
+                    self.__find_identical_files()
+                if self.baseline is not None:
+                    self.__find_baseline_copies()
+                elif self.engine == 'suffixarray':
+                    self.__find_sa_copies()
+                else:
+                    self.__find_rk_copies()
+                # near-miss, identical files and suffix array matches are found at the end.
+                self.__stream_matches()
+                if self.blameprovider is not None:
+                    self.__find_authors()
+            finally:
+                if self.sink is not None:
+                    self.sink.close()
+                    print("Matches streamed to %s (%d records)\n" % (self.streamfile, self.sink.records))
+                    self.sink = None
         return self.matchstore.iter_matches()
 
-    def printmatches(self, output):
-        exactmatches = self.findcopies()
+    def filtermatches(self, minimum=None, min_lines=None):
+        '''
+        return the matchsets with at least 'minimum' tokens and 'min_lines' lines. Matches are
+        detected once with the smallest thresholds. Reports for larger thresholds are created
+        by filtering the matches.
+        '''
+        exactmatches = list(self.findcopies())
+        if minimum is not None:
+            exactmatches = [matches for matches in exactmatches if matches.matchedtokens >= minimum]
+        if min_lines is not None:
+            exactmatches = [matches for matches in exactmatches if matches.matchedlines >= min_lines]
+        return exactmatches
+
+    def printmatches(self, output, minimum=None, min_lines=None):
+        exactmatches = self.filtermatches(minimum, min_lines)
         # now sort the matches based on the matched line count (in reverse)
         exactmatches = sorted(exactmatches, reverse=True, key=lambda x: x.matchedlines)
         duplicateLineCount = 0
@@ -75,41 +402,39 @@ class CodeDupDetect(object):
         return exactmatches
 
     def insert_comments(self, dirname):
+        '''
+        mark the duplicates in the source files with '//!DUPLICATE BEGIN/END' comments. Markers
+        of all matches in a file are computed in line order and the file is rewritten once.
+        Files are rewritten in parallel with 'jobs' worker processes.
+        '''
+        markers = defaultdict(list)  # key = source file, value = list of (start line, line count, number, info)
         begin_no = 0
         for matches in sorted(self.findcopies(), reverse=True, key=lambda x: x.matchedlines):
-            for match in matches:
+            for match in sorted(matches):
                 fn = match.srcfile()
                 infostring = ' '.join(['%s:%i+%i' % (f.srcfile(), f.getStartLine(), f.getLineCount())
                                        for f in matches if f.srcfile() != fn]).replace(dirname, '')
-                tmp_source = tempfile.NamedTemporaryFile(
-                    mode='wb', delete=False, prefix='cdd-')
-                with open(fn, 'r') as srcfile:
-                    for i in range(match.getStartLine()):
-                        tmp_source.write(srcfile.readline())
-                    comment = '//!DUPLICATE BEGIN %i -- %s\n' % (
-                        begin_no, infostring)
-                    tmp_source.write(comment)
-                    for i in range(match.getLineCount()):
-                        line = srcfile.readline()
-                        tmp_source.write(line)
-                        # with open('/tmp/%i.dup'%begin_no, 'a') as dup:
-                        #    dup.write(line)
-                    comment = '//!DUPLICATE END %i\n' % begin_no
-                    tmp_source.write(comment)
-                    line = srcfile.readline()
-                    while line:
-                        tmp_source.write(line)
-                        line = srcfile.readline()
-                # this should also work on windows
-                tmp_source_name = tmp_source.name
-                tmp_source.close()
-                shutil.copy(tmp_source_name, fn)
+                markers[fn].append((match.getStartLine(), match.getLineCount(), begin_no, infostring))
                 begin_no += 1
 
-    def getCooccuranceData(self, dirname):
+        tasks = sorted(markers.items())
+        if self.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(self.jobs)
+            try:
+                for fn in pool.imap_unordered(insert_file_comments, tasks):
+                    logging.info("Duplicate comments inserted in %s" % fn)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for task in tasks:
+                insert_file_comments(task)
+
+    def getCooccuranceData(self, dirname, minimum=None, min_lines=None):
         '''
         create a co-occurance data in nodes and links list format. Something that can be
-        dumped to json quickly
+        dumped to json quickly. Only the matches with at least 'minimum' tokens and 'min_lines'
+        lines are included.
         '''
         groups = dict()  # key = directory name, value = index
         nodes = dict()  # key = filename, value = index
@@ -148,7 +473,7 @@ class CodeDupDetect(object):
             next(b, None)
             return zip(a, b)
 
-        for matchset in self.findcopies():
+        for matchset in self.filtermatches(minimum, min_lines):
             # for each matchset first add files into the nodes dictionary
             matchset = list(matchset)
             for match in matchset:
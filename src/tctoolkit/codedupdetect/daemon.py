@@ -0,0 +1,279 @@
+'''
+daemon.py
+Long running duplicate detection service for IDE integrations and pre-commit hooks. Tokens
+and hashes of all files are kept in memory and updated incrementally when the files change.
+Code fragments or files are searched in the index with a JSON API on localhost HTTP.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import json
+import time
+import logging
+import threading
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .matchstore import MatchStore
+from .rabinkarp import RabinKarp, CloneCoverage, compute_fingerprint
+from .tokentable import TokenTable, TOKEN_INDEX_BITS, split_tokenref
+from tctoolkit.tctoolkitutil import make_uncpath
+
+DEFAULT_POLL_INTERVAL = 2.0  # seconds between the checks for changed files
+# token values of the old versions of changed files are never removed from the intern table.
+# Index is rebuilt when the table grows to twice its size after the last rebuild.
+MIN_REBUILD_TOKEN_VALUES = 64 * 1024
+
+
+class DupIndex(RabinKarp):
+    '''
+    in memory index of tokens and hashes of the files returned by 'listfiles' function.
+    Changed files get a new file id and the hashes of the old version are removed from the
+    hash buckets (see refresh). All methods are synchronized with 'lock'.
+    Token values and file ids are not reused. Hence the index is rebuilt from the current files
+    when the intern table of token values has doubled (see rebuild).
+    '''
+    def __init__(self, listfiles, chunk, min_lines, fuzzy=False, tokencache=None,
+                 hashengine='rolling', hashbits=24):
+        super(DupIndex, self).__init__(chunk, min_lines, MatchStore(chunk, False), fuzzy,
+                                       tokencache=tokencache, hashengine=hashengine,
+                                       hashbits=hashbits)
+        self.listfiles = listfiles
+        self.filestate = dict()  # srcfile -> ((size, modification time), file id, hash keys)
+        self.lock = threading.RLock()
+        self.rebuildsize = 0  # number of token values after the last rebuild
+        self.rebuilds = 0
+
+    def fileStat(self, srcfile):
+        stat = os.stat(make_uncpath(srcfile))
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def addFile(self, srcfile):
+        '''
+        add (or update) the tokens and hashes of the file.
+        '''
+        with self.lock:
+            self.removeFile(srcfile)
+            filestat = self.fileStat(srcfile)
+            fingerprint = self.loadFingerprint(srcfile)
+            tokentable = self.addTokenTable(fingerprint)
+            tokenids = tokentable.tokenids
+            keys = array('q')
+            # state is set before the hashes are added. Hence removeFile can clean up after errors.
+            self.filestate[srcfile] = (filestat, tokentable.fileid, keys)
+            for tokenidx, curhash in fingerprint.hashlist():
+                tokenid = self.keyTokenId(tokenids[tokenidx])
+                keys.append(hash((curhash, tokenid)))
+                self.matchstore.addHash(curhash, tokenid, tokentable.tokenref(tokenidx))
+
+    def removeFile(self, srcfile):
+        '''
+        remove the tokens and hashes of the file.
+        '''
+        with self.lock:
+            state = self.filestate.pop(srcfile, None)
+            if state is None:
+                return
+            filestat, fileid, keys = state
+            hashset = self.matchstore.hashset
+            for key in set(keys):
+                tokenrefs = hashset.get(key)
+                if tokenrefs is None:
+                    continue
+                tokenrefs = [tokenref for tokenref in tokenrefs if tokenref >> TOKEN_INDEX_BITS != fileid]
+                if tokenrefs:
+                    hashset[key] = tokenrefs
+                else:
+                    del hashset[key]
+            self.tokentables.discard(fileid)
+            del self.fileids[srcfile]
+
+    def refresh(self):
+        '''
+        add the new files, update the changed files and remove the deleted files. Returns
+        the dictionary of number of added, updated and removed files.
+        '''
+        with self.lock:
+            counts = dict(added=0, updated=0, removed=0)
+            srcfiles = set(self.listfiles())
+            for srcfile in [srcfile for srcfile in self.filestate if srcfile not in srcfiles]:
+                self.removeFile(srcfile)
+                counts['removed'] = counts['removed'] + 1
+            for srcfile in sorted(srcfiles):
+                try:
+                    filestat = self.fileStat(srcfile)
+                    state = self.filestate.get(srcfile)
+                    if state is None or state[0] != filestat:
+                        self.addFile(srcfile)
+                        counts['added' if state is None else 'updated'] += 1
+                except Exception as exp:
+                    # e.g. file deleted or being written. It is added again on the next refresh.
+                    logging.warning("cdd daemon: failed to update %s : %s" % (srcfile, exp))
+                    self.removeFile(srcfile)
+            if len(self.tokenvalues) > 2 * max(self.rebuildsize, MIN_REBUILD_TOKEN_VALUES):
+                self.rebuild()
+            return counts
+
+    def rebuild(self):
+        '''
+        recreate the tokens and hashes of the current files with a new intern table of token
+        values. Token values of the removed files and old versions of changed files are dropped.
+        '''
+        with self.lock:
+            srcfiles = sorted(self.filestate)
+            super(DupIndex, self).__init__(self.chunk, self.min_lines, MatchStore(self.chunk, False),
+                                           self.fuzzy, tokencache=self.tokencache,
+                                           hashengine=self.hashengine, hashbits=self.hashbits)
+            self.filestate = dict()
+            for srcfile in srcfiles:
+                try:
+                    self.addFile(srcfile)
+                except Exception as exp:
+                    logging.warning("cdd daemon: failed to update %s : %s" % (srcfile, exp))
+                    self.removeFile(srcfile)
+            self.rebuildsize = len(self.tokenvalues)
+            self.rebuilds = self.rebuilds + 1
+            logging.info("cdd daemon: index rebuilt with %d token values" % self.rebuildsize)
+
+    def status(self):
+        with self.lock:
+            return dict(files=len(self.filestate), hashes=len(self.matchstore.hashset),
+                        tokenvalues=len(self.tokenvalues), rebuilds=self.rebuilds)
+
+    def search(self, fingerprint, excludefileid=None):
+        '''
+        return list of duplicates of the fingerprint (code fragment or file) in the index.
+        Matches in the file with id 'excludefileid' are ignored.
+        '''
+        with self.lock:
+            querytable = TokenTable.fromFingerprint(-1, fingerprint, self.tokenvalues)
+            tokenids = querytable.tokenids
+            lines = querytable.lines
+            coverage = CloneCoverage()
+            results = list()
+            for tokenidx, curhash in fingerprint.hashlist():
+                matches = self.matchstore.getHashMatch(curhash, self.keyTokenId(tokenids[tokenidx]))
+                for tokenref in matches or ():
+                    fileid, tokenidx2 = split_tokenref(tokenref)
+                    if fileid == excludefileid or coverage.isCovered(fileid, tokenidx2 - tokenidx, tokenidx):
+                        continue
+                    tokentable = self.tokentables[fileid]
+                    matchlen, sha1_hash, matchend1, matchend2 = self.findMatchLength(
+                        querytable, tokenidx, tokentable, tokenidx2)
+                    if matchlen < self.chunk:
+                        continue
+                    coverage.add(fileid, tokenidx2 - tokenidx, tokenidx, matchend1)
+                    if lines[matchend1] - lines[tokenidx] >= self.min_lines:
+                        results.append(dict(file=tokentable.srcfile,
+                                            startline=tokentable.lines[tokenidx2],
+                                            endline=tokentable.lines[matchend2],
+                                            querystartline=lines[tokenidx],
+                                            queryendline=lines[matchend1],
+                                            tokens=matchlen))
+            results.sort(key=lambda result: (-result['tokens'], result['file'], result['startline']))
+            return results
+
+    def queryFragment(self, text, filename):
+        '''
+        return duplicates of the code fragment. 'filename' is used to select the lexer.
+        '''
+        fingerprint = compute_fingerprint(filename, self.chunk, self.fuzzy, self.hashengine,
+                                          self.hashbits, text=text)
+        return self.search(fingerprint)
+
+    def queryFile(self, srcfile):
+        '''
+        return duplicates of the current contents of the file in other files of the index.
+        '''
+        fingerprint = compute_fingerprint(srcfile, self.chunk, self.fuzzy, self.hashengine,
+                                          self.hashbits)
+        with self.lock:
+            return self.search(fingerprint, self.fileids.get(srcfile))
+
+
+class DupQueryHandler(BaseHTTPRequestHandler):
+    '''
+    JSON API of the DupIndex
+        GET /status
+        POST /fragment  {"text": code fragment, "filename": file name for selecting lexer}
+        POST /file  {"file": source file path}
+        POST /refresh
+    '''
+    def do_GET(self):
+        if self.path == '/status':
+            self.sendJson(self.server.dupindex.status())
+        else:
+            self.sendJson(dict(error="unknown request %s" % self.path), 404)
+
+    def do_POST(self):
+        dupindex = self.server.dupindex
+        starttime = time.time()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8')) if length else dict()
+            if self.path == '/fragment':
+                result = dict(matches=dupindex.queryFragment(request['text'],
+                                                             request.get('filename', 'fragment.py')))
+            elif self.path == '/file':
+                result = dict(matches=dupindex.queryFile(request['file']))
+            elif self.path == '/refresh':
+                result = dupindex.refresh()
+            else:
+                self.sendJson(dict(error="unknown request %s" % self.path), 404)
+                return
+        except (ValueError, KeyError, OSError) as err:
+            self.sendJson(dict(error=str(err)), 400)
+            return
+        result['elapsed_ms'] = round((time.time() - starttime) * 1000.0, 3)
+        self.sendJson(result)
+
+    def sendJson(self, result, code=200):
+        body = json.dumps(result).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info("cdd daemon: " + format % args)
+
+
+class DupServer(ThreadingHTTPServer):
+    '''
+    HTTP server for the DupIndex queries. Files are checked for changes every
+    'interval' seconds in a background thread.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, dupindex, interval=DEFAULT_POLL_INTERVAL):
+        super(DupServer, self).__init__(address, DupQueryHandler)
+        self.dupindex = dupindex
+        self.interval = interval
+        self.stopwatch = threading.Event()
+        self.watcher = threading.Thread(target=self.watchFiles, name='cdd-watcher')
+        self.watcher.daemon = True
+
+    def watchFiles(self):
+        while not self.stopwatch.wait(self.interval):
+            try:
+                counts = self.dupindex.refresh()
+            except Exception:
+                # keep watching. Error may be temporary (e.g. directory being checked out)
+                logging.exception("cdd daemon: refresh failed")
+                continue
+            if any(counts.values()):
+                logging.info("cdd daemon: files added %(added)d, updated %(updated)d, removed %(removed)d" % counts)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.watcher.start()
+        try:
+            super(DupServer, self).serve_forever(poll_interval)
+        finally:
+            self.stopwatch.set()
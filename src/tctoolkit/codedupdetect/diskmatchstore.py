@@ -0,0 +1,168 @@
+'''
+diskmatchstore.py
+MatchStore with the hash buckets stored on disk. Postings (i.e. hash key and token reference
+of each window) are written in sorted 'runs' in the first pass, merged into one sorted
+postings file and memory mapped. Hence the memory required does not depend on the number
+of windows in the code base.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import mmap
+import heapq
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .matchstore import MatchStore
+from .tokentable import TOKEN_INDEX_BITS
+
+RUN_SIZE = 256 * 1024  # number of postings sorted in memory for one run.
+BLOCK_SIZE = 64 * 1024  # number of postings read/written in one block
+
+
+def read_run(fname, count):
+    '''
+    iterator over (key, tokenref) tuples of a sorted run file. Run file contains 'count'
+    keys followed by 'count' token references.
+    '''
+    with open(fname, 'rb') as keyfile, open(fname, 'rb') as reffile:
+        reffile.seek(count * 8)
+        remaining = count
+        while remaining > 0:
+            blocklen = min(BLOCK_SIZE, remaining)
+            keys = array('q')
+            keys.fromfile(keyfile, blocklen)
+            refs = array('q')
+            refs.fromfile(reffile, blocklen)
+            for posting in zip(keys, refs):
+                yield posting
+            remaining = remaining - blocklen
+
+
+class DiskMatchStore(MatchStore):
+    '''
+    store the hash buckets in memory mapped sorted postings. All postings are added with
+    countHash in first pass. Postings are visible to getHashMatch only up to the file which
+    is currently added with addHash. Hence the results are same as MatchStore.
+    '''
+    def __init__(self, minmatch, blameflag, tmpdir=None, runsize=None):
+        super(DiskMatchStore, self).__init__(minmatch, blameflag)
+        self.tmpdir = tempfile.mkdtemp(prefix='cdd-postings-', dir=tmpdir)
+        self.runsize = runsize or RUN_SIZE
+        self.runs = list()  # list of (run file name, number of postings)
+        self.keybuf = array('q')
+        self.refbuf = array('q')
+        self.numpostings = 0
+        self.mmaps = list()
+        self.keys = None  # sorted keys of all postings (memory mapped)
+        self.refs = None  # token references of the postings (memory mapped)
+        self.maxtokenref = 0  # token references of files after the current file are not visible
+
+    def countHash(self, rhash, tokenid, tokenref):
+        '''
+        first pass. Add the posting of the window.
+        '''
+        self.keybuf.append(hash((rhash, tokenid)))
+        self.refbuf.append(tokenref)
+        if len(self.keybuf) >= self.runsize:
+            self.writeRun()
+
+    def writeRun(self):
+        '''
+        sort the postings in memory and write them to a new run file. Sort is stable. Hence
+        the postings with same key remain in the order of file id and token index.
+        '''
+        keys = self.keybuf
+        refs = self.refbuf
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        fname = os.path.join(self.tmpdir, 'run%d' % len(self.runs))
+        with open(fname, 'wb') as runfile:
+            array('q', [keys[i] for i in order]).tofile(runfile)
+            array('q', [refs[i] for i in order]).tofile(runfile)
+        self.runs.append((fname, len(keys)))
+        self.keybuf = array('q')
+        self.refbuf = array('q')
+
+    def buildIndex(self):
+        '''
+        merge the sorted runs into the postings files and memory map them.
+        '''
+        if len(self.keybuf) > 0:
+            self.writeRun()
+        keyfname = os.path.join(self.tmpdir, 'postings.keys')
+        reffname = os.path.join(self.tmpdir, 'postings.refs')
+        with open(keyfname, 'wb') as keyfile, open(reffname, 'wb') as reffile:
+            keys = array('q')
+            refs = array('q')
+            for key, ref in heapq.merge(*[read_run(fname, count) for fname, count in self.runs]):
+                keys.append(key)
+                refs.append(ref)
+                if len(keys) >= BLOCK_SIZE:
+                    self.numpostings = self.numpostings + len(keys)
+                    keys.tofile(keyfile)
+                    refs.tofile(reffile)
+                    keys = array('q')
+                    refs = array('q')
+            self.numpostings = self.numpostings + len(keys)
+            keys.tofile(keyfile)
+            refs.tofile(reffile)
+
+        for fname, count in self.runs:
+            os.remove(fname)
+        self.runs = list()
+
+        if self.numpostings == 0:
+            # empty file cannot be memory mapped
+            self.keys = array('q')
+            self.refs = array('q')
+            return
+        self.keys = self.mapPostings(keyfname)
+        self.refs = self.mapPostings(reffname)
+
+    def mapPostings(self, fname):
+        with open(fname, 'rb') as postings:
+            mm = mmap.mmap(postings.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        postingsview = view.cast('q')
+        self.mmaps.append((mm, view, postingsview))
+        return postingsview
+
+    def addHash(self, rhash, tokenid, tokenref):
+        '''
+        postings are already added in the first pass. Make the postings of the file of
+        tokenref visible.
+        '''
+        self.maxtokenref = max(self.maxtokenref, ((tokenref >> TOKEN_INDEX_BITS) + 1) << TOKEN_INDEX_BITS)
+
+    def getHashMatch(self, rhash, tokenid):
+        key = hash((rhash, tokenid))
+        start = bisect_left(self.keys, key)
+        end = bisect_right(self.keys, key, start)
+        maxtokenref = self.maxtokenref
+        matches = [tokenref for tokenref in self.refs[start:end].tolist() if tokenref < maxtokenref]
+        return matches or None
+
+    def getHashCount(self):
+        return self.numpostings
+
+    def close(self):
+        '''
+        release the memory mapped postings and remove the temporary files.
+        '''
+        self.keys = None
+        self.refs = None
+        # memory views have to be released before closing the memory map.
+        for mm, view, postingsview in self.mmaps:
+            postingsview.release()
+            view.release()
+            mm.close()
+        self.mmaps = list()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -0,0 +1,64 @@
+'''
+fingerprint.py
+Compact per-file token stream and rolling hashes. Computed in worker processes when
+duplicate detection is run with multiple jobs and sent back to the main process.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+from array import array
+
+
+class FileFingerprint(object):
+    '''
+    token stream and rolling hashes of one source file stored in columns. Token values
+    are stored once per file in 'values' and tokens refer to them by index. Hence the
+    object is small enough to be pickled across process boundaries.
+    '''
+    __slots__ = ['srcfile', 'values', 'valueids', 'tokenids', 'lines', 'charpos',
+                 'hashpos', 'hashes']
+
+    def __init__(self, srcfile):
+        self.srcfile = srcfile
+        self.values = list()
+        self.valueids = dict()
+        self.tokenids = array('i')
+        self.lines = array('i')
+        self.charpos = array('i')
+        # index of first token of the window and rolling hash of the window
+        self.hashpos = array('i')
+        self.hashes = array('q')
+
+    def __getstate__(self):
+        # 'valueids' is required only while adding the tokens. Don't pickle it.
+        return (self.srcfile, self.values, self.tokenids, self.lines, self.charpos,
+                self.hashpos, self.hashes)
+
+    def __setstate__(self, state):
+        (self.srcfile, self.values, self.tokenids, self.lines, self.charpos,
+         self.hashpos, self.hashes) = state
+        self.valueids = None
+
+    def addToken(self, value, lineno, charpos):
+        valueid = self.valueids.get(value)
+        if valueid is None:
+            valueid = len(self.values)
+            self.valueids[value] = valueid
+            self.values.append(value)
+        self.tokenids.append(valueid)
+        self.lines.append(lineno)
+        self.charpos.append(charpos)
+
+    def hashlist(self):
+        '''
+        iterator over (index of first token of window, rolling hash) tuples
+        '''
+        return zip(self.hashpos, self.hashes)
+
+    def __len__(self):
+        return len(self.tokenids)
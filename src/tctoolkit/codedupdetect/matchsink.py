@@ -0,0 +1,89 @@
+'''
+matchsink.py
+Stream the matches to a JSON Lines file while the files are analyzed. On large code bases
+detection takes hours. Streamed matches are available during the run and are not lost
+if the run is aborted. Final sorted report can be created from the stream file.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import json
+import binascii
+
+
+def match_id(key):
+    '''
+    return string id of the matchstore key (sha1 digest or near-miss key tuple)
+    '''
+    if isinstance(key, tuple):
+        return '-'.join(str(part) for part in key)
+    return binascii.hexlify(key).decode('ascii')
+
+
+class JsonLinesSink(object):
+    '''
+    write one JSON record per line for each matchset added or extended. A matchset can get
+    more matches when later files are analyzed. Hence same matchset can be written more than
+    once and the last record of an 'id' is the final one (see read_matches).
+    '''
+    def __init__(self, fname):
+        self.fname = fname
+        self.outfile = open(fname, 'w', encoding='utf-8')
+        self.records = 0
+
+    def write(self, matchsets):
+        '''
+        write the list of (matchstore key, matchset) and flush the file.
+        '''
+        for key, matchset in matchsets:
+            matches = [dict(file=match.srcfile(), startline=match.getStartLine(),
+                            lines=match.getLineCount()) for match in sorted(matchset)]
+            record = dict(id=match_id(key), tokens=matchset.matchedtokens,
+                          lines=matchset.matchedlines, matches=matches)
+            self.outfile.write(json.dumps(record))
+            self.outfile.write('\n')
+            self.records = self.records + 1
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+
+def read_matches(fname):
+    '''
+    return list of final records in the stream file, sorted on matched lines (in reverse).
+    Incomplete last line of an aborted run is ignored.
+    '''
+    records = dict()
+    with open(fname, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['id']] = record
+    return sorted(records.values(), reverse=True, key=lambda record: record['lines'])
+
+
+def write_report(fname, output):
+    '''
+    write the text report (same format as CodeDupDetect.printmatches) of the stream file.
+    '''
+    duplicateLineCount = 0
+    for matchidx, record in enumerate(read_matches(fname), 1):
+        output.write('%s\n' % ('=' * 50))
+        output.write("Match %d:\n" % matchidx)
+        matches = record['matches']
+        duplicateLineCount = duplicateLineCount + \
+            sum(match['lines'] for match in matches) - record['lines']
+        output.write("Found an minimum %d line duplication in %d files.\n" % (record['lines'], len(matches)))
+
+        for match in matches:
+            output.write("Starting at line %d of %s\n" % (match['startline'], match['file']))
+
+    output.write("\n\nTotal Duplicate Lines : %d" % duplicateLineCount)
@@ -11,33 +11,32 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 
 '''
 
-import codecs
 from . import tokenizer
+from .tokentable import TokenTable
 from functools import reduce
-
-try:
-    from .svn_blame import *
-    BLAME_SUPPORT = True
-except:
-    print("svn_blame not found : SVN blame detection for duplicate files is not supported")
-    BLAME_SUPPORT = False
+from tctoolkit.tctoolkitutil.bloomfilter import ScalableBloomFilter
+from .sourcelines import LineIndex
 
 
 class MatchData(object):
     '''
     store the match/duplication data of one instance in a MatchSet
     '''
-    __slots__ = ['matchlen', 'starttoken', 'endtoken', 'revisioninfo']
+    __slots__ = ['matchlen', 'filename', 'fileid', 'startidx', 'endidx', 'startline',
+                 'endline', 'revisioninfo']
 
-    def __init__(self, matchlen, starttoken, endtoken, revisioninfo):
+    def __init__(self, matchlen, tokentable, startidx, endidx, revisioninfo):
         self.matchlen = matchlen
-        assert starttoken[0] == endtoken[0]  # make sure filenames are same
+        # index of starttoken has to be earlier than end token
+        assert startidx <= endidx
+        self.filename = tokentable.srcfile
+        self.fileid = tokentable.fileid
+        self.startidx = startidx
+        self.endidx = endidx
+        self.startline = tokentable.lines[startidx]
+        self.endline = tokentable.lines[endidx]
         # line number of starttoken has to be earlier than end token
-        assert starttoken[1] <= endtoken[1]
-        # file position of starttoken has to be earlier than end token
-        assert starttoken[2] <= endtoken[2]
-        self.starttoken = starttoken
-        self.endtoken = endtoken
+        assert self.startline <= self.endline
         self.revisioninfo = revisioninfo
 
     def __eq__(self, other):
@@ -63,15 +62,15 @@ class MatchData(object):
         return hash(tpl)
 
     def getLineCount(self):
-        lc = self.endtoken.lineno - self.starttoken.lineno
+        lc = self.endline - self.startline
         assert lc >= 0
         return lc
 
     def srcfile(self):
-        return self.starttoken.srcfile
+        return self.filename
 
     def getStartLine(self):
-        return self.starttoken.lineno
+        return self.startline
 
     def getRevisionNumber(self):
         return self.revisioninfo[1]
@@ -85,28 +84,18 @@ class MatchSet(object):
     Store one set of duplicates. Match set contains 'collection' of MatchData.
     Match
     '''
-    def __init__(self, blameflag):
+    def __init__(self):
         self.matchset = set()
         self.firstMatch = None
-        self.svn_blame_client = None
-
-        if BLAME_SUPPORT and blameflag:
-            self.svn_blame_client = SvnBlameClient()
 
-    def addMatch(self, matchlen, matchstart, matchend):
+    def addMatch(self, matchlen, tokentable, startidx, endidx):
         '''
-        add the match information in the match data set
+        add the match information (tokens from startidx to endidx of tokentable) in the
+        match data set. Revision info (author, revision) is set after the detection
+        (see blame.attribute_blame)
         '''
         revisioninfo = (None, None)
-
-        if self.svn_blame_client:
-            startlinenum = matchstart[1]
-            endlinenum = startlinenum + matchend[1]
-            dupFileName = str(matchstart[0])
-            revisioninfo = self.svn_blame_client.findAuthorForFragment(
-                dupFileName, startlinenum, endlinenum)
-
-        matchdata = MatchData(matchlen, matchstart, matchend, revisioninfo)
+        matchdata = MatchData(matchlen, tokentable, startidx, endidx, revisioninfo)
         self.matchset.add(matchdata)
         if self.firstMatch is None:
             self.firstMatch = matchdata
@@ -120,21 +109,33 @@ class MatchSet(object):
         matchdata =min(self.matchset, key=lambda matchdata:matchdata.getLineCount())
         return matchdata.getLineCount()
 
+    @property
+    def matchedtokens(self):
+        '''
+        matched tokens is minimum token count of all matched samples (i.e. the maximal length of
+        the match). Used to report the matches for larger 'minimum token' thresholds.
+        '''
+        return min(matchdata.matchlen for matchdata in self.matchset)
+
     def __len__(self):
         return len(self.matchset)
 
     def __iter__(self):
         return self.matchset.__iter__()
 
-    def getMatchSource(self):
+    def getMatchSource(self, sourcelines=None):
         '''
-        extract the source code from the first file in matchset.
+        extract the source code from the first file in matchset. 'sourcelines' (SourceLines) keeps
+        the files open for reading the source of many matchsets.
         '''
         match = self.firstMatch
-        with codecs.open(match.srcfile(), "rb", encoding='utf-8', errors='ignore') as src:
-            for i in range(match.getStartLine()):
-                src.readline()
-            return [src.readline() for i in range(match.getLineCount())]
+        if sourcelines is not None:
+            return sourcelines.getLines(match.srcfile(), match.getStartLine(), match.getLineCount())
+        index = LineIndex(match.srcfile())
+        try:
+            return index.getLines(match.getStartLine(), match.getLineCount())
+        finally:
+            index.close()
 
     def getSourceLexer(self):
         '''
@@ -151,63 +152,158 @@ class MatchSet(object):
         totallines = reduce(lambda accum, match: accum+match.getLineCount(), self.matchset, 0)
         return totallines - self.matchedlines
 
+class RepeatFilter(object):
+    '''
+    find the hashes which are added more than once using two bloom filters. A hash is added
+    to 'repeated' filter if it is already in 'seen' filter. False positives only mean that
+    some hashes occuring once are not pruned.
+    '''
+    def __init__(self, initial_capacity=1024 * 1024, error_rate=0.1):
+        self.seen = ScalableBloomFilter(initial_capacity, error_rate,
+                                        ScalableBloomFilter.LARGE_SET_GROWTH)
+        self.repeated = ScalableBloomFilter(initial_capacity // 8, error_rate,
+                                            ScalableBloomFilter.LARGE_SET_GROWTH)
+
+    def add(self, key):
+        if self.seen.add(key):
+            self.repeated.add(key)
+
+    def __contains__(self, key):
+        return key in self.repeated
+
+
 class MatchStore(object):
     '''
     store the hashes and duplicates (i.e.matches)
     '''
-    def __init__(self, minmatch, blameflag):
+    def __init__(self, minmatch, blameflag, lowmemory=False):
         self.minmatch = minmatch
         self.blameflag = blameflag
         self.hashset = dict()
         self.matchlist = dict()
+        # in low memory mode, hashes occuring only once are not stored in hashset.
+        self.repeatfilter = RepeatFilter() if lowmemory else None
+        self.prunedhashes = 0
+        # keys of the matchsets added or extended since last popUpdated call (None means
+        # updates are not tracked). Used for streaming the matches (see JsonLinesSink)
+        self.updated = None
+
+    def trackUpdates(self):
+        self.updated = set()
+
+    def markUpdated(self, key):
+        if self.updated is not None:
+            self.updated.add(key)
+
+    def popUpdated(self):
+        '''
+        return list of (key, matchset) of the matchsets added or extended since the last call.
+        '''
+        updated = [(key, self.matchlist[key]) for key in self.updated]
+        self.updated.clear()
+        return updated
 
-    def addHash(self, rhash, duptoken):
-        # create a new hash with (rolling hash value and actual token string)
-        rhash = hash((rhash, duptoken.value))
+    def countHash(self, rhash, tokenid, tokenref):
+        '''
+        first pass of low memory mode. Add the hash to repeat filter.
+        '''
+        self.repeatfilter.add(hash((rhash, tokenid)))
+
+    def buildIndex(self):
+        '''
+        called after the first pass (see countHash). Nothing to do for in memory store.
+        '''
+        pass
+
+    def addHash(self, rhash, tokenid, tokenref):
+        '''
+        add the token reference (i.e. packed file id and token index) of the first token of
+        the window.
+        '''
+        # create a new hash with (rolling hash value and token id of first token)
+        rhash = hash((rhash, tokenid))
+        if self.repeatfilter is not None and rhash not in self.repeatfilter:
+            # hash occurs only once. It can never be a match.
+            self.prunedhashes = self.prunedhashes + 1
+            return
         hashdata = self.hashset.setdefault(rhash, list())
-        hashdata.append(duptoken)
-        self.hashset[rhash] = hashdata
+        hashdata.append(tokenref)
 
-    def getHashMatch(self, rhash, duptoken):
-        # create a new hash with (rolling hash value and actual token string)
-        rhash = hash((rhash, duptoken.value))
+    def getHashMatch(self, rhash, tokenid):
+        # create a new hash with (rolling hash value and token id of first token)
+        rhash = hash((rhash, tokenid))
         return(self.hashset.get(rhash))
 
-    def is_overlapping(self, matchstart1, matchend1, matchstart2, matchend2):
+    def is_overlapping(self, tokentable1, matchstart1, matchend1, tokentable2, matchstart2, matchend2):
         '''
         rare cases we may get an 'overlapping' match for same file (e.g. intializing arrays with 0 on multiple lines)
         such cases detect the overlapp and ignore it. Dont add it as match
         '''
-        assert matchstart1.srcfile == matchend1.srcfile
-        assert matchstart2.srcfile == matchend2.srcfile
-
-        return matchstart1.srcfile  == matchstart2.srcfile and \
-            ((matchstart1.charpos <= matchstart2.charpos and matchstart2.charpos < matchend1.charpos) \
-                or (matchstart1.charpos <= matchend2.charpos and matchend2.charpos < matchend1.charpos) or \
-                (matchstart2.charpos <= matchstart1.charpos and matchstart1.charpos < matchend2.charpos)  \
-                or (matchstart2.charpos <= matchend1.charpos and matchend1.charpos < matchend2.charpos))
+        return tokentable1.fileid == tokentable2.fileid and \
+            ((matchstart1 <= matchstart2 and matchstart2 < matchend1) \
+                or (matchstart1 <= matchend2 and matchend2 < matchend1) or \
+                (matchstart2 <= matchstart1 and matchstart1 < matchend2)  \
+                or (matchstart2 <= matchend1 and matchend1 < matchend2))
             
-    def addExactMatch(self, matchlen, sha1_hash, matchstart1, matchend1, matchstart2, matchend2):
-        # ensure filenames of start and end are same
-        assert matchstart1[0] == matchend1[0]
-        # ensure filenames of start and end are same
-        assert matchstart2[0] == matchend2[0]
+    def addExactMatch(self, matchlen, sha1_hash, tokentable1, matchstart1, matchend1,
+                      tokentable2, matchstart2, matchend2):
+        '''
+        matchstart and matchend are the token indices of first and last matched tokens in
+        the respective token tables.
+        '''
         # ensure matchstart position is less than matchend position
-        assert matchstart1[2] < matchend1[2]
+        assert matchstart1 < matchend1
         # ensure matchstart position is less than matchend position
-        assert matchstart2[2] < matchend2[2]
+        assert matchstart2 < matchend2
         assert matchlen >= self.minmatch
 
-        if not self.is_overlapping(matchstart1, matchend1, matchstart2, matchend2):
+        if not self.is_overlapping(tokentable1, matchstart1, matchend1, tokentable2, matchstart2, matchend2):
             matchset = self.matchlist.get(sha1_hash)
             if matchset is None:
-                matchset = MatchSet(self.blameflag)
-            matchset.addMatch(matchlen, matchstart1, matchend1)
-            matchset.addMatch(matchlen, matchstart2, matchend2)
+                matchset = MatchSet()
+            matchcount = len(matchset)
+            matchset.addMatch(matchlen, tokentable1, matchstart1, matchend1)
+            matchset.addMatch(matchlen, tokentable2, matchstart2, matchend2)
 
             if len(matchset) > 1:
                 self.matchlist[sha1_hash] = matchset
-        
+                if len(matchset) > matchcount:
+                    self.markUpdated(sha1_hash)
+
+    def addNearMissMatch(self, matchlen, tokentable1, matchstart1, matchend1,
+                         tokentable2, matchstart2, matchend2):
+        '''
+        add a near-miss (approximate) match. Token spans are not identical. Hence each
+        near-miss match is a separate matchset of two matches.
+        '''
+        key = ('nearmiss', tokentable1.fileid, matchstart1, tokentable2.fileid, matchstart2)
+        if not self.is_overlapping(tokentable1, matchstart1, matchend1, tokentable2, matchstart2, matchend2):
+            matchset = MatchSet()
+            matchset.addMatch(matchlen, tokentable1, matchstart1, matchend1)
+            matchset.addMatch(matchend2 - matchstart2 + 1, tokentable2, matchstart2, matchend2)
+            self.matchlist[key] = matchset
+            self.markUpdated(key)
+
+    def addIdenticalFiles(self, digest, tokentable, srcfiles):
+        '''
+        add a whole file match for the files with identical contents. 'tokentable' is the
+        token table of the first file. Other files have the same tokens.
+        '''
+        matchlen = len(tokentable)
+        matchset = MatchSet()
+        for srcfile in srcfiles:
+            filetable = TokenTable(None, srcfile, tokentable.tokenids, tokentable.lines,
+                                   tokentable.charpos)
+            matchset.addMatch(matchlen, filetable, 0, matchlen - 1)
+        self.matchlist[digest] = matchset
+        self.markUpdated(digest)
+
+    def getHashCount(self):
+        return len(self.hashset)
+
+    def close(self):
+        pass
+
     def iter_matches(self):
         # print "number hashes : %d" % len(self.hashset)
         return iter(self.matchlist.values())
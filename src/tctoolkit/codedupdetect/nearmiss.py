@@ -0,0 +1,234 @@
+'''
+nearmiss.py
+Near-miss (i.e. approximate) duplicate detection. Copies with few inserted, deleted or
+changed tokens are not found by exact duplicate detection. Token stream of each file is split
+into overlapping fragments. Each fragment is represented by MinHash signature of winnowed
+k-gram fingerprints. Candidate fragment pairs are found by LSH banding of the signatures
+and verified with edit distance of the token ids. Verified fragment pairs are merged
+into clone regions.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+from collections import defaultdict
+
+from .rabinkarp import NUMPY_SUPPORT
+
+if NUMPY_SUPPORT:
+    import numpy
+    from numpy.lib.stride_tricks import sliding_window_view
+
+KGRAM_SIZE = 5  # number of tokens in a k-gram
+WINNOW_SIZE = 4  # number of consecutive k-grams from which one fingerprint is selected
+MIN_FRAGMENT_SIZE = 24  # minimum number of tokens in a fragment
+NUM_BANDS = 16  # LSH bands
+BAND_ROWS = 4  # MinHash values in one band
+MAX_BUCKET_SIZE = 32  # larger LSH buckets are boilerplate code. Ignored.
+FRAGMENT_BLOCK_SIZE = 256  # number of fragments whose MinHash signatures are computed together
+
+
+def edit_distance(seq1, seq2, maxdist):
+    '''
+    edit distance (insert, delete, replace) between two sequences computed with bit-parallel
+    algorithm of Myers (global distance variant by Hyyro). One column of the distance matrix is
+    computed with a few integer operations. Returns maxdist+1 if the distance is more than maxdist.
+    '''
+    toolarge = maxdist + 1
+    if abs(len(seq1) - len(seq2)) > maxdist:
+        return toolarge
+    if seq1 == seq2:
+        return 0
+    if len(seq1) == 0:
+        return len(seq2) if len(seq2) <= maxdist else toolarge
+    peq = dict()  # bit mask of positions of each token in seq1
+    for i, token in enumerate(seq1):
+        peq[token] = peq.get(token, 0) | (1 << i)
+    mask = (1 << len(seq1)) - 1
+    lastbit = 1 << (len(seq1) - 1)
+    posvert = mask
+    negvert = 0
+    score = len(seq1)
+    remaining = len(seq2)
+    for token in seq2:
+        eq = peq.get(token, 0)
+        xvert = eq | negvert
+        xhorz = (((eq & posvert) + posvert) ^ posvert) | eq
+        poshorz = negvert | (~(xhorz | posvert) & mask)
+        neghorz = posvert & xhorz
+        if poshorz & lastbit:
+            score = score + 1
+        elif neghorz & lastbit:
+            score = score - 1
+        remaining = remaining - 1
+        if score - remaining > maxdist:
+            return toolarge
+        poshorz = ((poshorz << 1) | 1) & mask
+        neghorz = (neghorz << 1) & mask
+        posvert = neghorz | (~(xvert | poshorz) & mask)
+        negvert = poshorz & xvert
+    return score if score <= maxdist else toolarge
+
+
+class NearMissDetect(object):
+    '''
+    detect near-miss duplicates in the token tables of the exact duplicate detector
+    (RabinKarp or SuffixArrayDetect). 'similarity' is minimum fraction of tokens of fragment
+    which have to match (i.e. maximum edit distance is (1-similarity)*fragment size)
+    '''
+    def __init__(self, chunk, min_lines, matchstore, similarity=0.8):
+        assert NUMPY_SUPPORT, "numpy is required for NearMissDetect"
+        self.fragmentsize = max(chunk, MIN_FRAGMENT_SIZE)
+        self.stride = max(1, self.fragmentsize // 4)
+        self.min_lines = min_lines
+        self.matchstore = matchstore
+        self.maxdist = int(self.fragmentsize * (1.0 - similarity))
+        rng = numpy.random.RandomState(self.fragmentsize)
+        numhashes = NUM_BANDS * BAND_ROWS
+        # multiply-add hash functions for MinHash. Arithmetic wraps around 2^64.
+        self.hashmult = (rng.randint(1, 2 ** 62, numhashes, dtype=numpy.int64) * 2 + 1).astype(numpy.uint64)
+        self.hashadd = rng.randint(0, 2 ** 62, numhashes, dtype=numpy.int64).astype(numpy.uint64)
+        self.fragments = list()  # list of (file id, start token index)
+        self.candidates = 0  # number of candidate fragment pairs
+        self.verified = 0  # number of fragment pairs within edit distance
+        self.clones = 0  # number of near-miss clone regions found
+
+    def signatures(self, tokenids):
+        '''
+        return (fragment start indices, MinHash signatures of the fragments) for the token ids
+        of a file. Signature of a fragment is min hash over the winnowed fingerprints of the
+        k-grams inside the fragment. Fingerprints are hashed for a block of fragments at a time.
+        Hence the memory used does not depend on the file size.
+        '''
+        numtokens = len(tokenids)
+        ids = numpy.frombuffer(tokenids, dtype=numpy.int32).astype(numpy.uint64)
+        # k-gram hashes (polynomial hash wrapping around 2^64)
+        kgrams = numpy.zeros(numtokens - KGRAM_SIZE + 1, dtype=numpy.uint64)
+        for i in range(KGRAM_SIZE):
+            kgrams = kgrams * numpy.uint64(1000003) + ids[i:numtokens - KGRAM_SIZE + 1 + i]
+        kgrams = kgrams ^ (kgrams >> numpy.uint64(29))
+        # winnowing : minimum of each window of WINNOW_SIZE k-grams is the fingerprint.
+        winnowed = sliding_window_view(kgrams, WINNOW_SIZE).min(axis=1)
+        windowlen = self.fragmentsize - KGRAM_SIZE - WINNOW_SIZE + 2
+        starts = numpy.arange(0, numtokens - self.fragmentsize + 1, self.stride)
+        if starts[-1] != numtokens - self.fragmentsize:
+            starts = numpy.append(starts, numtokens - self.fragmentsize)
+        signatures = numpy.empty((len(starts), len(self.hashmult)), dtype=numpy.uint64)
+        for block in range(0, len(starts), FRAGMENT_BLOCK_SIZE):
+            blockstarts = starts[block:block + FRAGMENT_BLOCK_SIZE]
+            first = blockstarts[0]
+            # MinHash of the fingerprints of the block. Duplicate fingerprints don't change the minimum.
+            hashed = self.hashmult[:, None] * winnowed[None, first:blockstarts[-1] + windowlen] + \
+                self.hashadd[:, None]
+            windows = sliding_window_view(hashed, windowlen, axis=1)[:, blockstarts - first]
+            signatures[block:block + len(blockstarts)] = windows.min(axis=2).T
+        return starts.tolist(), signatures
+
+    def findMatches(self, tokentables, numfiles):
+        '''
+        find near-miss duplicates in the token tables of 'numfiles' files and add them to the
+        matchstore. 'tokentables' is indexed by file id (e.g. TokenTablePool). Token tables
+        are not kept. Hence the pool limits are not exceeded.
+        '''
+        buckets = defaultdict(list)
+        for fileid in range(numfiles):
+            tokentable = tokentables[fileid]
+            if len(tokentable) < self.fragmentsize:
+                continue
+            starts, signatures = self.signatures(tokentable.tokenids)
+            for start, signature in zip(starts, signatures):
+                fragmentid = len(self.fragments)
+                self.fragments.append((fileid, start))
+                signature = signature.tobytes()
+                bandlen = BAND_ROWS * 8
+                for band in range(NUM_BANDS):
+                    buckets[(band, signature[band * bandlen:(band + 1) * bandlen])].append(fragmentid)
+
+        pairs = set()
+        for fragmentids in buckets.values():
+            if 1 < len(fragmentids) <= MAX_BUCKET_SIZE:
+                for i, fragmentid1 in enumerate(fragmentids):
+                    for fragmentid2 in fragmentids[i + 1:]:
+                        pairs.add((fragmentid1, fragmentid2))
+        buckets = None
+        pairs = [(fragmentid1, fragmentid2) for fragmentid1, fragmentid2 in sorted(pairs)
+                 if not self.isOverlapping(fragmentid1, fragmentid2)]
+
+        # token ids of the candidate fragments. Token tables are loaded from the pool in file order.
+        fragmenttokens = dict()
+        for fragmentid in sorted(set(fragmentid for pair in pairs for fragmentid in pair)):
+            fileid, start = self.fragments[fragmentid]
+            fragmenttokens[fragmentid] = tokentables[fileid].tokenids[start:start + self.fragmentsize]
+
+        verified = list()
+        for fragmentid1, fragmentid2 in pairs:
+            fileid1, start1 = self.fragments[fragmentid1]
+            fileid2, start2 = self.fragments[fragmentid2]
+            self.candidates = self.candidates + 1
+            dist = edit_distance(fragmenttokens[fragmentid1], fragmenttokens[fragmentid2], self.maxdist)
+            if dist <= self.maxdist:
+                self.verified = self.verified + 1
+                verified.append((fileid1, start1, fileid2, start2, dist))
+        fragmenttokens = None
+        self.mergeRegions(verified, tokentables)
+
+    def isOverlapping(self, fragmentid1, fragmentid2):
+        '''
+        return True if the fragments are overlapping parts of the same file.
+        '''
+        fileid1, start1 = self.fragments[fragmentid1]
+        fileid2, start2 = self.fragments[fragmentid2]
+        return fileid1 == fileid2 and abs(start1 - start2) < self.fragmentsize
+
+    def mergeRegions(self, verified, tokentables):
+        '''
+        merge the verified fragment pairs of the same two files into clone regions. Pairs
+        separated by a gap (e.g. inserted statements) of less than half fragment are merged.
+        Regions where all fragment pairs are exact copies on same diagonal are already found
+        by exact duplicate detection.
+        '''
+        byfiles = defaultdict(list)
+        for fileid1, start1, fileid2, start2, dist in verified:
+            byfiles[(fileid1, fileid2)].append((start1, start2, dist))
+
+        maxgap = self.fragmentsize // 2
+        for (fileid1, fileid2), fragpairs in byfiles.items():
+            fragpairs.sort()
+            regions = list()  # open regions [start1, end1, start2, end2, isexact, diagonal, lastdiagonal]
+            for start1, start2, dist in fragpairs:
+                end1 = start1 + self.fragmentsize - 1
+                end2 = start2 + self.fragmentsize - 1
+                diagonal = start2 - start1
+                for region in regions:
+                    if start1 <= region[1] + maxgap + 1 and region[2] <= start2 <= region[3] + maxgap + 1 \
+                            and abs(diagonal - region[6]) <= maxgap:
+                        region[1] = max(region[1], end1)
+                        region[3] = max(region[3], end2)
+                        region[4] = region[4] and dist == 0 and diagonal == region[5]
+                        region[6] = diagonal
+                        break
+                else:
+                    regions.append([start1, end1, start2, end2, dist == 0, diagonal, diagonal])
+                # regions which cannot be extended further are complete.
+                for region in [region for region in regions if region[1] + maxgap + 1 < start1]:
+                    regions.remove(region)
+                    self.addRegion(tokentables, fileid1, fileid2, region)
+            for region in regions:
+                self.addRegion(tokentables, fileid1, fileid2, region)
+
+    def addRegion(self, tokentables, fileid1, fileid2, region):
+        start1, end1, start2, end2, isexact = region[:5]
+        if isexact:
+            return
+        tokentable1 = tokentables[fileid1]
+        tokentable2 = tokentables[fileid2]
+        if tokentable1.lines[end1] - tokentable1.lines[start1] < self.min_lines or \
+                tokentable2.lines[end2] - tokentable2.lines[start2] < self.min_lines:
+            return
+        self.clones = self.clones + 1
+        self.matchstore.addNearMissMatch(end1 - start1 + 1, tokentable1, start1, end1,
+                                         tokentable2, start2, end2)
@@ -13,12 +13,22 @@ TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
 '''
 import logging
 
+from array import array
+from bisect import bisect_right
 from collections import deque
 from itertools import groupby
 import operator
 import hashlib
 
+try:
+    import numpy
+    NUMPY_SUPPORT = True
+except ImportError:
+    NUMPY_SUPPORT = False
+
 from . import tokenizer
+from .fingerprint import FileFingerprint
+from .tokentable import TokenValues, TokenTable, TokenTablePool, make_tokenref, split_tokenref
 
 HASH_BASE = (256*256*256*256)  #a single token hash value is made up of 4 bytes
 HASH_MOD = 16777619  # make sure it is a prime
@@ -32,6 +42,17 @@ FNV_OFFSET_BASIS = 2166136261
 FNV_PRIME = 16777619
 
 
+# 64 bit fingerprints are made of two 31 bit polynomial hashes with different (base, modulus)
+# pairs. Token hash for 64 bit fingerprints is 64 bit FNV hash.
+WIDE_HASH_PARAMS = [(1000000007, 2147483647), (998244353, 2147483629)]
+WIDE_HASH_SHIFT = 31
+FNV64_OFFSET_BASIS = 14695981039346656037
+FNV64_PRIME = 1099511628211
+
+# initial number of tokens compared in one block while extending a match.
+MATCH_BLOCK_SIZE = 16
+
+
 def int_mod(a, b):
     return (a % b + b) % b
 
@@ -57,6 +78,25 @@ def FNV_hash(str):
     return(fhash)
 
 
+def FNV64_hash(str):
+    '''
+    64 bit FNV hash of the string
+    '''
+    fhash = FNV64_OFFSET_BASIS
+    for ch in str:
+        fhash = ((fhash ^ ord(ch)) * FNV64_PRIME) & 0xFFFFFFFFFFFFFFFF
+    return(fhash)
+
+
+def wide_token_hash(token):
+    '''
+    token hashes for both polynomial hashes of 64 bit fingerprint.
+    '''
+    fhash = FNV64_hash(token)
+    (base1, mod1), (base2, mod2) = WIDE_HASH_PARAMS
+    return fhash % mod1, (fhash >> 32) % mod2
+
+
 class RollingHash(object):
     '''
     separated out rolling hash algorithm so that it can be indepdently tested.
@@ -120,47 +160,491 @@ class RollingHash(object):
         '''
         self.tokenqueue.clear()
         self.curhash = 0
-        
+
+    def computeHashes(self, fingerprint):
+        '''
+        compute rolling hashes of all tokens of the FileFingerprint. Token indices are used as
+        token data in the token queue.
+        '''
+        values = fingerprint.values
+        tokenids = fingerprint.tokenids
+        self.value_func = lambda tokenidx: values[tokenids[tokenidx]]
+        for firstidx, rhash in self.hashes(range(len(tokenids))):
+            fingerprint.hashpos.append(firstidx)
+            fingerprint.hashes.append(rhash)
+
+    def hashes(self, tokens):
+        '''
+        iterate over (firsttoken, rolling hash) tuples for the tokens. At appropriate point, the
+        'first token' is removed from the token queue and the rolling hash is returned. Later new
+        token is added in 'rolling hash'
+        '''
+        self.restart()
+        for token in tokens:
+            if len(self.tokenqueue) > 0:
+                (curhash, thash, firsttoken) = self.firstToken()
+                yield firsttoken, curhash
+            self.addToken(token)
+
+
+class WideRollingHash(RollingHash):
+    '''
+    rolling hash with 64 bit fingerprints. 24 bit hash of RollingHash gives lot of false
+    candidate matches for large code bases. Fingerprint is combination of two independent 31 bit
+    polynomial hashes (see WIDE_HASH_PARAMS).
+    '''
+    def __init__(self, window_size, value_func=lambda tokendata:tokendata.value):
+        super(WideRollingHash, self).__init__(window_size, value_func)
+        (base1, mod1), (base2, mod2) = WIDE_HASH_PARAMS
+        self.rollhashbase1 = pow(base1, self.window_size - 1, mod1)
+        self.rollhashbase2 = pow(base2, self.window_size - 1, mod2)
+        self.hash1 = 0
+        self.hash2 = 0
+
+    def getTokenHash(self, token):
+        return wide_token_hash(token)
+
+    def addToken(self, tokendata):
+        (base1, mod1), (base2, mod2) = WIDE_HASH_PARAMS
+        thash = self.getTokenHash(self.value_func(tokendata))
+        self.hash1 = (self.hash1 * base1 + thash[0]) % mod1
+        self.hash2 = (self.hash2 * base2 + thash[1]) % mod2
+        self.curhash = (self.hash1 << WIDE_HASH_SHIFT) | self.hash2
+        self.tokenqueue.append((thash, tokendata))
+
+        if len(self.tokenqueue) >= self.window_size:
+            self.removeToken()
+        return thash
+
+    def removeToken(self):
+        '''
+        remove first token and update the current hash
+        '''
+        (base1, mod1), (base2, mod2) = WIDE_HASH_PARAMS
+        (thash, firsttoken) = self.tokenqueue.popleft()
+        self.hash1 = (self.hash1 - thash[0] * self.rollhashbase1) % mod1
+        self.hash2 = (self.hash2 - thash[1] * self.rollhashbase2) % mod2
+        self.curhash = (self.hash1 << WIDE_HASH_SHIFT) | self.hash2
+        return firsttoken
+
+    def restart(self):
+        super(WideRollingHash, self).restart()
+        self.hash1 = 0
+        self.hash2 = 0
+
+
+class VectorRollingHash(object):
+    '''
+    computes the same hashes as RollingHash.computeHashes (or WideRollingHash.computeHashes
+    for 64 bit fingerprints) for all windows of a file in one pass using numpy arrays. Each
+    unique token value is hashed only once. Hash of all windows of size 'n' is computed by
+    combining hashes of the windows of size 2^k (i.e. hash(a+b) = hash(a)*HASH_BASE^len(b) + hash(b)).
+    Hence the number of numpy operations is proportional to log(window_size).
+    '''
+    def __init__(self, window_size, hashbits=24):
+        assert window_size > 1
+        assert NUMPY_SUPPORT, "numpy is required for VectorRollingHash"
+        self.window_size = window_size
+        self.hashbits = hashbits
+
+    def tokenHashes(self, fingerprint):
+        '''
+        return list of (base, modulus, token hashes array) for each polynomial hash.
+        '''
+        tokenids = numpy.frombuffer(fingerprint.tokenids, dtype=numpy.int32)
+        if self.hashbits == 64:
+            valuehashes = numpy.array([wide_token_hash(value) for value in fingerprint.values],
+                                      dtype=numpy.int64).reshape(-1, 2)
+            return [(base, mod, valuehashes[:, i][tokenids])
+                    for i, (base, mod) in enumerate(WIDE_HASH_PARAMS)]
+
+        valuehashes = numpy.array([FNV_hash(value) % HASH_BASE % HASH_MOD for value in fingerprint.values],
+                                  dtype=numpy.int64)
+        return [(HASH_BASE, HASH_MOD, valuehashes[tokenids])]
+
+    def combine(self, hashes):
+        '''
+        combine the hashes of the polynomial hashes in a single fingerprint
+        '''
+        if len(hashes) == 1:
+            return hashes[0]
+        return (hashes[0] << WIDE_HASH_SHIFT) | hashes[1]
+
+    def computeHashes(self, fingerprint):
+        '''
+        compute the rolling hashes of all tokens of the FileFingerprint. Windows are same as
+        RollingHash i.e. hashes of first 'window_size-2' partial windows of the first token
+        followed by the hashes of full windows of size 'window_size-1'
+        '''
+        numtokens = len(fingerprint.tokenids)
+        if numtokens < 2:
+            return
+        polyhashes = self.tokenHashes(fingerprint)
+        windowlen = self.window_size - 1
+
+        # partial windows starting at the first token.
+        numpartial = min(windowlen, numtokens - 1)
+        partialhashes = list()
+        for base, mod, tokenhashes in polyhashes:
+            curhash = 0
+            hashes = list()
+            for thash in tokenhashes[:numpartial].tolist():
+                curhash = (curhash * base + thash) % mod
+                hashes.append(curhash)
+            partialhashes.append(numpy.array(hashes, dtype=numpy.int64))
+        fingerprint.hashpos.extend([0] * numpartial)
+        fingerprint.hashes.frombytes(self.combine(partialhashes).tobytes())
+        if numtokens <= windowlen:
+            return
+
+        # the last full window ends at the token before last token.
+        windowhashes = self.combine([self.windowHashes(tokenhashes[:numtokens - 1], windowlen, base, mod)
+                                     for base, mod, tokenhashes in polyhashes])
+        # first full window is already added with the partial windows.
+        fingerprint.hashpos.extend(range(1, len(windowhashes)))
+        fingerprint.hashes.frombytes(windowhashes[1:].astype(numpy.int64).tobytes())
+
+    def windowHashes(self, tokenhashes, windowlen, base, mod):
+        '''
+        return hashes of windows of length windowlen starting at each token. Modulus has to
+        be less than 2^31 so that the products do not overflow 64 bit integers.
+        '''
+        numtokens = len(tokenhashes)
+        result = None
+        resultlen = 0
+        blockhashes = tokenhashes  # hashes of windows of size 'blocklen'
+        blocklen = 1
+        remaining = windowlen
+        while remaining > 0:
+            if remaining & 1:
+                if result is None:
+                    result = blockhashes
+                else:
+                    count = numtokens - resultlen - blocklen + 1
+                    result = (result[:count] * pow(base, blocklen, mod)
+                              + blockhashes[resultlen:resultlen + count]) % mod
+                resultlen = resultlen + blocklen
+            remaining = remaining >> 1
+            if remaining > 0:
+                count = numtokens - 2 * blocklen + 1
+                blockhashes = (blockhashes[:count] * pow(base, blocklen, mod)
+                               + blockhashes[blocklen:blocklen + count]) % mod
+                blocklen = blocklen * 2
+        return result
+
+
+class ParamRollingHash(object):
+    '''
+    rolling hashes of parameterized token streams (see Tokenizer with fuzzy='param'). A
+    parameter token stores the distance to previous occurrence of same name in the file. Inside
+    a window, the parameter whose previous occurrence is before the window start is a first
+    occurrence (i.e. distance 0). Hence value of a token depends on the window start. Each
+    parameter changes to distance 0 only once when the window start passes its previous
+    occurrence. Hence the hash is still updated in constant time per token. Windows are same
+    as RollingHash.
+    '''
+    def __init__(self, window_size, hashbits=24):
+        assert window_size > 1
+        self.window_size = window_size
+        self.hashbits = hashbits
+
+    def polynomials(self):
+        '''
+        return list of (base, modulus, token hash function) for each polynomial hash.
+        '''
+        if self.hashbits == 64:
+            return [(base, mod, lambda value, i=i: wide_token_hash(value)[i])
+                    for i, (base, mod) in enumerate(WIDE_HASH_PARAMS)]
+        return [(HASH_BASE % HASH_MOD, HASH_MOD, lambda value: FNV_hash(value) % HASH_BASE % HASH_MOD)]
+
+    def computeHashes(self, fingerprint):
+        numtokens = len(fingerprint.tokenids)
+        if numtokens < 2:
+            return
+        windowlen = self.window_size - 1
+        values = fingerprint.values
+        tokenids = fingerprint.tokenids
+        distances = [tokenizer.param_distance(value) for value in values]
+        firstvalue = tokenizer.PARAM_TOKEN_PREFIX + '0'
+        # index of next occurrence of the same parameter (-1 if none)
+        nextpos = [-1] * numtokens
+        for tokenidx, tokenid in enumerate(tokenids):
+            distance = distances[tokenid]
+            if distance:
+                nextpos[tokenidx - distance] = tokenidx
+
+        numpartial = min(windowlen, numtokens - 1)
+        numfull = max(0, numtokens - windowlen)
+        polyhashes = list()
+        for base, mod, tokenhash in self.polynomials():
+            # hash of the value and hash of the value if it is a first occurrence in the window.
+            valuehashes = [tokenhash(value) for value in values]
+            firsthash = tokenhash(firstvalue)
+            basehashes = [firsthash if distance is not None else thash
+                          for distance, thash in zip(distances, valuehashes)]
+
+            def windowvalue(tokenidx, windowstart):
+                tokenid = tokenids[tokenidx]
+                distance = distances[tokenid]
+                if distance and tokenidx - distance >= windowstart:
+                    return valuehashes[tokenid]
+                return basehashes[tokenid]
+
+            hashes = list()
+            curhash = 0
+            for tokenidx in range(numpartial):
+                curhash = (curhash * base + windowvalue(tokenidx, 0)) % mod
+                hashes.append(curhash)
+            if numfull > 1:
+                # hash of the full window starting at first token
+                for tokenidx in range(numpartial, windowlen):
+                    curhash = (curhash * base + windowvalue(tokenidx, 0)) % mod
+                topbase = pow(base, windowlen, mod)
+                for start in range(numfull - 1):
+                    # remove the first token. Next occurrence of the first token (if in window)
+                    # becomes first occurrence in the next window.
+                    curhash = curhash * base - basehashes[tokenids[start]] * topbase
+                    nextidx = nextpos[start]
+                    if 0 <= nextidx < start + windowlen:
+                        nextid = tokenids[nextidx]
+                        curhash = curhash - (valuehashes[nextid] - basehashes[nextid]) * \
+                            pow(base, start + windowlen - nextidx, mod)
+                    curhash = (curhash + windowvalue(start + windowlen, start + 1)) % mod
+                    hashes.append(curhash)
+            polyhashes.append(hashes)
+
+        if len(polyhashes) == 1:
+            hashes = polyhashes[0]
+        else:
+            hashes = [(hash1 << WIDE_HASH_SHIFT) | hash2 for hash1, hash2 in zip(*polyhashes)]
+        fingerprint.hashpos.extend([0] * numpartial)
+        fingerprint.hashpos.extend(range(1, len(hashes) - numpartial + 1))
+        fingerprint.hashes.extend(hashes)
+
+
+def create_hash_engine(hashengine, window_size, hashbits=24):
+    '''
+    create the rolling hash engine. 'hashengine' is 'rolling' or 'numpy'. 'hashbits' is 24 or 64.
+    '''
+    if hashengine == 'numpy':
+        return VectorRollingHash(window_size, hashbits)
+    if hashbits == 64:
+        return WideRollingHash(window_size)
+    return RollingHash(window_size)
+
+
+def compute_fingerprint(srcfile, chunk, fuzzy=False, hashengine='rolling', hashbits=24, text=None):
+    '''
+    tokenize the srcfile (or source code 'text') and compute the rolling hashes. Called in the
+    worker processes. Rolling hashes are not computed if hashengine is None.
+    '''
+    fingerprint = FileFingerprint(srcfile)
+    tknzr = tokenizer.Tokenizer(srcfile, fuzzy=fuzzy, text=text)
+    for duptoken in tknzr.get_tokens():
+        fingerprint.addToken(duptoken.value, duptoken.lineno, duptoken.charpos)
+
+    if fuzzy == 'param' and hashengine is not None:
+        ParamRollingHash(chunk, hashbits).computeHashes(fingerprint)
+    elif hashengine is not None:
+        create_hash_engine(hashengine, chunk, hashbits).computeHashes(fingerprint)
+    return fingerprint
+
+
+class CloneCoverage(object):
+    '''
+    token ranges of the current file already covered by verified clones. Ranges are stored
+    in sorted arrays per (partner file id, diagonal). Diagonal is the difference of token
+    indices of the partner file and the current file. A candidate on the same diagonal inside
+    a covered range is a suffix of the verified clone.
+    '''
+    def __init__(self):
+        self.ranges = dict()
+
+    def add(self, fileid, diagonal, startidx, endidx):
+        starts, ends = self.ranges.setdefault((fileid, diagonal), (array('i'), array('i')))
+        pos = bisect_right(starts, startidx)
+        starts.insert(pos, startidx)
+        ends.insert(pos, endidx)
+
+    def isCovered(self, fileid, diagonal, tokenidx):
+        ranges = self.ranges.get((fileid, diagonal))
+        if ranges is None:
+            return False
+        starts, ends = ranges
+        # verified clones on same diagonal never overlap. Hence check only previous range.
+        pos = bisect_right(starts, tokenidx) - 1
+        return pos >= 0 and ends[pos] >= tokenidx
+
+
 class RabinKarp(object):
     '''
     Rabin Karp duplication detection algorithm
     '''
-    def __init__(self, chunk, min_lines, matchstore, fuzzy=False, blameflag=False):
+    def __init__(self, chunk, min_lines, matchstore, fuzzy=False, blameflag=False, tokencache=None,
+                 hashengine='rolling', hashbits=24, poolfiles=0, poolbytes=0, tokenvalues=None):
         self.chunk = chunk  # minimum number of tokens to match
         self.min_lines = min_lines  # minimum number of lines to match.
         self.patternsize = self.chunk
         self.matchstore = matchstore
         self.fuzzy = fuzzy
         self.blameflag = blameflag
-        self.tokenizers = dict()
+        self.tokencache = tokencache  # persistent cache of tokens and hashes (optional)
+        self.hashengine = hashengine  # name of the rolling hash engine (see create_hash_engine)
+        self.hashbits = hashbits  # 24 or 64 bit fingerprints
+        # global intern table of token values
+        self.tokenvalues = tokenvalues if tokenvalues is not None else TokenValues()
+        self.srcfiles = list()  # source file of each file id
+        self.numcounted = 0  # number of files added in the first pass (see countHashes)
+        # token tables of recently used files. Index is file id.
+        self.tokentables = TokenTablePool(self.loadTokenTable, poolfiles, poolbytes)
+        self.fileids = dict()  # srcfile to file id map
         self.curfilematches = 0  # number of matches found the current file.
-        self.rollinghash = RollingHash(self.chunk)
-            
+        # statistics of verification of the candidate matches
+        self.candidates = 0  # number of candidate matches verified
+        self.falsepositives = 0  # candidates which do not match even for the hash window size
+        self.tokenswalked = 0  # number of tokens compared while verifying the candidates
+        self.skipped = 0  # candidates not verified since they are covered by verified clones
+        self.coverage = CloneCoverage()  # ranges of current file covered by verified clones
+        # parameterized matching (see ParamRollingHash). distance of parameter token ids
+        # to previous occurrence (-1 for other tokens)
+        self.parameterized = (fuzzy == 'param')
+        self.paramdistances = dict()
+        self.firstparamid = None
+        if self.parameterized:
+            self.firstparamid = self.tokenvalues.intern(tokenizer.PARAM_TOKEN_PREFIX + '0')
+
     def addAllTokens(self, srcfile):
         '''
         add all token in the srcfile to matchstore.
         '''
         #self.curfilematches = 0
+        self.addFingerprint(self.loadFingerprint(srcfile))
+
+        #print("Current number of matches %d" % self.curfilematches)
+
+    def loadFingerprint(self, srcfile):
+        '''
+        return the fingerprint of srcfile from the token cache or by parsing the file.
+        '''
+        if self.tokencache is not None:
+            return self.tokencache.fingerprint(srcfile)
+        return compute_fingerprint(srcfile, self.chunk, self.fuzzy, self.hashengine,
+                                   self.hashbits)
+
+    def loadTokenTable(self, fileid):
+        '''
+        load the token table evicted from the token table pool again.
+        '''
+        srcfile = self.srcfiles[fileid]
+        if self.tokencache is not None:
+            fingerprint = self.tokencache.fingerprint(srcfile)
+        else:
+            # only tokens are required. Don't compute the rolling hashes.
+            fingerprint = compute_fingerprint(srcfile, self.chunk, self.fuzzy, None)
+        return TokenTable.fromFingerprint(fileid, fingerprint, self.tokenvalues)
+
+    def countHashes(self, fingerprint):
+        '''
+        first pass of the low memory mode or disk match store. Count the hashes of the file
+        in the matchstore (see MatchStore.countHash).
+        '''
+        # file ids are assigned in the same order in the second pass (see addTokenTable)
+        fileid = self.numcounted
+        self.numcounted = self.numcounted + 1
+        idmap = [self.tokenvalues.intern(value) for value in fingerprint.values]
+        tokenids = fingerprint.tokenids
+        for tokenidx, curhash in fingerprint.hashlist():
+            self.matchstore.countHash(curhash, self.keyTokenId(idmap[tokenids[tokenidx]]),
+                                      make_tokenref(fileid, tokenidx))
+
+    def addFingerprint(self, fingerprint):
+        '''
+        add the tokens and hashes computed by addAllTokens or by a worker process to matchstore.
+        and detect the matches.
+        '''
+        tokentable = self.addTokenTable(fingerprint)
+        fileid = tokentable.fileid
+
+        tokenids = tokentable.tokenids
         hashlist = list()
-        self.rollinghash.restart()
-        tknzr = self.getTokanizer(srcfile)
-        for token in tknzr:
-            curhash, firsttoken = self.addHashInMatchStore()
-            self.rollinghash.addToken(token)
-            if curhash and firsttoken:
-                hashlist.append((firsttoken, curhash))
+        for tokenidx, curhash in fingerprint.hashlist():
+            self.matchstore.addHash(curhash, self.keyTokenId(tokenids[tokenidx]),
+                                    make_tokenref(fileid, tokenidx))
+            if curhash:
+                hashlist.append((tokenidx, curhash))
 
-        self.detectMatches(hashlist, srcfile)
+        self.detectMatches(hashlist, tokentable)
 
-        #print("Current number of matches %d" % self.curfilematches)
+    def addTokenTable(self, fingerprint):
+        '''
+        create the token table for the fingerprint and assign the next file id to it.
+        '''
+        fileid = len(self.srcfiles)
+        return self.registerTokenTable(TokenTable.fromFingerprint(fileid, fingerprint, self.tokenvalues))
+
+    def registerTokenTable(self, tokentable):
+        '''
+        add the token table with the next file id (e.g. token table loaded from baseline index)
+        '''
+        srcfile = tokentable.srcfile
+        assert srcfile not in self.fileids
+        assert tokentable.fileid == len(self.srcfiles)
+        self.fileids[srcfile] = tokentable.fileid
+        self.srcfiles.append(srcfile)
+        self.tokentables.add(tokentable)
+        return tokentable
+
+    def paramDistance(self, tokenid):
+        '''
+        return the distance of parameter token to its previous occurrence (-1 for other tokens)
+        '''
+        distance = self.paramdistances.get(tokenid)
+        if distance is None:
+            distance = tokenizer.param_distance(self.tokenvalues[tokenid])
+            distance = -1 if distance is None else distance
+            self.paramdistances[tokenid] = distance
+        return distance
+
+    def keyTokenId(self, tokenid):
+        '''
+        token id of the first token of the window used in the hash bucket key. In parameterized
+        mode, a parameter at the window start is always the first occurrence in the window.
+        '''
+        if self.parameterized and self.paramDistance(tokenid) >= 0:
+            return self.firstparamid
+        return tokenid
+
+    def isFirstOccurrence(self, tokenid, matchlen):
+        '''
+        True if the token at the offset 'matchlen' of the match is a parameter whose previous
+        occurrence is before the start of the match.
+        '''
+        distance = self.paramDistance(tokenid)
+        return distance == 0 or distance > matchlen
 
-    def findPossibleMatches(self, hashlist):
+    def spanDigest(self, tokentable, startidx, endidx):
+        '''
+        digest of the matched tokens. In parameterized mode, the first occurrences of the
+        parameters in the span are replaced by distance 0. Hence all parameterized copies have
+        the same digest.
+        '''
+        if not self.parameterized:
+            return tokentable.spanDigest(startidx, endidx)
+        tokenids = tokentable.tokenids[startidx:endidx + 1]
+        for offset, tokenid in enumerate(tokenids):
+            if self.paramDistance(tokenid) > 0 and self.isFirstOccurrence(tokenid, offset):
+                tokenids[offset] = self.firstparamid
+        return hashlib.sha1(tokenids.tobytes()).digest()
+
+    def findPossibleMatches(self, hashlist, tokentable):
         '''
         return location/tokens in current file with possible matches
         '''
+        tokenids = tokentable.tokenids
+
         def possibledup(tokendata):
-            token, thash = tokendata
-            matches = self.matchstore.getHashMatch(thash, token)
+            tokenidx, thash = tokendata
+            matches = self.matchstore.getHashMatch(thash, self.keyTokenId(tokenids[tokenidx]))
 
             bFoundMatch = (matches != None and len(matches) > 1)
             return bFoundMatch
@@ -171,104 +655,146 @@ class RabinKarp(object):
                 if len(matchgroup) > 1:
                     yield matchgroup
 
-    def detectMatches(self, hashlist, srcfile):
+    def detectMatches(self, hashlist, tokentable):
         '''
         detect matches in the hash list of current file.
         '''
-        for matchgroup in self.findPossibleMatches(hashlist):
-            #last duptoken in the each match group is current source file i.e. srcfile
-            starttoken, starthash = matchgroup[0]
-            endtoken, endhash = matchgroup[-1]
-            assert starttoken.srcfile == srcfile
-            assert endtoken.srcfile == srcfile
-            if (endtoken.lineno-starttoken.lineno >= self.min_lines):
-                self.findMatches(starthash, starttoken)
-    
-
-    def addHashInMatchStore(self):
-        '''
-        At appropriate point, the 'first token' is removed from the token queue and then 
-        the rolling hash is added to match store. Later new token is added in 'rolling hash'        
-        '''
-        curhash, firsttoken = None, None
-        if len(self.rollinghash.tokenqueue) > 0:
-            (curhash, thash, firsttoken) = self.rollinghash.firstToken()
-            self.matchstore.addHash(curhash, firsttoken)
-        return curhash, firsttoken
-        
-    def findMatches(self, curhash, tokendata1):
+        lines = tokentable.lines
+        self.coverage = CloneCoverage()
+        for matchgroup in self.findPossibleMatches(hashlist, tokentable):
+            #each match group contains token indices of current file
+            startidx, starthash = matchgroup[0]
+            endidx, endhash = matchgroup[-1]
+            if (lines[endidx] - lines[startidx] >= self.min_lines):
+                self.findMatches(starthash, tokentable.tokenref(startidx))
+
+    def findMatches(self, curhash, tokenref1):
         '''
         search for matches for the current rolling hash in the matchstore.
         If the hash match is found then go for full comparision to search for the match.
         '''
         maxmatchlen = 0
 
-        matches = self.matchstore.getHashMatch(curhash, tokendata1)
+        fileid1, tokenidx1 = split_tokenref(tokenref1)
+        tokentable1 = self.tokentables[fileid1]
+        matches = self.matchstore.getHashMatch(curhash, self.keyTokenId(tokentable1.tokenids[tokenidx1]))
         assert matches != None
-        
-        for tokendata2 in filter(lambda tokendata: tokendata1 != tokendata, matches):
-            matchlen, sha1_hash, match_end1, match_end2 = self.findMatchLength(tokendata1, tokendata2)
+
+        for tokenref2 in filter(lambda tokenref: tokenref1 != tokenref, matches):
+            fileid2, tokenidx2 = split_tokenref(tokenref2)
+            if self.coverage.isCovered(fileid2, tokenidx2 - tokenidx1, tokenidx1):
+                self.skipped = self.skipped + 1
+                continue
+            tokentable2 = self.tokentables[fileid2]
+            matchlen, sha1_hash, match_end1, match_end2 = self.findMatchLength(
+                tokentable1, tokenidx1, tokentable2, tokenidx2)
+            self.candidates = self.candidates + 1
+            # hash window is 'chunk-1' tokens (see RollingHash.hashes)
+            if matchlen < self.chunk - 1:
+                self.falsepositives = self.falsepositives + 1
+            elif matchlen >= self.patternsize:
+                self.coverage.add(fileid2, tokenidx2 - tokenidx1, tokenidx1, match_end1)
 
             # matchlen has to be at least pattern size
             # and matched line count has to be atleast self.min_lines
-            if matchlen >= self.patternsize and (match_end1.lineno - tokendata1.lineno) >= self.min_lines \
-                    and (match_end2.lineno - tokendata2.lineno) >= self.min_lines:
+            if matchlen >= self.patternsize \
+                    and (tokentable1.lines[match_end1] - tokentable1.lines[tokenidx1]) >= self.min_lines \
+                    and (tokentable2.lines[match_end2] - tokentable2.lines[tokenidx2]) >= self.min_lines:
                 # add the exact match to match store.
                 self.matchstore.addExactMatch(
-                    matchlen, sha1_hash, tokendata1, match_end1, tokendata2, match_end2)
+                    matchlen, sha1_hash, tokentable1, tokenidx1, match_end1,
+                    tokentable2, tokenidx2, match_end2)
                 maxmatchlen = max(maxmatchlen, matchlen)
                 self.curfilematches = self.curfilematches + 1
 
         return(maxmatchlen)
 
-    def findMatchLength(self, tokendata1, tokendata2):
+    def findMatchLength(self, tokentable1, tokenidx1, tokentable2, tokenidx2):
         '''
-        find how many tokens (characters) are matching between tokendata1 and tokendata2.
+        find how many tokens are matching between tokenidx1 of tokentable1 and tokenidx2 of
+        tokentable2. Returns (matchlen, sha1 of matched token ids, index of last matched
+        token in tokentable1, index of last matched token in tokentable2)
+
+        Token id arrays are compared in blocks (array slice comparison is done in C). Block
+        size is doubled till a block does not match and then the mismatched token in that
+        block is found by halving the block. In parameterized mode, comparison continues after
+        the mismatched token if both tokens are first occurrences of parameters in the match.
         '''
         matchend1 = None
         matchend2 = None
         matchlen = 0
         sha1_hash = None
 
+        tokenids1 = tokentable1.tokenids
+        tokenids2 = tokentable2.tokenids
+        self.tokenswalked = self.tokenswalked + 1
         # make a basic sanity check token value is same
-        # if the filename is same then distance between the token positions has to be at least patternsize
-        #   and the line numbers cannot be same
-        if(tokendata1.value == tokendata2.value):
-            tknzr1 = self.getTokanizer(tokendata1.srcfile)
-            tknzr2 = tknzr1
-
-            # filenames are different, get the different tokenizer
-            if tokendata2.srcfile != tokendata1.srcfile:
-                srcfile2 = tokendata2.srcfile
-                tknzr2 = self.getTokanizer(srcfile2)
-
-            assert tknzr1.srcfile == tokendata1.srcfile
-            assert tknzr2.srcfile == tokendata2.srcfile
-            sha1 = hashlib.sha1()
-
-            for matchdata1, matchdata2 in zip(tknzr1.get_tokens_frompos(tokendata1.charpos), tknzr2.get_tokens_frompos(tokendata2.charpos)):
-                if matchdata1.value != matchdata2.value:
+        if(self.isTokenMatch(tokenids1[tokenidx1], tokenids2[tokenidx2], 0)):
+            maxlen = min(len(tokenids1) - tokenidx1, len(tokenids2) - tokenidx2)
+            matchlen = 1
+            while matchlen < maxlen:
+                matchlen = self.extendMatch(tokenids1, tokenidx1, tokenids2, tokenidx2, matchlen, maxlen)
+                # different parameter ids match if both are first occurrence in the match.
+                if matchlen < maxlen and self.parameterized and \
+                        self.isTokenMatch(tokenids1[tokenidx1 + matchlen], tokenids2[tokenidx2 + matchlen], matchlen):
+                    matchlen = matchlen + 1
+                else:
                     break
-                sha1.update(matchdata1.value.encode('utf-8'))
-                matchend1 = matchdata1
-                matchend2 = matchdata2
-                matchlen = matchlen + 1
-            sha1_hash = sha1.digest()
+            matchend1 = tokenidx1 + matchlen - 1
+            matchend2 = tokenidx2 + matchlen - 1
+            sha1_hash = self.spanDigest(tokentable1, tokenidx1, matchend1)
 
         return(matchlen, sha1_hash, matchend1, matchend2)
 
-    def getTokanizer(self, srcfile):
+    def isTokenMatch(self, tokenid1, tokenid2, matchlen):
         '''
-        get the tokenizer for the given source file.
+        check if tokens at offset 'matchlen' of the match are same.
         '''
-        tknizer = self.tokenizers.get(srcfile)
-        if tknizer == None:
-            tknizer = tokenizer.Tokenizer(srcfile, fuzzy=self.fuzzy)
-            self.tokenizers[srcfile] = tknizer
+        if tokenid1 == tokenid2:
+            return True
+        return self.parameterized and self.isFirstOccurrence(tokenid1, matchlen) and \
+            self.isFirstOccurrence(tokenid2, matchlen)
 
-        assert tknizer.srcfile == srcfile
-
-        return tknizer
+    def extendMatch(self, tokenids1, tokenidx1, tokenids2, tokenidx2, matchlen, maxlen):
+        '''
+        return the length of match after extending the 'matchlen' tokens of match till the
+        first mismatched token id. Token id arrays are compared in blocks.
+        '''
+        blocklen = MATCH_BLOCK_SIZE
+        while matchlen < maxlen:
+            blocklen = min(blocklen, maxlen - matchlen)
+            start1 = tokenidx1 + matchlen
+            start2 = tokenidx2 + matchlen
+            self.tokenswalked = self.tokenswalked + blocklen
+            if tokenids1[start1:start1 + blocklen] == tokenids2[start2:start2 + blocklen]:
+                matchlen = matchlen + blocklen
+                blocklen = blocklen * 2
+                continue
+            # mismatch is in this block.
+            while blocklen > 1:
+                halflen = blocklen // 2
+                start1 = tokenidx1 + matchlen
+                start2 = tokenidx2 + matchlen
+                self.tokenswalked = self.tokenswalked + halflen
+                if tokenids1[start1:start1 + halflen] == tokenids2[start2:start2 + halflen]:
+                    matchlen = matchlen + halflen
+                    blocklen = blocklen - halflen
+                else:
+                    blocklen = halflen
+            break
+        return matchlen
+
+    def getTokenTable(self, srcfile):
+        '''
+        get the token table for the given source file.
+        '''
+        fileid = self.fileids.get(srcfile)
+        if fileid is None:
+            self.addAllTokens(srcfile)
+            fileid = self.fileids[srcfile]
+        tokentable = self.tokentables[fileid]
+        assert tokentable.srcfile == srcfile
+        return tokentable
 
 if __name__ == '__main__':
     def addtokens(rh, inputval):
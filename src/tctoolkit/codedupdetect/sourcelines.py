@@ -0,0 +1,90 @@
+'''
+sourcelines.py
+Read the source lines of duplicate fragments for reports. Offsets of the lines of a file are
+computed once and the file is memory mapped. Hence fragment source is sliced from the
+mapped file without reading the file from the beginning for every fragment.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+
+from tctoolkit.tctoolkitutil import make_uncpath
+
+MAX_OPEN_FILES = 64  # maximum number of files kept memory mapped
+
+
+class LineIndex(object):
+    '''
+    memory mapped file and start offsets of its lines.
+    '''
+    def __init__(self, srcfile):
+        self.srcfile = srcfile
+        self.fobj = open(make_uncpath(srcfile), 'rb')
+        try:
+            self.data = mmap.mmap(self.fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files cannot be memory mapped
+            self.data = b''
+        self.offsets = array('q', [0])
+        data = self.data
+        pos = data.find(b'\n')
+        while pos >= 0:
+            self.offsets.append(pos + 1)
+            pos = data.find(b'\n', pos + 1)
+        if self.offsets[-1] != len(data):
+            # last line without line end
+            self.offsets.append(len(data))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def getLines(self, startline, count):
+        '''
+        return list of 'count' lines starting from 'startline' (0 based). Line ends are kept.
+        '''
+        endline = min(startline + count, len(self.offsets) - 1)
+        if startline >= endline:
+            return list()
+        text = self.data[self.offsets[startline]:self.offsets[endline]]
+        return text.decode('utf-8', errors='ignore').splitlines(True)
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.fobj.close()
+
+
+class SourceLines(object):
+    '''
+    LRU cache of LineIndex of recently used files. At most 'maxfiles' files are kept open.
+    '''
+    def __init__(self, maxfiles=MAX_OPEN_FILES):
+        self.maxfiles = maxfiles
+        self.indices = OrderedDict()
+        self.lock = threading.Lock()
+
+    def getLines(self, srcfile, startline, count):
+        with self.lock:
+            index = self.indices.pop(srcfile, None)
+            if index is None:
+                index = LineIndex(srcfile)
+                if len(self.indices) >= self.maxfiles:
+                    srcfile0, index0 = self.indices.popitem(last=False)
+                    index0.close()
+            self.indices[srcfile] = index
+            return index.getLines(startline, count)
+
+    def close(self):
+        with self.lock:
+            for index in self.indices.values():
+                index.close()
+            self.indices.clear()
@@ -0,0 +1,254 @@
+'''
+suffixarray.py
+Exact duplicate detection using suffix array and LCP (longest common prefix) array of the
+token ids of all files. Unlike Rabin Karp, the cost does not depend on the size of hash
+buckets. Hence highly repetitive code (e.g. initializer tables, generated getters) does not
+make it quadratic.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+from .rabinkarp import RabinKarp, NUMPY_SUPPORT
+
+if NUMPY_SUPPORT:
+    import numpy
+
+
+def build_suffix_array(tokens):
+    '''
+    return (suffix array, lcp array) of the numpy array of tokens. lcp[i] is the length of
+    common prefix of suffixes sa[i-1] and sa[i]. Suffix array is built by prefix doubling
+    (ranks of substrings of length 2^k are computed from ranks of length 2^(k-1)). LCP is
+    computed with the same ranks by binary lifting. Hence both take O(n log(m)) numpy
+    operations where 'm' is the length of longest repeat. Ranks of all levels are kept for the
+    LCP (as int32 if possible) and each level is released once it is used.
+    '''
+    numtokens = len(tokens)
+    rankdtype = numpy.int32 if numtokens < (1 << 31) else numpy.int64
+    rank = numpy.unique(tokens, return_inverse=True)[1].astype(numpy.int64).reshape(numtokens)
+    ranks = [rank.astype(rankdtype)]
+    width = 1
+    while numtokens > 0 and rank.max() < numtokens - 1:
+        second = numpy.full(numtokens, -1, dtype=numpy.int64)
+        second[:numtokens - width] = rank[width:]
+        order = numpy.lexsort((second, rank))
+        changed = numpy.zeros(numtokens, dtype=numpy.int64)
+        changed[1:] = (rank[order][1:] != rank[order][:-1]) | (second[order][1:] != second[order][:-1])
+        rank = numpy.empty(numtokens, dtype=numpy.int64)
+        rank[order] = numpy.cumsum(changed)
+        ranks.append(rank.astype(rankdtype))
+        width = width * 2
+
+    sa = numpy.argsort(rank, kind='stable')
+    rank = None  # only the ranks kept in 'ranks' are used for the LCP
+    # substrings of length 2^k are unique for the last level. Hence lcp < 2^k
+    ranks.pop()
+    lcp = numpy.zeros(numtokens, dtype=numpy.int64)
+    if numtokens > 1:
+        pos1 = sa[:-1]
+        pos2 = sa[1:]
+        length = numpy.zeros(numtokens - 1, dtype=numpy.int64)
+        while ranks:
+            level = len(ranks) - 1
+            levelrank = ranks.pop()
+            idx1 = pos1 + length
+            idx2 = pos2 + length
+            valid = (idx1 < numtokens) & (idx2 < numtokens)
+            idx1 = numpy.minimum(idx1, numtokens - 1)
+            idx2 = numpy.minimum(idx2, numtokens - 1)
+            length = length + (valid & (levelrank[idx1] == levelrank[idx2])) * (1 << level)
+        lcp[1:] = length
+    return sa, lcp
+
+
+class SuffixArrayDetect(RabinKarp):
+    '''
+    detect the duplicates as maximal repeats of at least 'chunk' tokens in the concatenated
+    token ids of all files. Tokens are added file by file (same as RabinKarp) and the matches
+    are found once all files are added (see findAllMatches).
+    '''
+    def __init__(self, chunk, min_lines, matchstore, fuzzy=False, blameflag=False, tokencache=None,
+                 hashengine='rolling', hashbits=24):
+        assert NUMPY_SUPPORT, "numpy is required for SuffixArrayDetect"
+        super(SuffixArrayDetect, self).__init__(chunk, min_lines, matchstore, fuzzy, blameflag,
+                                                tokencache, hashengine, hashbits)
+        self.numtokens = 0  # total number of tokens in all files
+        self.repeats = 0  # number of maximal repeats found
+
+    def addFingerprint(self, fingerprint):
+        '''
+        add the tokens of the file. Rolling hashes of the fingerprint are not used.
+        '''
+        tokentable = self.addTokenTable(fingerprint)
+        self.numtokens = self.numtokens + len(tokentable)
+
+    def concatTokens(self):
+        '''
+        return (tokens, offsets). Tokens of all files are concatenated with a unique
+        separator after each file. Hence no common prefix crosses the file boundary.
+        '''
+        numvalues = len(self.tokenvalues)
+        tokentables = [self.tokentables[fileid] for fileid in range(len(self.srcfiles))]
+        offsets = numpy.zeros(len(tokentables) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(tokentable) + 1 for tokentable in tokentables])
+        tokens = numpy.empty(offsets[-1], dtype=numpy.int64)
+        for fileid, tokentable in enumerate(tokentables):
+            start = offsets[fileid]
+            end = start + len(tokentable)
+            tokens[start:end] = numpy.frombuffer(tokentable.tokenids, dtype=numpy.int32)
+            tokens[end] = numvalues + fileid
+        return tokens, offsets
+
+    def findAllMatches(self):
+        '''
+        find all maximal repeats and add them to the matchstore.
+        '''
+        tokens, offsets = self.concatTokens()
+        sa, lcp = build_suffix_array(tokens)
+
+        # repeat is maximal on left if all occurrences are not preceded by the same token.
+        # Token before the first token of a file is the separator. Hence it is always different.
+        prevtokens = numpy.empty_like(tokens)
+        prevtokens[0] = -1
+        prevtokens[1:] = tokens[:-1]
+        prevtokens = prevtokens[sa]
+        leftchanges = numpy.zeros(len(tokens), dtype=numpy.int64)
+        leftchanges[1:] = numpy.cumsum(prevtokens[1:] != prevtokens[:-1])
+
+        # only the runs of adjacent suffixes with lcp >= chunk contain repeats.
+        lcp[lcp < self.chunk] = 0
+        candidates = numpy.flatnonzero(lcp).tolist()
+        lcp = lcp.tolist()
+        runstart = 0
+        while runstart < len(candidates):
+            runend = runstart
+            while runend + 1 < len(candidates) and candidates[runend + 1] == candidates[runend] + 1:
+                runend = runend + 1
+            self.findRunMatches(sa, lcp, leftchanges, offsets,
+                                candidates[runstart], candidates[runend])
+            runstart = runend + 1
+
+    def findRunMatches(self, sa, lcp, leftchanges, offsets, first, last):
+        '''
+        enumerate the lcp intervals of suffixes sa[first-1] to sa[last] (bottom up traversal
+        of the suffix tree) and add the left maximal intervals as matches. Each interval keeps
+        only its own suffixes and one representative of each child interval. A child interval
+        is merged into its parent (union-find) if the child is not left maximal or if the left
+        maximal parent has occurrences of its own (e.g. nested intervals of initializer tables).
+        Occurrences are expanded once per merged group at the end. Hence the total work is
+        linear even for periodic token sequences. Each occurrence is reported with the longest
+        match containing it.
+        '''
+        owners = list()  # union-find parent of each interval
+        leftmaximal = list()
+        reps = list()  # representative suffix of each interval
+        children = list()
+        leaves = list()  # (suffix position, match length, interval) of own suffixes
+
+        def newInterval():
+            owners.append(len(owners))
+            leftmaximal.append(False)
+            reps.append(None)
+            children.append(list())
+            return len(owners) - 1
+
+        def addLeaf(node, pos, matchlen):
+            leaves.append((pos, matchlen, node))
+            if reps[node] is None:
+                reps[node] = pos
+
+        def find(node):
+            root = node
+            while owners[root] != root:
+                root = owners[root]
+            while owners[node] != root:
+                nextnode = owners[node]
+                owners[node] = root
+                node = nextnode
+            return root
+
+        def closeInterval(node, matchlen):
+            # merge the child intervals or add their representatives as own suffixes
+            maximalchildren = [child for child in children[node] if leftmaximal[child]]
+            for child in children[node]:
+                if not leftmaximal[child]:
+                    # occurrences of the child interval are occurrences of this repeat
+                    owners[child] = node
+            hasown = reps[node] is not None or len(maximalchildren) < len(children[node])
+            for child in maximalchildren:
+                if leftmaximal[node] and hasown:
+                    owners[child] = node
+                else:
+                    addLeaf(node, reps[child], matchlen)
+            if reps[node] is None:
+                reps[node] = reps[children[node][0]]
+            children[node] = None
+
+        # stack of (lcp, lower bound, interval) of open intervals
+        stack = [(0, first - 1, None)]
+        for idx in range(first, last + 2):
+            leftlcp = lcp[idx - 1] if idx > first else 0
+            curlcp = lcp[idx] if idx <= last else 0
+            leaf = int(sa[idx - 1])
+            if leftlcp >= curlcp:
+                addLeaf(stack[-1][2], leaf, stack[-1][0])
+            lowerbound = idx - 1
+            child = None
+            while curlcp < stack[-1][0]:
+                matchlen, lowerbound, node = stack.pop()
+                if child is not None:
+                    children[node].append(child)
+                # interval is sa[lowerbound] to sa[idx - 1]
+                leftmaximal[node] = leftchanges[idx - 1] != leftchanges[lowerbound]
+                closeInterval(node, matchlen)
+                child = node
+            if curlcp > stack[-1][0]:
+                stack.append((curlcp, lowerbound, newInterval()))
+                if child is not None:
+                    children[stack[-1][2]].append(child)
+            elif child is not None and stack[-1][2] is not None:
+                children[stack[-1][2]].append(child)
+            if leftlcp < curlcp:
+                addLeaf(stack[-1][2], leaf, curlcp)
+
+        groups = dict()
+        for pos, matchlen, node in leaves:
+            root = find(node)
+            if leftmaximal[root]:
+                groups.setdefault(root, list()).append((pos, matchlen))
+        for occurrences in groups.values():
+            self.addRepeat(occurrences, offsets)
+
+    def addRepeat(self, occurrences, offsets):
+        '''
+        add the occurrences (position in the concatenated tokens, match length) of a repeat to
+        the matchstore. Occurrences spanning less than min_lines lines and occurrences
+        overlapping the previous occurrence in the same file are ignored.
+        '''
+        positions = [pos for pos, matchlen in occurrences]
+        fileids = numpy.searchsorted(offsets, positions, side='right') - 1
+        matches = list()
+        for (pos, matchlen), fileid in sorted(zip(occurrences, fileids.tolist())):
+            tokentable = self.tokentables[fileid]
+            startidx = pos - int(offsets[fileid])
+            endidx = startidx + matchlen - 1
+            if tokentable.lines[endidx] - tokentable.lines[startidx] < self.min_lines:
+                continue
+            if matches and matches[-1][0] is tokentable and matches[-1][2] >= startidx:
+                continue
+            matches.append((tokentable, startidx, endidx))
+
+        if len(matches) > 1:
+            self.repeats = self.repeats + 1
+            tokentable1, start1, end1 = matches[0]
+            sha1_hash = tokentable1.spanDigest(start1, end1)
+            for tokentable2, start2, end2 in matches[1:]:
+                matchlen = min(end1 - start1, end2 - start2) + 1
+                self.matchstore.addExactMatch(matchlen, sha1_hash, tokentable1, start1, end1,
+                                              tokentable2, start2, end2)
+                self.curfilematches = self.curfilematches + 1
@@ -19,6 +19,9 @@ from collections import OrderedDict
 
 import pysvn
 
+# change the version whenever format of cached blame data (i.e. list of BlameInfo) changes.
+SVN_BLAME_CACHE_VERSION = 1
+
 class BlameInfo(object):
     '''
     small class to store blame information. Uses slots to reduce 
@@ -33,16 +36,23 @@ class BlameInfo(object):
 class SvnBlameClient(object):
 
     '''
-    Subversion client to query the 'blame' information for a file.
+    Subversion client to query the 'blame' information for a file. If 'diskcache' (DiskCache)
+    is given, blame is persisted with the key (URL, last changed revision). Hence unchanged
+    files are not annotated again on the next run. pysvn client is not thread safe. Use one
+    SvnBlameClient per thread (DiskCache can be shared)
     '''
     MAX_REVISIONS_FOR_BLAME = 50
 
-    def __init__(self, username=None, password=None):
+    def __init__(self, username=None, password=None, diskcache=None):
         self.svnclient = pysvn.Client()
         self.svnclient.exception_style = 1
         self.svnclient.callback_get_login = self.get_login
+        self.username = None
+        self.password = None
         self.set_user_password(username, password)
         self.blame_cache = OrderedDict()  # file name against blame output dictionary
+        self.diskcache = diskcache
+        self.fetched = 0  # number of files annotated by svn server (i.e. not found in cache)
 
     def set_user_password(self, username, password):
         if username != None:
@@ -90,34 +100,58 @@ class SvnBlameClient(object):
         # we just need 'author and revision'.
         return maxauthor[0]
 
+    def blameKey(self, filepath):
+        '''
+        return key of the blame of file in the disk cache. Key is the repository URL and last
+        changed revision. Both are read from working copy without contacting the server.
+        '''
+        path, info = self.svnclient.info2(filepath, recurse=False)[0]
+        return 'blame:svn:v%d:%s:%d' % (SVN_BLAME_CACHE_VERSION, info['URL'],
+                                        info['last_changed_rev'].number)
+
     def getBlame(self, filepath):
         '''
         run the blame command on file. Read the blame for SVN or from cache.
         '''
         if filepath not in self.blame_cache:
-            logging.debug('trying to extract annotations for %s' % filepath)
-
-            revision_start = pysvn.Revision( pysvn.opt_revision_kind.number, 0 )
-            revision_end = pysvn.Revision( pysvn.opt_revision_kind.head )
-
-            #call 'log' and query the last 100 revisions of given file. For large repositories
-            #annotate can put lot of stress on the server. Hence limit it to 100 revisions
-            revlogs = self.svnclient.log(filepath, discover_changed_paths=False, 
-                                         limit=self.MAX_REVISIONS_FOR_BLAME, include_merged_revisions=True,
-                                         revprops = ['revision'])
-
-            revision_start = revlogs[-1].revision
-            revision_end = revlogs[0].revision
-            output = self.svnclient.annotate(filepath,revision_start=revision_start,
-                                             revision_end=revision_end)
-            logging.debug('extracted annotations for %s' % filepath)
-
-            blameout = list()
-
-            for lineno, blamedict in enumerate(output):
-                blameinfo = BlameInfo(blamedict['author'], blamedict['revision'].number)
-                assert lineno == int(blamedict['number'])
-                blameout.append(blameinfo)
+            if self.diskcache is None:
+                blameout = self.annotate(filepath)
+            else:
+                key = self.blameKey(filepath)
+                blameout = self.diskcache.get(key)
+                if blameout is None:
+                    blameout = self.annotate(filepath)
+                    self.diskcache.put(key, blameout)
             self.blame_cache[filepath] = blameout
 
         return self.blame_cache[filepath]
+
+    def annotate(self, filepath):
+        '''
+        query the blame (list of BlameInfo for each line) from SVN server.
+        '''
+        logging.debug('trying to extract annotations for %s' % filepath)
+
+        revision_start = pysvn.Revision( pysvn.opt_revision_kind.number, 0 )
+        revision_end = pysvn.Revision( pysvn.opt_revision_kind.head )
+
+        #call 'log' and query the last 100 revisions of given file. For large repositories
+        #annotate can put lot of stress on the server. Hence limit it to 100 revisions
+        revlogs = self.svnclient.log(filepath, discover_changed_paths=False, 
+                                     limit=self.MAX_REVISIONS_FOR_BLAME, include_merged_revisions=True,
+                                     revprops = ['revision'])
+
+        revision_start = revlogs[-1].revision
+        revision_end = revlogs[0].revision
+        output = self.svnclient.annotate(filepath,revision_start=revision_start,
+                                         revision_end=revision_end)
+        logging.debug('extracted annotations for %s' % filepath)
+
+        blameout = list()
+
+        for lineno, blamedict in enumerate(output):
+            blameinfo = BlameInfo(blamedict['author'], blamedict['revision'].number)
+            assert lineno == int(blamedict['number'])
+            blameout.append(blameinfo)
+        self.fetched = self.fetched + 1
+        return blameout
@@ -0,0 +1,134 @@
+'''
+tokencache.py
+Persistent cache of tokens and rolling hashes of source files. Unchanged files are not
+parsed again with Pygments lexers on the next duplication detection run.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import os
+import hashlib
+
+from tctoolkit.tctoolkitutil import DiskCache, make_uncpath
+from .rabinkarp import compute_fingerprint
+
+# change the version whenever format of cached data (i.e. FileFingerprint) changes.
+TOKEN_CACHE_VERSION = 2
+
+
+def file_digest(srcfile):
+    '''
+    return SHA1 digest of the file contents.
+    '''
+    sha1 = hashlib.sha1()
+    with open(make_uncpath(srcfile), 'rb') as fobj:
+        for block in iter(lambda: fobj.read(1024 * 1024), b''):
+            sha1.update(block)
+    return sha1.digest()
+
+
+def file_info(srcfile):
+    '''
+    return (size, modification time, contents digest) of the file. Taken before the file is
+    parsed. Hence tokens of a file changed while parsing are not cached as valid.
+    '''
+    stat = os.stat(make_uncpath(srcfile))
+    return (stat.st_size, stat.st_mtime_ns, file_digest(srcfile))
+
+
+class TokenCache(object):
+    '''
+    cache of FileFingerprint objects (i.e. tokens and rolling hashes) keyed by file path.
+    Cached entry is valid only if file size and modification time are same or if the file
+    contents digest is same.
+    '''
+
+    def __init__(self, cachedir, maxsize, chunk, fuzzy, hashengine='rolling', hashbits=24):
+        self.diskcache = DiskCache(cachedir, maxsize)
+        self.chunk = chunk
+        self.fuzzy = fuzzy
+        # all hash engines compute same hashes. Hence it is not part of the key.
+        self.hashengine = hashengine
+        self.hashbits = hashbits
+        # rolling hashes depend on the chunk size and fingerprint size. Tokens depend on fuzzy flag
+        self.params = 'v%d:%d:%s:%d' % (TOKEN_CACHE_VERSION, chunk, fuzzy, hashbits)
+        if hashengine is None:
+            # only tokens are cached.
+            self.params = 'v%d:%s:nohash' % (TOKEN_CACHE_VERSION, fuzzy)
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, srcfile):
+        '''
+        return the FileFingerprint for srcfile from the cache. If it is not available, then
+        parse the file and add it to cache.
+        '''
+        fingerprint, fileinfo = load_fingerprint(srcfile, self.chunk, self.fuzzy, self,
+                                                 self.hashengine, self.hashbits)
+        self.update(fingerprint, fileinfo)
+        return fingerprint
+
+    def update(self, fingerprint, fileinfo):
+        '''
+        update the statistics and add the newly computed fingerprint to cache. 'fileinfo' is
+        None if the fingerprint is loaded from the cache (see load_fingerprint).
+        '''
+        if fileinfo is not None:
+            self.misses = self.misses + 1
+            self.put(fingerprint, fileinfo)
+        else:
+            self.hits = self.hits + 1
+
+    def _key(self, srcfile):
+        return '%s:%s' % (self.params, os.path.abspath(srcfile))
+
+    def get(self, srcfile):
+        '''
+        return cached FileFingerprint for srcfile or None if file is not in cache or changed
+        after it was cached.
+        '''
+        key = self._key(srcfile)
+        entry = self.diskcache.get(key)
+        if entry is None:
+            return None
+
+        (size, mtime, digest), fingerprint = entry
+        stat = os.stat(make_uncpath(srcfile))
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            if stat.st_size != size or file_digest(srcfile) != digest:
+                # file is changed.
+                return None
+            # file is 'touched' but contents are same. Update the modification time.
+            self.diskcache.put(key, ((stat.st_size, stat.st_mtime_ns, digest), fingerprint))
+
+        # file path may be different (e.g. relative path) from the path stored in cache.
+        fingerprint.srcfile = srcfile
+        return fingerprint
+
+    def put(self, fingerprint, fileinfo):
+        '''
+        add the fingerprint to cache. 'fileinfo' is file_info() of the file before it was parsed.
+        '''
+        self.diskcache.put(self._key(fingerprint.srcfile), (fileinfo, fingerprint))
+
+
+def load_fingerprint(srcfile, chunk, fuzzy=False, tokencache=None, hashengine='rolling',
+                     hashbits=24):
+    '''
+    return (fingerprint, fileinfo) tuple. Fingerprint is loaded from tokencache (if available)
+    else computed by parsing the file. 'fileinfo' is file_info() taken before parsing the file
+    if the fingerprint is computed with a tokencache, else None. Called in worker processes,
+    hence the new fingerprints are added to the cache by the caller (see TokenCache.update).
+    '''
+    if tokencache is None:
+        return compute_fingerprint(srcfile, chunk, fuzzy, hashengine, hashbits), None
+    fingerprint = tokencache.get(srcfile)
+    if fingerprint is not None:
+        return fingerprint, None
+    fileinfo = file_info(srcfile)
+    return compute_fingerprint(srcfile, chunk, fuzzy, hashengine, hashbits), fileinfo
@@ -19,22 +19,37 @@ from pygments.token import Token
 
 DupToken = namedtuple('DupToken', ['srcfile', 'lineno', 'charpos', 'value'])
 
+# parameterized tokens (fuzzy='param') are encoded as distance to previous occurrence of the
+# same name in the file. Distance 0 means first occurrence.
+PARAM_TOKEN_PREFIX = '#PARAM:'
+
+
+def param_distance(value):
+    '''
+    return distance to previous occurrence for parameterized token value. None for other tokens
+    '''
+    if value.startswith(PARAM_TOKEN_PREFIX):
+        return int(value[len(PARAM_TOKEN_PREFIX):])
+    return None
+
+
 class Tokenizer(SourceCodeTokenizer):
     '''
-    tokenizer for code duplication detection.
+    tokenizer for code duplication detection. 'fuzzy' is False, True (all names and literals
+    are replaced by same value) or 'param' (names and literals are replaced by distance to
+    their previous occurrence, i.e. Baker's parameterized strings). Source code is read
+    from 'srcfile' or given as 'text' (srcfile is then used only to select the lexer).
     '''
 
-    def __init__(self, srcfile, fuzzy=False):
+    def __init__(self, srcfile, fuzzy=False, text=None):
         super(Tokenizer, self).__init__(srcfile)
         self.fuzzy = fuzzy
-        self.pos_dict = dict()
+        self.text = text  # source code text (e.g. code fragment). srcfile is read if None.
 
-    def update_token_list(self):
-        if(self.tokenlist == None):
-            self.tokenlist = list()
-            for idx, token in enumerate(self.get_tokens()):
-                self.tokenlist.append(token)
-                self.pos_dict[token.charpos] = idx
+    def read_source(self):
+        if self.text is not None:
+            return self.text
+        return super(Tokenizer, self).read_source()
 
     def is_fuzzy_token(self, srctoken):
         '''
@@ -57,9 +72,15 @@ class Tokenizer(SourceCodeTokenizer):
                     srctoken.is_type(Token.Comment.Single)
 
         linenum = 1
+        tokenidx = 0
+        lastposition = dict()  # last token index of each parameter name
         for srctoken in self._parse_tokens():
             # print ttype
-            if(self.fuzzy and self.is_fuzzy_token(srctoken)):
+            if self.fuzzy == 'param' and self.is_fuzzy_token(srctoken) and srctoken.value != '':
+                lastpos = lastposition.get(srctoken.value)
+                lastposition[srctoken.value] = tokenidx
+                value = PARAM_TOKEN_PREFIX + str(tokenidx - lastpos if lastpos is not None else 0)
+            elif(self.fuzzy and self.is_fuzzy_token(srctoken)):
                 # we are doing fuzzy matching. Hence replace the names
                 # e.g. variable names by value 'Variable'.
                 value = '#FUZZY#'
@@ -68,11 +89,7 @@ class Tokenizer(SourceCodeTokenizer):
 
             if(value != '' and not is_comment(srctoken)):
                 duptoken = DupToken(self.srcfile, linenum, srctoken.charpos, value)
+                tokenidx = tokenidx + 1
                 yield duptoken
 
             linenum = linenum + srctoken.num_lines
-
-    def get_tokens_frompos(self, fromcharpos):
-        self.update_token_list()
-        idx = self.pos_dict[fromcharpos]
-        return self.tokenlist[idx:]
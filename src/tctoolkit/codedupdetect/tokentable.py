@@ -0,0 +1,160 @@
+'''
+tokentable.py
+Compact storage of tokens for code duplication detection. Token values are interned in one
+global table and tokens of each file are stored in 'array' columns (token id, line number
+and character position). A token is identified by (file id, token index) pair.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+'''
+
+import hashlib
+from array import array
+from collections import OrderedDict
+
+TOKEN_INDEX_BITS = 32
+TOKEN_INDEX_MASK = (1 << TOKEN_INDEX_BITS) - 1
+
+
+def make_tokenref(fileid, tokenidx):
+    '''
+    pack the (file id, token index) pair into a single integer. Hash buckets store millions of
+    such references. Single integer takes much less memory than a tuple.
+    '''
+    return (fileid << TOKEN_INDEX_BITS) | tokenidx
+
+
+def split_tokenref(tokenref):
+    '''
+    return (file id, token index) pair for the packed token reference.
+    '''
+    return tokenref >> TOKEN_INDEX_BITS, tokenref & TOKEN_INDEX_MASK
+
+
+class TokenValues(object):
+    '''
+    global intern table of token values (strings). Each unique token value gets an integer id.
+    '''
+
+    def __init__(self):
+        self.values = list()
+        self.valueids = dict()
+
+    def intern(self, value):
+        '''
+        return the integer id for the token value.
+        '''
+        tokenid = self.valueids.get(value)
+        if tokenid is None:
+            tokenid = len(self.values)
+            self.valueids[value] = tokenid
+            self.values.append(value)
+        return tokenid
+
+    def __getitem__(self, tokenid):
+        return self.values[tokenid]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class TokenTable(object):
+    '''
+    tokens of one source file stored as columns of token id, line number and char position.
+    '''
+    __slots__ = ['fileid', 'srcfile', 'tokenids', 'lines', 'charpos']
+
+    def __init__(self, fileid, srcfile, tokenids=None, lines=None, charpos=None):
+        self.fileid = fileid
+        self.srcfile = srcfile
+        self.tokenids = tokenids if tokenids is not None else array('i')
+        self.lines = lines if lines is not None else array('i')
+        self.charpos = charpos if charpos is not None else array('i')
+
+    @classmethod
+    def fromFingerprint(cls, fileid, fingerprint, tokenvalues):
+        '''
+        create the token table from FileFingerprint. Token ids local to the fingerprint are
+        converted to the global token ids of 'tokenvalues'
+        '''
+        idmap = [tokenvalues.intern(value) for value in fingerprint.values]
+        tokenids = array('i', [idmap[valueid] for valueid in fingerprint.tokenids])
+        return cls(fileid, fingerprint.srcfile, tokenids, fingerprint.lines, fingerprint.charpos)
+
+    def tokenref(self, tokenidx):
+        return make_tokenref(self.fileid, tokenidx)
+
+    def spanDigest(self, startidx, endidx):
+        '''
+        SHA1 digest of the token ids from startidx to endidx (inclusive). Token ids are global.
+        Hence the digest is same for same token sequence in any file.
+        '''
+        return hashlib.sha1(self.tokenids[startidx:endidx + 1].tobytes()).digest()
+
+    def nbytes(self):
+        '''
+        estimated memory used by the token columns in bytes.
+        '''
+        return sum(column.itemsize * len(column) for column in (self.tokenids, self.lines, self.charpos))
+
+    def __len__(self):
+        return len(self.tokenids)
+
+
+class TokenTablePool(object):
+    '''
+    size bounded pool of token tables indexed by file id. Least recently used token tables
+    are evicted when the number of files or the estimated size exceeds the limit. Evicted
+    token tables are loaded again by calling 'loader' (file id -> TokenTable) when required.
+    Limit of 0 means no limit.
+    '''
+
+    def __init__(self, loader, maxfiles=0, maxbytes=0):
+        self.loader = loader
+        self.maxfiles = maxfiles
+        self.maxbytes = maxbytes
+        self.tables = OrderedDict()
+        self.numbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, tokentable):
+        self.tables[tokentable.fileid] = tokentable
+        self.numbytes = self.numbytes + tokentable.nbytes()
+        self.evict()
+
+    def evict(self):
+        '''
+        remove the least recently used token tables till the pool is within limits. Most
+        recently used token table is never removed.
+        '''
+        while len(self.tables) > 1 and \
+                ((self.maxfiles and len(self.tables) > self.maxfiles) or
+                 (self.maxbytes and self.numbytes > self.maxbytes)):
+            fileid, tokentable = self.tables.popitem(last=False)
+            self.numbytes = self.numbytes - tokentable.nbytes()
+            self.evictions = self.evictions + 1
+
+    def discard(self, fileid):
+        '''
+        remove the token table of the file (e.g. file is deleted or changed).
+        '''
+        tokentable = self.tables.pop(fileid, None)
+        if tokentable is not None:
+            self.numbytes = self.numbytes - tokentable.nbytes()
+
+    def __getitem__(self, fileid):
+        tokentable = self.tables.get(fileid)
+        if tokentable is None:
+            self.misses = self.misses + 1
+            tokentable = self.loader(fileid)
+            self.add(tokentable)
+        else:
+            self.hits = self.hits + 1
+            self.tables.move_to_end(fileid)
+        return tokentable
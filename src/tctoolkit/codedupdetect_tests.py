@@ -0,0 +1,884 @@
+'''
+This module is part of Thinking Craftsman Toolkit (TC Toolkit).
+and is released under the New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+
+Purpose: Tests for the code duplication detection algorithms (codedupdetect package)
+'''
+import unittest
+import os
+import re
+import json
+import shutil
+import sqlite3
+import tempfile
+import subprocess
+import sys
+import types
+import threading
+import importlib
+from array import array
+from unittest import mock
+from urllib.request import urlopen, Request
+
+from tctoolkit.codedupdetect import CodeDupDetect
+from tctoolkit.codedupdetect import diskmatchstore
+from tctoolkit.codedupdetect import nearmiss
+from tctoolkit.codedupdetect.rabinkarp import RollingHash, WideRollingHash, VectorRollingHash
+from tctoolkit.codedupdetect.rabinkarp import ParamRollingHash
+from tctoolkit.codedupdetect.rabinkarp import NUMPY_SUPPORT
+from tctoolkit.codedupdetect.rabinkarp import compute_fingerprint
+from tctoolkit.codedupdetect.fingerprint import FileFingerprint
+from tctoolkit.codedupdetect.suffixarray import build_suffix_array
+from tctoolkit.codedupdetect.rabinkarp import RabinKarp, CloneCoverage
+from tctoolkit.codedupdetect.tokentable import TokenTable, TokenValues, split_tokenref
+from tctoolkit.codedupdetect.baselineindex import BaselineIndex, baseline_key
+from tctoolkit.codedupdetect.daemon import DupIndex, DupServer
+from tctoolkit.codedupdetect.matchsink import read_matches
+from tctoolkit.codedupdetect import blame
+from tctoolkit.codedupdetect.blame import GitBlameProvider, parse_porcelain
+from tctoolkit.codedupdetect.sourcelines import LineIndex
+from tctoolkit import cdd
+from tctoolkit.thirdparty.templet import unicodefunction, unicodegenerator
+from tctoolkit.tctoolkitutil import writeChunks
+
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+
+
+def get_test_files():
+    return [os.path.join(TESTDATA_DIR, fname) for fname in ['script_1.py', 'script_2.py']]
+
+
+def make_tempdir(testcase):
+    '''
+    create a temporary directory which is removed when the test case finishes.
+    '''
+    tmpdir = tempfile.mkdtemp(prefix='cdd-test-')
+    testcase.addCleanup(shutil.rmtree, tmpdir)
+    return tmpdir
+
+
+def get_match_report(cdd):
+    '''
+    return the matches as sorted list of (matched lines, sorted list of (file, startline)).
+    Text output of printmatches is not used since order of matches in a matchset depends
+    on the hash values of the file names.
+    '''
+    report = list()
+    for matchset in cdd.findcopies():
+        report.append((matchset.matchedlines,
+                       sorted((m.srcfile(), m.getStartLine(), m.getLineCount()) for m in matchset)))
+    return sorted(report)
+
+
+class TestCodeDupDetect(unittest.TestCase):
+
+    def test_parallel_run_is_same_as_serial_run(self):
+        serial = CodeDupDetect(get_test_files(), 20, min_lines=3)
+        parallel = CodeDupDetect(get_test_files(), 20, min_lines=3, jobs=2)
+        serial_report = get_match_report(serial)
+        self.assertTrue(len(serial_report) > 0)
+        self.assertEqual(serial_report, get_match_report(parallel))
+
+    def test_token_cache_gives_same_results(self):
+        cachedir = make_tempdir(self)
+        report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3))
+        firstrun = CodeDupDetect(get_test_files(), 20, min_lines=3, cachedir=cachedir)
+        self.assertEqual(report, get_match_report(firstrun))
+        self.assertEqual((0, 2), (firstrun.tokencache.hits, firstrun.tokencache.misses))
+
+        secondrun = CodeDupDetect(get_test_files(), 20, min_lines=3, cachedir=cachedir, jobs=2)
+        self.assertEqual(report, get_match_report(secondrun))
+        self.assertEqual((2, 0), (secondrun.tokencache.hits, secondrun.tokencache.misses))
+
+    def test_file_changed_while_parsing_is_not_cached(self):
+        tmpdir = make_tempdir(self)
+        filelist = list()
+        for srcfile in get_test_files():
+            filelist.append(os.path.join(tmpdir, os.path.basename(srcfile)))
+            shutil.copy(srcfile, filelist[-1])
+        cachedir = os.path.join(tmpdir, 'cache')
+
+        def parse_and_change(srcfile, *args):
+            fingerprint = compute_fingerprint(srcfile, *args)
+            if srcfile == filelist[1]:
+                with open(srcfile, 'a') as changed:
+                    changed.write('changed = True\n')
+            return fingerprint
+        with mock.patch('tctoolkit.codedupdetect.tokencache.compute_fingerprint', side_effect=parse_and_change):
+            get_match_report(CodeDupDetect(filelist, 20, min_lines=3, cachedir=cachedir))
+        # tokens of the changed file are cached with the file info before parsing
+        secondrun = CodeDupDetect(filelist, 20, min_lines=3, cachedir=cachedir)
+        report = get_match_report(secondrun)
+        self.assertEqual((1, 1), (secondrun.tokencache.hits, secondrun.tokencache.misses))
+        self.assertEqual(report, get_match_report(CodeDupDetect(filelist, 20, min_lines=3)))
+
+    def test_low_memory_mode_gives_same_results(self):
+        report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3))
+        lowmemory = CodeDupDetect(get_test_files(), 20, min_lines=3, lowmemory=True)
+        self.assertEqual(report, get_match_report(lowmemory))
+        self.assertTrue(lowmemory.matchstore.prunedhashes > len(lowmemory.matchstore.hashset))
+
+    def test_token_table_pool_gives_same_results(self):
+        unpooled = CodeDupDetect(get_test_files(), 20, min_lines=3)
+        report = get_match_report(unpooled)
+        pool = unpooled.tokentablepool
+        self.assertEqual((0, 0), (pool.misses, pool.evictions))
+        lookups = pool.hits
+        # pool of one token table (by files or by size) reloads the evicted token tables.
+        for limits in (dict(poolfiles=1), dict(poolsize=1)):
+            pooled = CodeDupDetect(get_test_files(), 20, min_lines=3, **limits)
+            self.assertEqual(report, get_match_report(pooled))
+            pool = pooled.tokentablepool
+            self.assertEqual((2, 3), (pool.misses, pool.evictions))
+            self.assertEqual(lookups, pool.hits + pool.misses)
+            self.assertEqual(1, len(pool.tables))
+
+    def test_disk_match_store_gives_same_results(self):
+        report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3))
+        # use small runs to test the merging of runs.
+        with mock.patch.object(diskmatchstore, 'RUN_SIZE', 1000):
+            diskstore = CodeDupDetect(get_test_files(), 20, min_lines=3, diskstore=True)
+            self.assertEqual(report, get_match_report(diskstore))
+        self.assertFalse(os.path.exists(diskstore.matchstore.tmpdir))
+
+    def test_larger_thresholds_are_filtered_from_smallest_threshold(self):
+        cdd = CodeDupDetect(get_test_files(), 20, min_lines=3)
+        matches = cdd.filtermatches()
+        self.assertEqual(len(matches), len(list(cdd.findcopies())))
+        filtered = cdd.filtermatches(40, 5)
+        self.assertTrue(len(filtered) < len(matches))
+        self.assertEqual([matchset for matchset in matches
+                          if matchset.matchedtokens >= 40 and matchset.matchedlines >= 5], filtered)
+
+    def test_streamed_matches_are_same_as_final_matches(self):
+        tmpdir = make_tempdir(self)
+        streamfile = os.path.join(tmpdir, 'matches.jsonl')
+        cdd = CodeDupDetect(get_test_files(), 20, min_lines=3, streamfile=streamfile)
+        report = get_match_report(cdd)
+        streamed = sorted((record['lines'], sorted((match['file'], match['startline'], match['lines'])
+                                                   for match in record['matches']))
+                          for record in read_matches(streamfile))
+        self.assertEqual(report, streamed)
+
+    def test_insert_comments_rewrites_each_file_once(self):
+        tmpdirs = [make_tempdir(self) for jobs in (1, 2)]
+        contents = list()
+        for tmpdir, jobs in zip(tmpdirs, (1, 2)):
+            filelist = list()
+            for srcfile in get_test_files():
+                filelist.append(os.path.join(tmpdir, os.path.basename(srcfile)))
+                shutil.copy(srcfile, filelist[-1])
+            cdd = CodeDupDetect(filelist, 20, min_lines=3, jobs=jobs)
+            matchcount = sum(len(matchset) for matchset in cdd.findcopies())
+            cdd.insert_comments(tmpdir)
+            text = list()
+            for srcfile, copy in zip(get_test_files(), filelist):
+                with open(copy) as commented:
+                    lines = commented.readlines()
+                with open(srcfile) as original:
+                    # only the marker lines are inserted.
+                    self.assertEqual(original.read().splitlines(),
+                                     [line.rstrip('\n') for line in lines if not line.startswith('//!DUPLICATE ')])
+                text.append(''.join(lines).replace(tmpdir, ''))
+            self.assertEqual(matchcount, sum(t.count('//!DUPLICATE BEGIN') for t in text))
+            self.assertEqual(matchcount, sum(t.count('//!DUPLICATE END') for t in text))
+            contents.append(text)
+        self.assertEqual(contents[0], contents[1])
+
+    def test_identical_files_are_reported_as_whole_file_match(self):
+        tmpdir = make_tempdir(self)
+        filelist = get_test_files()
+        for i in range(2):
+            copy = os.path.join(tmpdir, 'copy%d.py' % i)
+            shutil.copy(filelist[0], copy)
+            filelist.append(copy)
+        cdd = CodeDupDetect(filelist, 20, min_lines=3, filededup=True)
+        report = get_match_report(cdd)
+        self.assertEqual(filelist[:2], cdd.tokenfiles)
+        # copies are reported only in the whole file match.
+        wholefile = [locations for lines, locations in report
+                     if any(srcfile == filelist[2] for srcfile, startline, linecount in locations)]
+        self.assertEqual(1, len(wholefile))
+        self.assertEqual(sorted([filelist[0], filelist[2], filelist[3]]),
+                         [srcfile for srcfile, startline, linecount in wholefile[0]])
+        # file dedup is off by default. Copies are analyzed and reported in partial matches.
+        cdd = CodeDupDetect(filelist, 20, min_lines=3)
+        report = get_match_report(cdd)
+        self.assertEqual(filelist, cdd.tokenfiles)
+        self.assertTrue(len([locations for lines, locations in report
+                             if any(srcfile == filelist[2] for srcfile, startline, linecount in locations)]) > 1)
+
+    @unittest.skipUnless(NUMPY_SUPPORT, "numpy is not installed")
+    def test_near_miss_copy_is_reported(self):
+        tmpdir = make_tempdir(self)
+        words = 'never argue with idiots they drag you down to their level and beat you'.split()
+        lines = ['def compute(values, scale):']
+        lines += ['    %s = values.get("%s", %d) * scale' % (word, word, i) for i, word in enumerate(words)]
+        lines += ['    return %s' % ' + '.join(words)]
+        copy = lines[:10] + ['    print("changed", scale)'] + lines[10:]
+        filelist = list()
+        for fname, srclines in [('orig.py', lines), ('copy.py', copy)]:
+            filelist.append(os.path.join(tmpdir, fname))
+            with open(filelist[-1], 'w') as srcfile:
+                srcfile.write('\n'.join(srclines) + '\n')
+        exact = CodeDupDetect(filelist, 20, min_lines=3)
+        exact.findcopies()
+        self.assertFalse(any(key[0] == 'nearmiss' for key in exact.matchstore.matchlist
+                             if isinstance(key, tuple)))
+        nearmissdup = CodeDupDetect(filelist, 20, min_lines=3, nearmiss=0.8)
+        nearmissdup.findcopies()
+        matchsets = [matchset for key, matchset in nearmissdup.matchstore.matchlist.items()
+                     if isinstance(key, tuple) and key[0] == 'nearmiss']
+        self.assertEqual(1, len(matchsets))
+        # near-miss match spans the inserted line
+        for match in matchsets[0]:
+            self.assertTrue(match.getStartLine() < 10 and match.getLineCount() >= 12)
+        # signatures are computed in blocks of fragments. Token tables are read from the pool.
+        with mock.patch.object(nearmiss, 'FRAGMENT_BLOCK_SIZE', 2):
+            pooled = CodeDupDetect(filelist, 20, min_lines=3, nearmiss=0.8, poolfiles=1)
+            self.assertEqual(get_match_report(nearmissdup), get_match_report(pooled))
+
+    def test_changed_files_are_searched_in_baseline_index(self):
+        tmpdir = make_tempdir(self)
+        filelist = list()
+        for srcfile in get_test_files():
+            filelist.append(os.path.join(tmpdir, os.path.basename(srcfile)))
+            shutil.copy(srcfile, filelist[-1])
+        indexfile = os.path.join(tmpdir, 'baseline.idx')
+        CodeDupDetect(filelist, 20, min_lines=3).saveIndex(indexfile, tmpdir)
+        # matches involving the changed file in the full run
+        report = [(lines, locations) for lines, locations in
+                  get_match_report(CodeDupDetect(filelist, 20, min_lines=3))
+                  if any(srcfile == filelist[1] for srcfile, startline, linecount in locations)]
+        self.assertTrue(len(report) > 0)
+        changed = CodeDupDetect(filelist[1:], 20, min_lines=3, rootdir=tmpdir,
+                                baseline=BaselineIndex.load(indexfile))
+        self.assertEqual(report, get_match_report(changed))
+        with self.assertRaises(ValueError):
+            CodeDupDetect(filelist[1:], 25, min_lines=3, rootdir=tmpdir,
+                          baseline=BaselineIndex.load(indexfile))
+        # index keys don't depend on hash() of the Python build
+        self.assertEqual((0x123456 << 32) | 7, baseline_key(0x123456, 7))
+        self.assertTrue(0 <= baseline_key((1 << 64) - 1, 0xFFFFFFFF) < (1 << 63))
+
+
+class TestDupIndex(unittest.TestCase):
+
+    def test_index_is_updated_and_queried(self):
+        tmpdir = make_tempdir(self)
+        srcfile = get_test_files()[0]
+        with open(srcfile) as src:
+            fragment = ''.join(src.readlines()[10:40])
+        filelist = [os.path.join(tmpdir, 'script_1.py')]
+        shutil.copy(srcfile, filelist[0])
+        dupindex = DupIndex(lambda: list(filelist), 20, 3)
+        self.assertEqual(dict(added=1, updated=0, removed=0), dupindex.refresh())
+        matches = dupindex.queryFragment(fragment, 'fragment.py')
+        self.assertEqual((filelist[0], 11), (matches[0]['file'], matches[0]['startline']))
+
+        # new file with the fragment. Fragment is found in both files.
+        filelist.append(os.path.join(tmpdir, 'copy.py'))
+        with open(filelist[1], 'w') as copy:
+            copy.write(fragment)
+        self.assertEqual(dict(added=1, updated=0, removed=0), dupindex.refresh())
+        self.assertEqual(set(filelist), set(m['file'] for m in dupindex.queryFragment(fragment, 'x.py')))
+        self.assertEqual([filelist[0]], list(set(m['file'] for m in dupindex.queryFile(filelist[1]))))
+
+        # removed file is not found
+        filelist.pop()
+        self.assertEqual(dict(added=0, updated=0, removed=1), dupindex.refresh())
+        self.assertEqual(set(filelist[:1]), set(m['file'] for m in dupindex.queryFragment(fragment, 'x.py')))
+        self.assertFalse(any(tokenref >> 32 == 1 for tokenrefs in dupindex.matchstore.hashset.values()
+                             for tokenref in tokenrefs))
+
+        server = DupServer(('127.0.0.1', 0), dupindex, interval=60)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%d/fragment' % server.server_address[1]
+            request = Request(url, json.dumps(dict(text=fragment, filename='x.py')).encode('utf-8'))
+            result = json.loads(urlopen(request).read().decode('utf-8'))
+            self.assertEqual(matches, result['matches'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_refresh_errors_and_rebuild(self):
+        tmpdir = make_tempdir(self)
+        srcfile = get_test_files()[0]
+        with open(srcfile) as src:
+            fragment = ''.join(src.readlines()[10:40])
+        filelist = [os.path.join(tmpdir, 'script_1.py'), os.path.join(tmpdir, 'names.py')]
+        shutil.copy(srcfile, filelist[0])
+        with open(filelist[1], 'w') as names:
+            names.write('x = 1\n')
+        dupindex = DupIndex(lambda: list(filelist), 20, 3)
+        loadfingerprint = dupindex.loadFingerprint
+
+        def failing(srcfile):
+            if srcfile == filelist[1]:
+                raise OSError("file deleted")
+            return loadfingerprint(srcfile)
+        # file which can't be read is skipped and added on the next refresh
+        with mock.patch.object(dupindex, 'loadFingerprint', side_effect=failing):
+            self.assertEqual(dict(added=1, updated=0, removed=0), dupindex.refresh())
+        self.assertEqual(dict(added=1, updated=0, removed=0), dupindex.refresh())
+
+        # watcher thread keeps running after errors
+        server = DupServer(('127.0.0.1', 0), dupindex, interval=0.01)
+        try:
+            refreshes = list()
+
+            def refresh():
+                refreshes.append(1)
+                if len(refreshes) == 1:
+                    raise ValueError("refresh failed")
+                server.stopwatch.set()
+                return dict(added=0, updated=0, removed=0)
+            with mock.patch.object(dupindex, 'refresh', side_effect=refresh):
+                server.watchFiles()
+            self.assertEqual(2, len(refreshes))
+        finally:
+            server.server_close()
+
+        # token values of old versions are dropped when the index is rebuilt
+        numvalues = len(dupindex.tokenvalues)
+        with mock.patch('tctoolkit.codedupdetect.daemon.MIN_REBUILD_TOKEN_VALUES', numvalues):
+            with open(filelist[1], 'w') as names:
+                names.writelines('name%d = %d\n' % (i, i) for i in range(numvalues * 2))
+            self.assertEqual(dict(added=0, updated=1, removed=0), dupindex.refresh())
+        self.assertEqual(1, dupindex.status()['rebuilds'])
+        filelist.pop()
+        self.assertEqual(dict(added=0, updated=0, removed=1), dupindex.refresh())
+        self.assertTrue(len(dupindex.tokenvalues) > numvalues)
+        dupindex.rebuild()
+        self.assertTrue(len(dupindex.tokenvalues) < numvalues)
+        matches = dupindex.queryFragment(fragment, 'fragment.py')
+        self.assertEqual((filelist[0], 11), (matches[0]['file'], matches[0]['startline']))
+
+
+def run_cdd(args, cwd=None):
+    '''
+    run the cdd command line with the arguments (in directory 'cwd').
+    '''
+    curdir = os.getcwd()
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        with mock.patch('sys.argv', ['cdd.py', '-p', '*.py'] + args):
+            cdd.RunMain()
+    finally:
+        os.chdir(curdir)
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = make_tempdir(self)
+        self.srcdir = os.path.join(self.tmpdir, 'src')
+        os.mkdir(self.srcdir)
+        for name, srcfile in zip(['a.py', 'c.py'], get_test_files()):
+            shutil.copy(srcfile, os.path.join(self.srcdir, name))
+
+    def test_changed_files_with_relative_source_directory(self):
+        run_cdd(['-m', '20', '--lines', '3', '--save-index', 'baseline.idx', 'src'], cwd=self.tmpdir)
+        # a.py is renamed to b.py and d.py is a new copy of c.py
+        os.rename(os.path.join(self.srcdir, 'a.py'), os.path.join(self.srcdir, 'b.py'))
+        shutil.copy(os.path.join(self.srcdir, 'c.py'), os.path.join(self.srcdir, 'd.py'))
+        with open(os.path.join(self.tmpdir, 'changed.txt'), 'w') as changed:
+            changed.write('a.py\nb.py\nd.py\n')
+        run_cdd(['-m', '20', '--lines', '3', '--baseline', 'baseline.idx', '--changed', 'changed.txt',
+                 '-o', 'report.txt', 'src'], cwd=self.tmpdir)
+        with open(os.path.join(self.tmpdir, 'report.txt')) as report:
+            files = set(os.path.basename(line.rstrip().split(' of ')[-1])
+                        for line in report if line.startswith('Starting at line'))
+        # deleted a.py is not reported
+        self.assertEqual(set(['c.py', 'd.py']), files - set(['b.py']))
+
+    def read_report(self, name):
+        with open(os.path.join(self.tmpdir, name), encoding='utf-8') as report:
+            return report.read()
+
+    def test_sqlite_report(self):
+        os.mkdir(os.path.join(self.srcdir, 'sub'))
+        os.rename(os.path.join(self.srcdir, 'c.py'), os.path.join(self.srcdir, 'sub', 'c.py'))
+        shutil.copy(os.path.join(self.srcdir, 'a.py'), os.path.join(self.srcdir, 'sub', 'd.py'))
+        for report in ['report.db', 'report.txt']:
+            run_cdd(['-m', '20', '--lines', '3', '-o', report, 'src'], cwd=self.tmpdir)
+        text = self.read_report('report.txt')
+        conn = sqlite3.connect(os.path.join(self.tmpdir, 'report.db'))
+        try:
+            def query(sql):
+                return conn.execute(sql).fetchall()
+            self.assertEqual(sorted([('a.py', ''), (os.path.join('sub', 'c.py'), 'sub'),
+                                     (os.path.join('sub', 'd.py'), 'sub')]),
+                             sorted(query("SELECT path, directory FROM files")))
+            self.assertEqual(text.count('\nMatch '), query("SELECT COUNT(*) FROM matchsets")[0][0])
+            self.assertEqual(text.count('\nStarting at line '), query("SELECT COUNT(*) FROM matches")[0][0])
+            # a link for each pair of files in a matchset
+            pairs = query("SELECT DISTINCT m1.file_id, m2.file_id FROM matches m1 JOIN matches m2 "
+                          "ON m1.matchset_id = m2.matchset_id AND m1.rowid < m2.rowid")
+            links = query("SELECT file1_id, file2_id FROM links")
+            self.assertEqual(len(links), len(set(frozenset(pair) for pair in links)))
+            self.assertEqual(set(frozenset(pair) for pair in pairs), set(frozenset(pair) for pair in links))
+            directories = dict((directory, (matchsets, lines)) for directory, matchsets, lines in
+                               query("SELECT * FROM directory_duplication"))
+            self.assertEqual(set(['', 'sub']), set(directories))
+            self.assertEqual(query("SELECT SUM(lines) FROM matches")[0][0],
+                             sum(lines for matchsets, lines in directories.values()))
+            self.assertEqual(query("SELECT COUNT(DISTINCT matchset_id) FROM matches JOIN files "
+                                   "ON files.id = file_id WHERE directory = 'sub'")[0][0],
+                             directories['sub'][0])
+        finally:
+            conn.close()
+
+    def test_sharded_html_report(self):
+        run_cdd(['-m', '20', '--lines', '3', '-f', 'html', '--shard-size', '3', '-o', 'report.html', 'src'],
+                cwd=self.tmpdir)
+        index = self.read_report('report.html')
+        rows = re.findall(r'<a href="report_files/(matches_\d+\.html)#match_(\d+)">Match (\d+)</a>', index)
+        self.assertTrue(len(rows) > 3)
+        numshards = (len(rows) + 2) // 3
+        self.assertIn('%d matches in %d pages' % (len(rows), numshards), index)
+        shardnames = ['matches_%04d.html' % shard for shard in range(numshards)]
+        self.assertEqual(shardnames, sorted(os.listdir(os.path.join(self.tmpdir, 'report_files'))))
+        for i, (shardname, anchor, number) in enumerate(rows):
+            self.assertEqual((shardnames[i // 3], str(i), str(i + 1)), (shardname, anchor, number))
+        for shard, shardname in enumerate(shardnames):
+            page = self.read_report(os.path.join('report_files', shardname))
+            self.assertEqual([str(i) for i in range(shard * 3, min(shard * 3 + 3, len(rows)))],
+                             re.findall(r'<div id="match_(\d+)">', page))
+            self.assertEqual(2, page.count('<a href="../report.html">Index</a>'))
+            links = re.findall(r'<a href="(matches_\d+\.html)">(Previous|Next)</a>', page)
+            expected = list()
+            if shard > 0:
+                expected.append((shardnames[shard - 1], 'Previous'))
+            if shard + 1 < numshards:
+                expected.append((shardnames[shard + 1], 'Next'))
+            self.assertEqual(expected * 2, links)
+
+    def test_html_highlight_cache_and_pool(self):
+        args = ['-m', '20', '--lines', '3', '-f', 'html', '--cache-dir', 'cache']
+        with mock.patch('tctoolkit.cdd.highlight_fragment', wraps=cdd.highlight_fragment) as highlight:
+            run_cdd(args + ['-o', 'miss.html', 'src'], cwd=self.tmpdir)
+            misses = highlight.call_count
+            run_cdd(args + ['-o', 'hit.html', 'src'], cwd=self.tmpdir)
+        self.assertTrue(misses > 0)
+        # all fragments are found in the cache on the second run
+        self.assertEqual(misses, highlight.call_count)
+        run_cdd(['-m', '20', '--lines', '3', '-f', 'html', '-j', '2', '-o', 'pool.html', 'src'], cwd=self.tmpdir)
+        report = self.read_report('miss.html')
+        self.assertEqual(misses, report.count('<div id="match_'))
+        self.assertEqual(report, self.read_report('hit.html'))
+        self.assertEqual(report, self.read_report('pool.html'))
+
+
+class TestGitBlame(unittest.TestCase):
+
+    def test_duplicates_are_attributed_to_commit_author(self):
+        tmpdir = make_tempdir(self)
+        filelist = list()
+        for srcfile in get_test_files():
+            filelist.append(os.path.join(tmpdir, os.path.basename(srcfile)))
+            shutil.copy(srcfile, filelist[-1])
+        git = ['git', '-c', 'user.name=Dup Author', '-c', 'user.email=dup@example.com']
+        try:
+            for command in (['init', '-q'], ['add', '.'], ['commit', '-q', '-m', 'initial']):
+                subprocess.check_output(git + command, cwd=tmpdir, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest("git is not available")
+        cachedir = os.path.join(tmpdir, 'cache')
+        for blamed in (2, 0):
+            provider = GitBlameProvider(jobs=2, cachedir=cachedir)
+            cdd = CodeDupDetect(filelist, 20, min_lines=3, blameprovider=provider)
+            matches = [match for matchset in cdd.findcopies() for match in matchset]
+            self.assertTrue(len(matches) > 0)
+            self.assertEqual(set(['Dup Author']), set(match.getAuthorName() for match in matches))
+            # blame is read from the cache on the second run.
+            self.assertEqual(blamed, provider.blamed)
+
+    def test_fragment_is_attributed_to_author_of_most_lines(self):
+        tmpdir = make_tempdir(self)
+        fragment = ['value%d = compute(%d, "a")\n' % (i, i) for i in range(12)]
+        filelist = [os.path.join(tmpdir, 'orig.py'), os.path.join(tmpdir, 'copy.py')]
+        with open(filelist[0], 'w') as orig:
+            orig.writelines(['def compute(value, name):\n', '    return value\n'] + fragment)
+        # odd lines of the copy are committed by 'First', even lines by 'Second'
+        versions = [[line if i % 2 == 0 else '\n' for i, line in enumerate(fragment)], fragment]
+        try:
+            subprocess.check_output(['git', 'init', '-q'], cwd=tmpdir, stderr=subprocess.STDOUT)
+            for author, version in zip(['First', 'Second'], versions):
+                with open(filelist[1], 'w') as copy:
+                    copy.writelines(version)
+                git = ['git', '-c', 'user.name=%s' % author, '-c', 'user.email=dup@example.com']
+                for command in (['add', '.'], ['commit', '-q', '-m', author]):
+                    subprocess.check_output(git + command, cwd=tmpdir, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest("git is not available")
+        # blame provider is selected for the directory of the files. Six lines of each author
+        # in the copy. Tie is resolved on the first line.
+        cdd = CodeDupDetect(filelist, 20, min_lines=3, blameflag=True)
+        self.assertEqual([(1, 12, 'First')], [(match.startline, match.endline, match.getAuthorName())
+                                              for matchset in cdd.findcopies() for match in matchset
+                                              if match.srcfile() == filelist[1]])
+
+        blamelist = [('A', '1'), ('B', '2'), ('B', '2'), ('C', '3')]
+        self.assertEqual(('A', '1'), blame.fragment_author(blamelist, 1, 2))
+        self.assertEqual(('B', '2'), blame.fragment_author(blamelist, 2, 4))
+        self.assertEqual(('C', '3'), blame.fragment_author(blamelist, 4, 4))
+
+    def test_form_feed_in_blamed_lines(self):
+        first, second = 'a' * 40, 'b' * 40
+        output = '\n'.join([first + ' 1 1 1', 'author First', '\tpage one\x0c\r',
+                            second + ' 2 2 1', 'author Second', '\tpage\x0ctwo\u2028',
+                            first + ' 3 3 1', '\tlast line', ''])
+        self.assertEqual([('First', first[:12]), ('Second', second[:12]), ('First', first[:12])],
+                         parse_porcelain(output))
+
+
+class TestTemplateGenerator(unittest.TestCase):
+
+    @unicodefunction
+    def getRow(self, i):
+        '''<li>$i</li>'''
+
+    @unicodegenerator
+    def getList(self, items):
+        '''<ul>${[self.getRow(i) for i in items]}</ul>'''
+
+    @unicodegenerator
+    def getPage(self, items):
+        '''<html>${self.getList(items)}</html>'''
+
+    def test_chunks_are_written_as_generated(self):
+        rendered = list()
+
+        def items():
+            for i in range(3):
+                rendered.append(i)
+                yield i
+
+        writes = list()
+        output = mock.Mock()
+        # record how many rows were rendered when each chunk is written
+        output.write.side_effect = lambda chunk: writes.append((chunk, len(rendered)))
+        writeChunks(output, self.getPage(items()))
+        self.assertEqual('<html><ul><li>0</li><li>1</li><li>2</li></ul></html>',
+                         ''.join(chunk for chunk, count in writes))
+        self.assertEqual([('<html>', 0), ('<ul>', 0), ('<li>0</li>', 1), ('<li>1</li>', 2),
+                          ('<li>2</li>', 3), ('</ul>', 3), ('</html>', 3)], writes)
+
+
+def create_fake_pysvn(revisions, annotated):
+    '''
+    return a fake pysvn module. 'revisions' is the last changed revision of each file name
+    and the (file name, thread) of each annotate call is added to 'annotated'.
+    '''
+    pysvn = types.ModuleType('pysvn')
+    pysvn.ClientError = type('ClientError', (Exception,), dict())
+    pysvn.opt_revision_kind = mock.Mock()
+    pysvn.Revision = mock.Mock()
+    pysvn.clients = list()  # all created clients
+
+    class Client(object):
+        def __init__(self):
+            self.threads = set()
+            pysvn.clients.append(self)
+
+        def set_default_username(self, username):
+            pass
+
+        def set_default_password(self, password):
+            pass
+
+        def info2(self, filepath, recurse=True):
+            self.threads.add(threading.current_thread().ident)
+            rev = mock.Mock(number=revisions[os.path.basename(filepath)])
+            return [(filepath, {'URL': 'svn://repo/' + os.path.basename(filepath), 'last_changed_rev': rev})]
+
+        def log(self, filepath, **kwargs):
+            return [mock.Mock(revision=mock.Mock(number=number)) for number in (5, 1)]
+
+        def annotate(self, filepath, revision_start, revision_end):
+            self.threads.add(threading.current_thread().ident)
+            annotated.append((os.path.basename(filepath), threading.current_thread().ident))
+            author = 'author_' + os.path.basename(filepath)
+            return [dict(author=author, revision=mock.Mock(number=revisions[os.path.basename(filepath)]),
+                         number=i) for i in range(3)]
+    pysvn.Client = mock.Mock(side_effect=Client)
+    return pysvn
+
+
+class TestSvnBlame(unittest.TestCase):
+
+    def test_blame_is_cached_on_url_and_revision(self):
+        revisions = dict(('file%d.py' % i, 10 + i) for i in range(6))
+        annotated = list()
+        pysvn = create_fake_pysvn(revisions, annotated)
+        tmpdir = make_tempdir(self)
+        # modules imported with the fake pysvn are removed from sys.modules at the end.
+        with mock.patch.dict(sys.modules, {'pysvn': pysvn}):
+            svn_blame = importlib.import_module('tctoolkit.codedupdetect.svn_blame')
+            with mock.patch.object(blame, 'pysvn', pysvn, create=True), \
+                    mock.patch.object(blame, 'SvnBlameClient', svn_blame.SvnBlameClient, create=True):
+                client = svn_blame.SvnBlameClient()
+                self.assertEqual('blame:svn:v1:svn://repo/file2.py:12', client.blameKey('file2.py'))
+
+                srcfiles = [os.path.join(tmpdir, name) for name in sorted(revisions)]
+                cachedir = os.path.join(tmpdir, 'cache')
+                expected = dict((srcfile, [('author_' + os.path.basename(srcfile),
+                                            revisions[os.path.basename(srcfile)])] * 3)
+                                for srcfile in srcfiles)
+                provider = blame.SvnBlameProvider(jobs=3, cachedir=cachedir)
+                self.assertEqual(expected, provider.blameFiles(srcfiles))
+                self.assertEqual(6, provider.blamed)
+                self.assertEqual(sorted(revisions), sorted(name for name, thread in annotated))
+                # each pysvn client is used only by one thread
+                self.assertTrue(all(len(svnclient.threads) == 1 for svnclient in pysvn.clients))
+                self.assertEqual(len(pysvn.clients) - 1, len(set(thread for name, thread in annotated)))
+
+                # unchanged files are read from the disk cache
+                del annotated[:]
+                revisions['file4.py'] = 20
+                expected[srcfiles[4]] = [('author_file4.py', 20)] * 3
+                provider = blame.SvnBlameProvider(jobs=3, cachedir=cachedir)
+                self.assertEqual(expected, provider.blameFiles(srcfiles))
+                self.assertEqual(1, provider.blamed)
+                self.assertEqual(['file4.py'], [name for name, thread in annotated])
+
+
+class TestLineIndex(unittest.TestCase):
+
+    def test_lines_are_same_as_readline(self):
+        tmpdir = make_tempdir(self)
+        srcfile = os.path.join(tmpdir, 'lines.txt')
+        with open(srcfile, 'wb') as fobj:
+            fobj.write(b'first\r\nsecond\n\nfourth')
+        index = LineIndex(srcfile)
+        try:
+            self.assertEqual(4, len(index))
+            self.assertEqual(['second\n', '\n'], index.getLines(1, 2))
+            self.assertEqual(['fourth'], index.getLines(3, 5))
+            self.assertEqual([], index.getLines(4, 1))
+        finally:
+            index.close()
+
+
+class TestTokenTable(unittest.TestCase):
+
+    def test_token_columns_use_global_token_ids(self):
+        tokenvalues = TokenValues()
+        fingerprint1 = compute_fingerprint('a.py', 5, text='x = f(1)\ny = x\n')
+        fingerprint2 = compute_fingerprint('b.py', 5, text='y = x\nx = f(1)\n')
+        table1 = TokenTable.fromFingerprint(0, fingerprint1, tokenvalues)
+        table2 = TokenTable.fromFingerprint(1, fingerprint2, tokenvalues)
+        self.assertEqual(7, len(tokenvalues))
+        self.assertEqual(['x', '=', 'f', '(', '1', ')', 'y', '=', 'x'],
+                         [tokenvalues[tokenid] for tokenid in table1.tokenids])
+        self.assertEqual([1, 1, 1, 1, 1, 1, 2, 2, 2], list(table1.lines))
+        self.assertEqual([0, 2, 4, 5, 6, 7, 9, 11, 13], list(table1.charpos))
+        # same token sequence has same token ids (and digest) in both files
+        self.assertEqual(table1.tokenids[:6], table2.tokenids[3:])
+        self.assertEqual(table1.tokenids[6:], table2.tokenids[:3])
+        self.assertEqual(table1.spanDigest(0, 5), table2.spanDigest(3, 8))
+        self.assertNotEqual(table1.spanDigest(0, 5), table2.spanDigest(2, 7))
+        self.assertEqual((1, 3), split_tokenref(table2.tokenref(3)))
+        self.assertEqual(9, len(table2))
+        self.assertEqual(3 * 9 * table2.tokenids.itemsize, table2.nbytes())
+
+
+class TestFindMatchLength(unittest.TestCase):
+
+    def test_match_length(self):
+        rk = RabinKarp(5, 3, None)
+        common = list(range(100))
+        for prefixlen in [0, 1, 7, 40]:
+            for matchlen in [1, 2, 15, 16, 17, 33, 64, 100]:
+                tokens1 = [200] * prefixlen + common[:matchlen] + [300, 1, 2]
+                tokens2 = common[:matchlen] + [301]
+                table1 = TokenTable(0, 'a', array('i', tokens1))
+                table2 = TokenTable(1, 'b', array('i', tokens2))
+                result = rk.findMatchLength(table1, prefixlen, table2, 0)
+                self.assertEqual((matchlen, prefixlen + matchlen - 1, matchlen - 1),
+                                 (result[0], result[2], result[3]))
+                self.assertEqual(table2.spanDigest(0, matchlen - 1), result[1])
+                # match till the end of token table
+                self.assertEqual(len(tokens2), rk.findMatchLength(table2, 0, table2, 0)[0])
+
+    def test_clone_coverage(self):
+        coverage = CloneCoverage()
+        coverage.add(1, 5, 100, 200)
+        coverage.add(1, 5, 10, 20)
+        self.assertTrue(coverage.isCovered(1, 5, 10))
+        self.assertTrue(coverage.isCovered(1, 5, 150))
+        self.assertTrue(coverage.isCovered(1, 5, 200))
+        self.assertFalse(coverage.isCovered(1, 5, 50))
+        self.assertFalse(coverage.isCovered(1, 5, 201))
+        self.assertFalse(coverage.isCovered(1, 6, 150))
+        self.assertFalse(coverage.isCovered(2, 5, 150))
+
+
+class TestParameterizedMatch(unittest.TestCase):
+
+    def write_sources(self, tmpdir, sources):
+        filelist = list()
+        for fname, source in sources:
+            filelist.append(os.path.join(tmpdir, fname))
+            with open(filelist[-1], 'w') as srcfile:
+                srcfile.write(source)
+        return filelist
+
+    def test_consistently_renamed_copy_is_matched(self):
+        source = '''
+def average(values, weights):
+    total = 0
+    count = 0
+    for value, weight in zip(values, weights):
+        total = total + value * weight
+        count = count + weight
+    print("average", total, count)
+    return total / count
+'''
+        renamed = source.replace('total', 'acc').replace('count', 'num').replace('value', 'item')
+        # 'total' and 'count' are not renamed consistently
+        inconsistent = source.replace('total = total', 'total = count')
+        tmpdir = make_tempdir(self)
+        filelist = self.write_sources(tmpdir, [('orig.py', source), ('renamed.py', renamed),
+                                               ('inconsistent.py', inconsistent)])
+        for hashbits in [24, 64]:
+            self.assertEqual([], get_match_report(CodeDupDetect(filelist[:2], 20, min_lines=3,
+                                                                hashbits=hashbits)))
+            report = get_match_report(CodeDupDetect(filelist, 20, min_lines=3, fuzzy='param',
+                                                    hashbits=hashbits, filededup=False))
+            self.assertEqual(1, len(report))
+            self.assertEqual(sorted(filelist[:2]), [srcfile for srcfile, start, count in report[0][1]])
+            self.assertTrue(report[0][0] >= 7)
+
+    def test_param_hash_is_same_as_rolling_hash_without_parameters(self):
+        values = 'never argue with idiots'.split() * 3
+        for numtokens in range(len(values)):
+            for window_size in [2, 3, 5, 11]:
+                for hashbits, hashengine in [(24, RollingHash), (64, WideRollingHash)]:
+                    fingerprint1 = FileFingerprint('test')
+                    fingerprint2 = FileFingerprint('test')
+                    for i, value in enumerate(values[:numtokens]):
+                        fingerprint1.addToken(value, i, i)
+                        fingerprint2.addToken(value, i, i)
+                    hashengine(window_size).computeHashes(fingerprint1)
+                    ParamRollingHash(window_size, hashbits).computeHashes(fingerprint2)
+                    self.assertEqual(list(fingerprint1.hashlist()), list(fingerprint2.hashlist()))
+
+
+@unittest.skipUnless(NUMPY_SUPPORT, "numpy is not installed")
+class TestVectorRollingHash(unittest.TestCase):
+    '''
+    RollingHash is the reference implementation. VectorRollingHash must compute same hashes.
+    '''
+
+    def get_hashes(self, hashengine, values, window_size):
+        fingerprint = FileFingerprint('test')
+        for i, value in enumerate(values):
+            fingerprint.addToken(value, i, i)
+        hashengine.computeHashes(fingerprint)
+        return list(fingerprint.hashlist())
+
+    def test_short_token_lists(self):
+        values = 'never argue with idiots'.split() * 3
+        for numtokens in range(len(values)):
+            for window_size in [2, 3, 4, 5, 8, 11]:
+                self.assertEqual(self.get_hashes(RollingHash(window_size), values[:numtokens], window_size),
+                                 self.get_hashes(VectorRollingHash(window_size), values[:numtokens], window_size))
+
+    def test_wide_hashes(self):
+        values = 'never argue with idiots'.split() * 3
+        for numtokens in range(len(values)):
+            for window_size in [2, 3, 5, 11]:
+                wide_hashes = self.get_hashes(WideRollingHash(window_size), values[:numtokens], window_size)
+                self.assertEqual(wide_hashes,
+                                 self.get_hashes(VectorRollingHash(window_size, 64), values[:numtokens], window_size))
+                if numtokens > 1:
+                    self.assertTrue(max(thash for pos, thash in wide_hashes) >= 2 ** 31)
+
+    def test_source_files(self):
+        for srcfile in get_test_files():
+            for chunk in [10, 25, 64]:
+                fingerprint1 = compute_fingerprint(srcfile, chunk, hashengine='rolling')
+                fingerprint2 = compute_fingerprint(srcfile, chunk, hashengine='numpy')
+                self.assertEqual(list(fingerprint1.hashlist()), list(fingerprint2.hashlist()))
+
+    def test_same_results_as_rolling_hash(self):
+        report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3))
+        numpy_report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3,
+                                                      hashengine='numpy'))
+        self.assertEqual(report, numpy_report)
+
+    def test_wide_hashes_give_same_results(self):
+        report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3))
+        for hashengine in ['rolling', 'numpy']:
+            wide = CodeDupDetect(get_test_files(), 20, min_lines=3, hashengine=hashengine, hashbits=64)
+            self.assertEqual(report, get_match_report(wide))
+
+
+@unittest.skipUnless(NUMPY_SUPPORT, "numpy is not installed")
+class TestSuffixArray(unittest.TestCase):
+
+    def test_suffix_array(self):
+        import numpy
+        for text in ['banana', 'mississippi', 'aaaaaaaaa', 'abcabcabcx', 'a', 'never argue with idiots']:
+            tokens = numpy.array([ord(ch) for ch in text], dtype=numpy.int64)
+            sa, lcp = build_suffix_array(tokens)
+            suffixes = sorted(range(len(text)), key=lambda i: text[i:])
+            self.assertEqual(suffixes, sa.tolist())
+            for i in range(1, len(text)):
+                suffix1, suffix2 = text[suffixes[i - 1]:], text[suffixes[i]:]
+                length = 0
+                while length < min(len(suffix1), len(suffix2)) and suffix1[length] == suffix2[length]:
+                    length = length + 1
+                self.assertEqual(length, lcp[i])
+
+    def test_all_occurrences_are_reported(self):
+        tmpdir = make_tempdir(self)
+        common = ['value%d = compute(%d, "a")\n' % (i, i) for i in range(15)]
+        tail = ['other%d = call(%d)\n' % (i, i) for i in range(15)]
+        # common fragment in 3 files. Two files also share the lines after the fragment.
+        sources = [common + tail, common + tail, common + ['print(%d)\n' % i for i in range(15)]]
+        filelist = list()
+        for i, source in enumerate(sources):
+            filelist.append(os.path.join(tmpdir, 'copy%d.py' % i))
+            with open(filelist[-1], 'w') as copy:
+                copy.writelines(source)
+        report = get_match_report(CodeDupDetect(filelist, 20, min_lines=3, engine='suffixarray'))
+        self.assertTrue(any(sorted(set(srcfile for srcfile, start, count in locations)) == filelist
+                            for lines, locations in report))
+
+    def test_periodic_table_is_reported_once(self):
+        tmpdir = make_tempdir(self)
+        filelist = list()
+        for i in range(3):
+            filelist.append(os.path.join(tmpdir, 'table%d.c' % i))
+            with open(filelist[-1], 'w') as table:
+                table.write('int table%d[] = {\n' % i + '0, 0, 0, 0,\n' * 600 + '};\n')
+        report = get_match_report(CodeDupDetect(filelist, 20, min_lines=3, engine='suffixarray'))
+        # nested repeats of the table are not reported as separate match sets
+        self.assertTrue(len(report) <= 3)
+        lines, locations = report[-1]
+        self.assertTrue(lines >= 600)
+        self.assertEqual(filelist, [srcfile for srcfile, startline, linecount in locations])
+
+    def test_finds_rabinkarp_matches(self):
+        rk_report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3))
+        sa_report = get_match_report(CodeDupDetect(get_test_files(), 20, min_lines=3,
+                                                   engine='suffixarray'))
+        self.assertTrue(len(sa_report) >= len(rk_report))
+        # occurrences of a repeat are reported with the longest match containing them.
+        sa_locations = [loc for lines, locations in sa_report for loc in locations]
+        for lines, locations in rk_report:
+            for srcfile, startline, linecount in locations:
+                self.assertTrue(any(srcfile == sa_file and sa_start <= startline <= sa_start + sa_count
+                                    for sa_file, sa_start, sa_count in sa_locations))
+
+
+if __name__ == '__main__':
+    unittest.main()
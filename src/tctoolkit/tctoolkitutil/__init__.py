@@ -12,6 +12,7 @@ from .filelist import *
 from .tagcloud import TagCloud
 from .treemapdata import TreemapNode
 from .tcapp import TCApp
+from .diskcache import DiskCache
 from .sourcetokenizer import SourceCodeTokenizer
 from .sourcetokenizer import TagTypeFilter, KeywordFilter, NameFilter
 from .sourcetokenizer import ClassFuncNameFilter, FuncNameFilter, ClassNameFilter
@@ -29,9 +29,7 @@ class BitArray(object):
         '''
         if not (index>=0 and index < self.size):
             raise IndexError
-        byteindex = int(index/8)
-        bitindex = index % 8
-        return (self.bytes[byteindex] & (0x01 << bitindex)) >> bitindex
+        return (self.bytes[index >> 3] >> (index & 0x07)) & 0x01
     
     def __setitem__(self, index, value):
         '''
@@ -39,10 +37,9 @@ class BitArray(object):
         '''
         assert index>=0 and index < self.size
         assert value == 0 or value == 1
-        byteindex = int(index/8)
-        bitindex = index % 8
+        byteindex = index >> 3
         value = 0x01 & value
-        self.bytes[byteindex] = self.bytes[byteindex] | (value << bitindex)
+        self.bytes[byteindex] = self.bytes[byteindex] | (value << (index & 0x07))
     
     def hex(self):
         '''
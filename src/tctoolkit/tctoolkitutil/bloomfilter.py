@@ -19,7 +19,7 @@ from __future__ import absolute_import
 an a Scalable Bloom Filter that grows in size as your add more items to it
 without increasing the false positive error_rate.
 
-Requires the bitarray library: http://pypi.python.org/pypi/bitarray/
+Uses the simple BitArray class from tctoolkitutil.bitarray instead of the bitarray library.
 
     >>> from pybloom import BloomFilter
     >>> f = BloomFilter(capacity=10000, error_rate=0.001)
@@ -54,10 +54,7 @@ import hashlib
 import six
 from struct import unpack, pack, calcsize
 
-try:
-    import bitarray
-except ImportError:
-    raise ImportError('pybloom requires bitarray >= 0.3.4')
+from . import bitarray
 
 __version__ = '2.0'
 __author__  = "Jay Baird <jay.baird@me.com>, Bob Ippolito <bob@redivi.com>,\
@@ -90,6 +87,15 @@ def make_hashfuncs(num_slices, num_bits):
         num_salts += 1
     salts = tuple(hashfn(hashfn(pack('I', i)).digest()) for i in six.moves.range(num_salts))
     def _make_hashfuncs(key):
+        if isinstance(key, six.integer_types):
+            # integer keys (e.g. hash values) are already well distributed. Derive the slice
+            # hashes by double hashing instead of computing the cryptographic hash.
+            key = key & 0xFFFFFFFFFFFFFFFF
+            hash1 = key & 0xFFFFFFFF
+            hash2 = (key >> 32) | 1
+            for i in six.moves.range(num_slices):
+                yield (hash1 + i * hash2) % num_bits
+            return
         if six.PY3:
             if isinstance(key, str):
                 key = key.encode('utf-8')
@@ -171,11 +177,13 @@ class BloomFilter(object):
 
         """
         bits_per_slice = self.bits_per_slice
-        bitarray = self.bitarray
+        # access the bytes of BitArray directly. Method call per bit is slow.
+        bits = self.bitarray.bytes
         hashes = self.make_hashes(key)
         offset = 0
         for k in hashes:
-            if not bitarray[offset + k]:
+            index = offset + k
+            if not (bits[index >> 3] >> (index & 0x07)) & 0x01:
                 return False
             offset += bits_per_slice
         return True
@@ -197,7 +205,7 @@ class BloomFilter(object):
         1
 
         """
-        bitarray = self.bitarray
+        bits = self.bitarray.bytes
         bits_per_slice = self.bits_per_slice
         hashes = self.make_hashes(key)
         found_all_bits = True
@@ -205,9 +213,11 @@ class BloomFilter(object):
             raise IndexError("BloomFilter is at capacity")
         offset = 0
         for k in hashes:
-            if not skip_check and found_all_bits and not bitarray[offset + k]:
+            index = offset + k
+            mask = 0x01 << (index & 0x07)
+            if not skip_check and found_all_bits and not bits[index >> 3] & mask:
                 found_all_bits = False
-            self.bitarray[offset + k] = True
+            bits[index >> 3] |= mask
             offset += bits_per_slice
 
         if skip_check:
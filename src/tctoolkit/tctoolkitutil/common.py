@@ -37,6 +37,15 @@ def FileOrStdout(filename):
         output.close()
 
 
+def writeChunks(output, chunks):
+    '''
+    write the text chunks (e.g. from a template generator) one by one. Unlike 'writelines' of
+    codecs writers, the chunks are not joined in memory first.
+    '''
+    for chunk in chunks:
+        output.write(chunk)
+
+
 @contextmanager
 def TimeIt(fout, prefix=''):
     '''
@@ -0,0 +1,125 @@
+'''
+diskcache.py
+Simple size bounded, persistent cache. Each value is pickled into a separate file in the
+cache directory. Least recently used entries are removed when the total size of the cache
+exceeds the given limit.
+
+Copyright (C) 2009 Nitin Bhide (nitinbhide@gmail.com, nitinbhide@thinkingcraftsman.in)
+
+This module is part of Thinking Craftsman Toolkit (TC Toolkit) and is released under the
+New BSD License: http://www.opensource.org/licenses/bsd-license.php
+TC Toolkit is hosted at https://bitbucket.org/nitinbhide/tctoolkit
+'''
+
+import os
+import logging
+import hashlib
+import pickle
+import tempfile
+
+CACHE_FILE_EXT = '.cache'
+
+
+class DiskCache(object):
+    '''
+    persistent key/value cache stored in a directory. Keys are strings, values are any
+    picklable objects. Modification time of the cache file is used as 'last used' time for
+    LRU eviction.
+    '''
+
+    def __init__(self, cachedir, maxsize=1024 * 1024 * 1024):
+        self.cachedir = os.path.abspath(cachedir)
+        self.maxsize = maxsize  # maximum size of cache directory in bytes
+        self.hits = 0
+        self.misses = 0
+        self.cursize = None
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+
+    def __getstate__(self):
+        # current size is tracked only in the process which adds new values.
+        state = self.__dict__.copy()
+        state['cursize'] = None
+        return state
+
+    def _cachefile(self, key):
+        keyhash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cachedir, keyhash[:2], keyhash + CACHE_FILE_EXT)
+
+    def get(self, key, default=None):
+        '''
+        return the value for the key or 'default' if the key is not in the cache.
+        '''
+        fname = self._cachefile(key)
+        try:
+            with open(fname, 'rb') as cachefile:
+                value = pickle.load(cachefile)
+            # update the modification time so that LRU entry is evicted first.
+            os.utime(fname, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError) as exp:
+            if os.path.exists(fname):
+                logging.warning("ignoring corrupt cache file %s : %s" % (fname, exp))
+            self.misses = self.misses + 1
+            return default
+
+        self.hits = self.hits + 1
+        return value
+
+    def put(self, key, value):
+        '''
+        add/replace the value for the key. Value is written to a temporary file first and
+        then renamed. Hence readers in other processes will never see partially written value.
+        '''
+        fname = self._cachefile(key)
+        dirname = os.path.dirname(fname)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        cursize = self.size()
+        oldsize = os.path.getsize(fname) if os.path.exists(fname) else 0
+
+        fd, tmpname = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as cachefile:
+            pickle.dump(value, cachefile, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, fname)
+
+        self.cursize = cursize + os.path.getsize(fname) - oldsize
+        if self.cursize > self.maxsize:
+            self.evict()
+
+    def size(self):
+        '''
+        current size of the cache directory in bytes.
+        '''
+        if self.cursize is None:
+            self.cursize = sum(os.path.getsize(fname) for fname, mtime in self._entries())
+        return self.cursize
+
+    def evict(self):
+        '''
+        remove least recently used entries till the cache size is reduced to 90% of maxsize.
+        '''
+        targetsize = int(self.maxsize * 0.9)
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.cursize = sum(os.path.getsize(fname) for fname, mtime in entries)
+        for fname, mtime in entries:
+            if self.cursize <= targetsize:
+                break
+            try:
+                fsize = os.path.getsize(fname)
+                os.remove(fname)
+                self.cursize = self.cursize - fsize
+            except OSError as exp:
+                logging.warning("unable to remove cache file %s : %s" % (fname, exp))
+
+    def _entries(self):
+        '''
+        iterator over (filename, modification time) of all cache files.
+        '''
+        for root, dirs, files in os.walk(self.cachedir):
+            for fname in files:
+                if fname.endswith(CACHE_FILE_EXT):
+                    fname = os.path.join(root, fname)
+                    try:
+                        yield fname, os.path.getmtime(fname)
+                    except OSError:
+                        pass
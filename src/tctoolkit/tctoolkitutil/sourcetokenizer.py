@@ -77,17 +77,23 @@ class SourceCodeTokenizer(object):
 
         if pyglexer != None:
             prevtoken = None
-            fname = make_uncpath(self.srcfile)
-            with codecs.open(fname, "rb", encoding='utf-8', errors='ignore') as code:
-                for charpos, ttype, value in pyglexer.get_tokens_unprocessed(code.read()):
-                    # NOTE : do not call 'strip' on the 'value' variable.
-                    # if derived class wants to calculate line numbers, the 'strip' call will screw up
-                    # the line number computation.
-                    srctoken = self.TOKEN_CLASS(ttype, value, charpos)
-                    self.update_type(srctoken, prevtoken)
-                    yield srctoken
-                    if srctoken.value != '':
-                        prevtoken = srctoken
+            for charpos, ttype, value in pyglexer.get_tokens_unprocessed(self.read_source()):
+                # NOTE : do not call 'strip' on the 'value' variable.
+                # if derived class wants to calculate line numbers, the 'strip' call will screw up
+                # the line number computation.
+                srctoken = self.TOKEN_CLASS(ttype, value, charpos)
+                self.update_type(srctoken, prevtoken)
+                yield srctoken
+                if srctoken.value != '':
+                    prevtoken = srctoken
+
+    def read_source(self):
+        '''
+        return the source code text to be parsed.
+        '''
+        fname = make_uncpath(self.srcfile)
+        with codecs.open(fname, "rb", encoding='utf-8', errors='ignore') as code:
+            return code.read()
 
     def ignore_token(self, srctoken):
         return False
@@ -42,6 +42,14 @@ to the 'out' variable directly inside a ${{...}} block, for example:
       }}</td></tr>
       '''
 
+@stringgenerator and @unicodegenerator rewrite the template function into a
+generator which yields the text in chunks instead of returning one string.
+Large documents can then be written chunk by chunk without materializing the
+whole document in memory.  In a generator template, ${[...]} is evaluated
+lazily, values which are themselves generators (e.g. results of other
+generator templates) are expanded in place, and ${{...}} blocks insert text
+with 'yield text' instead of 'out.append(text)'.
+
 Generated code is arranged so that error line numbers are reported as
 accurately as possible.
 
@@ -159,7 +167,7 @@ class _TemplateBuilder(object):
         return '\n'.join(self.code)
 
 
-def _templatefunction(func, listname, stringtype):
+def _templatefunction(func, listname, stringtype, generator=False):
     globals, locals = sys.modules[func.__module__].__dict__, {}
     filename, lineno = func.__code__.co_filename, func.__code__.co_firstlineno
     if func.__doc__ is None:
@@ -175,13 +183,24 @@ def _templatefunction(func, listname, stringtype):
     #args = inspect.getfullargspec(func)
     sig = inspect.signature(func)
     
-    builder = _TemplateBuilder(
-        'def %s%s:' % (func.__name__, str(sig)),
-        '%s = []' % listname,
-        '%s.append(%%s)' % listname,
-        '%s.append(%s(%%s))' % (listname, stringtype),
-        '%s.extend(map(%s, [%%s]))' % (listname, stringtype),
-        'return "".join(%s)' % listname)
+    if generator:
+        # values which are generators (have __next__) are expanded, others are converted to text
+        chunks = '(_c for _v in %%s for _c in (_v if hasattr(_v, "__next__") else (%s(_v),)))' % stringtype
+        builder = _TemplateBuilder(
+            'def %s%s:' % (func.__name__, str(sig)),
+            'pass',
+            'yield %s',
+            'yield from ' + chunks % '((%s),)',
+            'yield from ' + chunks % '(%s)',
+            'yield from ()')
+    else:
+        builder = _TemplateBuilder(
+            'def %s%s:' % (func.__name__, str(sig)),
+            '%s = []' % listname,
+            '%s.append(%%s)' % listname,
+            '%s.append(%s(%%s))' % (listname, stringtype),
+            '%s.extend(map(%s, [%%s]))' % (listname, stringtype),
+            'return "".join(%s)' % listname)
     code_str = builder.build(func.__doc__, filename, lineno, docline)
     code = compile(code_str, filename, 'exec')
     exec(code, globals, locals)
@@ -198,6 +217,16 @@ def unicodefunction(func):
     """Function attribute for unicode template functions"""
     return _templatefunction(func, listname='out', stringtype=six.text_type.__name__)
 
+
+def stringgenerator(func):
+    """Function attribute for string template generators"""
+    return _templatefunction(func, listname='out', stringtype='str', generator=True)
+
+
+def unicodegenerator(func):
+    """Function attribute for unicode template generators"""
+    return _templatefunction(func, listname='out', stringtype=six.text_type.__name__, generator=True)
+
 ##############################################################################
 # When executed as a script, run some testing code.
 if __name__ == '__main__':
@@ -300,6 +329,14 @@ if __name__ == '__main__':
     except SyntaxError as e:
         error_line = re.search('line [0-9]*', str(e)).group(0)
     expect(error_line, 'line 4')
+
+    @stringgenerator
+    def testGenerator(a):
+        "<$a>${[testBasic(x) for x in a]}${testGenerator(a[1:]) if a else ''}"
+    chunks = testGenerator(['David', 'Kevin'])
+    expect(next(chunks), "<")
+    expect("<" + "".join(chunks),
+           "<['David', 'Kevin']>Hello David.Hello Kevin.<['Kevin']>Hello Kevin.<[]>")
     if ok:
         print("OK")
     else: